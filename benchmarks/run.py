@@ -0,0 +1,355 @@
+"""Benchmarks for the map loading, point and tile paths.
+
+Run from the repository root:
+
+    python benchmarks/run.py --roads 1000 20000 --tile_sizes 128 512 --json out.json
+
+Each case is timed `--repeat` times after a warm-up run and reported as latency
+percentiles, throughput and peak memory (Python and NumPy allocations, traced
+with tracemalloc in a separate run). `--compare` prints the change in median
+latency against a previous `--json` output.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import roadster  # noqa: E402
+
+import synthetic  # noqa: E402
+
+PEI = "download/prince-edward-island-latest-free.shp.zip"
+PEI_TILE = ((-63.1647, 46.2779), (-63.0914, 46.2329))
+
+TILE_MODES = [
+    "brute",
+    "edt",
+    "bilinear",
+    "bicubic",
+    "idw",
+    "hierarchical",
+    "kriging",
+    "raster",
+]
+
+
+def measure(fn, repeat: int, count=1):
+    """Latencies of `repeat` calls to `fn` (per item when a call does `count`) and
+    the peak traced memory of one more call."""
+    fn()
+    times = list()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) / count)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    times = np.array(times)
+    return {
+        "count": count,
+        "mean": float(times.mean()),
+        "p50": float(np.percentile(times, 50)),
+        "p90": float(np.percentile(times, 90)),
+        "p99": float(np.percentile(times, 99)),
+        "throughput": float(1.0 / times.mean()),
+        "peak_mb": peak / (1 << 20),
+    }
+
+
+def random_tiles(rng, count: int, low: tuple, high: tuple, size: float):
+    corners = rng.uniform(low, np.subtract(high, size), (count, 2))
+    return [((x, y + size), (x + size, y)) for x, y in corners]
+
+
+def bench_map(name, map_file, road_layer, tile, args, results):
+    """All the cases over one map, `tile` is the (ul, lb) of the tiles to plot."""
+    rng = np.random.default_rng(args.seed)
+    cache_dir = tempfile.mkdtemp()
+
+    def report(case, unit, stats, **params):
+        stats.update(name=f"{name} {case}", unit=unit, params=params)
+        results.append(stats)
+        print(
+            "{:<42} {:>12,.1f}us {:>12,.1f}us {:>12,.1f}us {:>12,.1f} {}/s {:>8.1f}MB".format(
+                stats["name"],
+                stats["p50"] * 1e6,
+                stats["p90"] * 1e6,
+                stats["p99"] * 1e6,
+                stats["throughput"],
+                unit,
+                stats["peak_mb"],
+            ),
+            flush=True,
+        )
+
+    try:
+        report(
+            "load_map (shape file)",
+            "loads",
+            measure(
+                lambda: roadster.data.load_map(map_file, road_layer),
+                max(1, args.repeat // 5),
+            ),
+        )
+        roadster.data.prepare_map(map_file, road_layer, cache_dir=cache_dir)
+        report(
+            "load_map (prepared)",
+            "loads",
+            measure(
+                lambda: roadster.data.load_map(
+                    map_file, road_layer, cache_dir=cache_dir
+                ),
+                args.repeat,
+            ),
+        )
+        mapdata = roadster.data.load_map(map_file, road_layer, cache_dir=cache_dir)
+        coords = mapdata.coords
+        low, high = coords.min(axis=0), coords.max(axis=0)
+        span = float(np.max(high - low))
+
+        tiles = random_tiles(rng, 100, low, high, span / 10)
+        report(
+            "pre_filter",
+            "tiles",
+            measure(
+                lambda: [roadster.data.pre_filter(mapdata, ul, lb) for ul, lb in tiles],
+                args.repeat,
+                len(tiles),
+            ),
+        )
+
+        points = rng.uniform(low, high, (args.points, 2))
+        queries = itertools.cycle(points)
+        report(
+            "point.distance",
+            "points",
+            # one call at a time, the percentiles are over single queries
+            measure(
+                lambda: roadster.point.distance(mapdata, next(queries)),
+                args.repeat * 100,
+            ),
+        )
+        report(
+            "point.distances",
+            "points",
+            measure(
+                lambda: roadster.point.distances(mapdata, points),
+                args.repeat,
+                len(points),
+            ),
+            points=len(points),
+        )
+
+        if "fclass" in mapdata.properties:
+            # all the types in one pass against a pass per type, also with a rare
+            # type (one road in a thousand) that is far from most coordinates
+            labels = mapdata.properties["fclass"]
+            rare = labels.astype(object)
+            rare[::1000] = "rare"
+            typed = {
+                "": mapdata,
+                " rare": roadster.data.MapData(
+                    mapdata.geoms, properties={"fclass": rare.astype(str)}
+                ).build_index(),
+            }
+            class_points = points[: max(1, len(points) // 10)]
+            for case, classed in typed.items():
+                labels = classed.properties["fclass"]
+                subsets = [
+                    classed.subset(np.flatnonzero(labels == label)).build_index()
+                    for label in np.unique(labels)
+                ]
+                report(
+                    f"point.class_distances{case}",
+                    "points",
+                    measure(
+                        lambda: roadster.point.class_distances(classed, class_points),
+                        max(1, args.repeat // 5),
+                        len(class_points),
+                    ),
+                    points=len(class_points),
+                    types=len(subsets),
+                )
+                report(
+                    f"point.distances by type{case}",
+                    "points",
+                    measure(
+                        lambda: [
+                            roadster.point.distances(subset, class_points)
+                            for subset in subsets
+                        ],
+                        max(1, args.repeat // 5),
+                        len(class_points),
+                    ),
+                    points=len(class_points),
+                    types=len(subsets),
+                )
+
+        raster = None
+        if "raster" in args.modes:
+            raster = roadster.raster.build_raster(
+                mapdata,
+                os.path.join(cache_dir, "raster"),
+                span / 2000,
+                bounds=(*low, *high),
+            )
+            report(
+                "raster distances",
+                "points",
+                measure(
+                    lambda: roadster.point.distances(mapdata, points, raster=raster),
+                    args.repeat,
+                    len(points),
+                ),
+                points=len(points),
+            )
+
+        ul, lb = tile
+        for size in args.tile_sizes:
+            for mode in args.modes:
+                # Kriging uses the 100 closest of 1% of the pixels
+                if mode == "kriging" and not 100 <= size < args.max_kriging + 1:
+                    continue
+
+                def plot():
+                    image = roadster.data.create_image(size, size)
+                    roadster.tile.plot(
+                        image, mapdata, mode, ul, lb, boost=args.boost, raster=raster
+                    )
+
+                report(
+                    f"tile.plot {mode} {size}x{size}",
+                    "tiles",
+                    measure(
+                        plot,
+                        max(1, args.repeat // 5) if mode == "kriging" else args.repeat,
+                    ),
+                    mode=mode,
+                    size=size,
+                )
+
+            def roads():
+                image = roadster.data.create_image(size, size)
+                roadster.data.plot_roads(image, mapdata, ul, lb)
+
+            report(
+                f"plot_roads {size}x{size}",
+                "tiles",
+                measure(roads, args.repeat),
+                size=size,
+            )
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as baseline:
+        before = {result["name"]: result for result in json.load(baseline)}
+    print()
+    print("{:<42} {:>14} {:>14} {:>8}".format("case", "before", "after", "change"))
+    for result in results:
+        old = before.get(result["name"])
+        if old is None:
+            continue
+        print(
+            "{:<42} {:>12,.1f}us {:>12,.1f}us {:>+7.1f}%".format(
+                result["name"],
+                old["p50"] * 1e6,
+                result["p50"] * 1e6,
+                (result["p50"] / old["p50"] - 1) * 100,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the roadster paths.")
+    parser.add_argument(
+        "--roads",
+        type=int,
+        nargs="*",
+        help="Sizes of the synthetic maps, in roads.",
+        default=[1000, 20000],
+    )
+    parser.add_argument(
+        "--pei",
+        action=argparse.BooleanOptionalAction,
+        help=f"Also benchmark the Prince Edward Island map ({PEI}), if downloaded.",
+        default=True,
+    )
+    parser.add_argument(
+        "--tile_sizes",
+        type=int,
+        nargs="*",
+        help="Tile sizes, in pixels.",
+        default=[128, 512],
+    )
+    parser.add_argument(
+        "--modes", nargs="*", choices=TILE_MODES, help="Tile modes.", default=TILE_MODES
+    )
+    parser.add_argument(
+        "--max_kriging",
+        type=int,
+        help="Biggest tile for Kriging, its time grows fast with the size.",
+        default=256,
+    )
+    parser.add_argument("--repeat", type=int, help="Timed runs per case.", default=10)
+    parser.add_argument(
+        "--points", type=int, help="Coordinates for point.distances.", default=100000
+    )
+    parser.add_argument("--boost", type=float, help="Tile boost.", default=10.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", type=str, help="Save the results to this file.")
+    parser.add_argument(
+        "--compare", type=str, help="Compare to results saved with --json."
+    )
+    args = parser.parse_args()
+
+    print(
+        "{:<42} {:>14} {:>14} {:>14} {:>19} {:>10}".format(
+            "case", "p50", "p90", "p99", "throughput", "peak"
+        )
+    )
+    results = list()
+    folder = tempfile.mkdtemp()
+    try:
+        for count in args.roads:
+            map_file = synthetic.write_map(
+                os.path.join(folder, f"synthetic-{count}.shp.zip"), count, args.seed
+            )
+            bench_map(
+                f"synthetic-{count}",
+                map_file,
+                1,
+                ((0.4, 0.6), (0.5, 0.5)),
+                args,
+                results,
+            )
+        if args.pei:
+            if os.path.exists(PEI):
+                bench_map("pei", PEI, 11, PEI_TILE, args, results)
+            else:
+                print(f"{PEI} not found, skipping it")
+    finally:
+        shutil.rmtree(folder)
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=1)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
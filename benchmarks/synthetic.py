@@ -0,0 +1,42 @@
+"""Synthetic road networks of controlled size, for the benchmarks."""
+
+import numpy as np
+import shapely.geometry as sg
+
+from tests.shapefiles import write_roads
+
+ROAD_TYPES = ["primary", "secondary", "tertiary", "residential", "service"]
+
+
+def roads(count: int, seed=0, extent=1.0):
+    """`count` random walks of 2 to 7 points over an `extent` degrees square.
+
+    Each step is about half a kilometre (at the equator, for the default extent),
+    so the density grows with `count` the way it does from rural to urban maps.
+    """
+    rng = np.random.default_rng(seed)
+    result = list()
+    for _ in range(count):
+        start = rng.random(2) * extent
+        steps = rng.normal(0, extent / 200, (rng.integers(1, 7), 2))
+        result.append(
+            sg.LineString(np.vstack([start, start + np.cumsum(steps, axis=0)]))
+        )
+    return result
+
+
+def write_map(map_file: str, count: int, seed=0, extent=1.0):
+    """Write `count` roads (see `roads`) to a `.shp.zip` like the Geofabrik ones,
+    with the roads in layer 1, see `tests.shapefiles.write_roads`.
+
+    Roads have `osm_id` and `fclass` properties.
+    """
+    return write_roads(
+        map_file,
+        roads(count, seed, extent),
+        {
+            "osm_id": [1000 + idx for idx in range(count)],
+            "fclass": [ROAD_TYPES[idx % len(ROAD_TYPES)] for idx in range(count)],
+        },
+        crs="EPSG:4326",
+    )
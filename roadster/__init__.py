@@ -1,3 +1,10 @@
 import roadster.data
 import roadster.tile
 import roadster.point
+import roadster.project
+import roadster.cache
+import roadster.pool
+import roadster.jobs
+import roadster.raster
+import roadster.timing
+import roadster.update
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+import roadster.data as data
+
+
+class MapCache:
+    """Process-wide cache of loaded maps, bounded by a memory budget.
+
+    Maps are evicted least-recently-used first once their estimated size goes
+    over `max_bytes`. Concurrent requests for a map being loaded wait for that
+    load instead of loading it again, and road type subsets are taken from an
+    already loaded "all" map of the same layer, when there is one.
+    """
+
+    def __init__(self, max_bytes=2 << 30, loader=data.load_map):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._maps = OrderedDict()
+        self._sizes = dict()
+        self._loading = dict()
+        self._lock = threading.Lock()
+
+    def get(self, map_file: str, road_layer: int = 0, road_type: set = set(["all"])):
+        """The MapData for the given map, layer and road types."""
+        key = (map_file, road_layer, frozenset(road_type))
+        all_key = (map_file, road_layer, frozenset(["all"]))
+        while True:
+            with self._lock:
+                if key in self._maps:
+                    self._maps.move_to_end(key)
+                    self.hits += 1
+                    return self._maps[key]
+                loading = self._loading.get(key)
+                if loading is None:
+                    self.misses += 1
+                    parent = self._maps.get(all_key)
+                    if parent is not None:
+                        self._maps.move_to_end(all_key)
+                    loading = self._loading[key] = threading.Event()
+                    break
+            # somebody else is loading it, if that load fails we try ourselves
+            loading.wait()
+
+        try:
+            if parent is not None and "fclass" in parent.properties:
+                mapdata = parent.select(road_type).build_index()
+            else:
+                mapdata = self.loader(map_file, road_layer, set(road_type))
+            size = mapdata.nbytes
+            with self._lock:
+                self._maps[key] = mapdata
+                self._sizes[key] = size
+                self._evict()
+            return mapdata
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+
+    @property
+    def nbytes(self):
+        """Estimated memory used by the cached maps."""
+        return sum(self._sizes.values())
+
+    def __len__(self):
+        return len(self._maps)
+
+    def drop(self, map_file: str, road_layer: int = 0):
+        """Forget the maps of a layer, e.g., after updating it."""
+        with self._lock:
+            for key in [key for key in self._maps if key[:2] == (map_file, road_layer)]:
+                del self._maps[key]
+                del self._sizes[key]
+
+    def clear(self):
+        with self._lock:
+            self._maps.clear()
+            self._sizes.clear()
+
+    def _evict(self):
+        # the most recent map is kept even if it does not fit
+        while len(self._maps) > 1 and self.nbytes > self.max_bytes:
+            key, _ = self._maps.popitem(last=False)
+            del self._sizes[key]
+            self.evictions += 1
+
+
+class TileCache:
+    """Rendered tiles stored on disk as `root/key/z/x/y.png`.
+
+    The key identifies the map, layer and rendering options (see `key`), the
+    options themselves are kept in `root/key/options.json` (see `describe`).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(map_file: str, road_layer: int, options: dict):
+        """Folder for the tiles of a map layer rendered with the given options."""
+        params = "&".join(f"{name}={options[name]}" for name in sorted(options))
+        digest = hashlib.sha1(params.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(os.path.basename(map_file), str(road_layer), digest)
+
+    def describe(self, key: str, options: dict):
+        """Record the rendering options of the tiles under a key."""
+        path = os.path.join(self.root, key, "options.json")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handle, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(handle, "w") as options_file:
+                json.dump(options, options_file)
+            os.replace(tmp, path)
+
+    def options(self, key: str):
+        """The rendering options recorded with `describe`, None if unknown."""
+        try:
+            with open(os.path.join(self.root, key, "options.json")) as options_file:
+                return json.load(options_file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def etag(image_binary: bytes):
+        return hashlib.sha1(image_binary).hexdigest()
+
+    def path(self, key: str, z: int, x: int, y: int):
+        return os.path.join(self.root, key, str(z), str(x), f"{y}.png")
+
+    def get(self, key: str, z: int, x: int, y: int):
+        """The cached tile bytes, None if it is not cached."""
+        try:
+            with open(self.path(key, z, x, y), "rb") as tile_file:
+                image_binary = tile_file.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return image_binary
+
+    def put(self, key: str, z: int, x: int, y: int, image_binary: bytes):
+        path = self.path(key, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write and rename, readers never see half-written tiles
+        handle, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(handle, "wb") as tile_file:
+            tile_file.write(image_binary)
+        os.replace(tmp, path)
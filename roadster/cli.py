@@ -1,9 +1,17 @@
+import csv
+import os
 import sys
 import argparse
 
+import numpy as np
+
+import roadster.cache as cache
 import roadster.data as data
 import roadster.tile as tile
 import roadster.point as point
+import roadster.pool as pool
+import roadster.raster as raster
+import roadster.update as update
 
 
 def add_base_args(parser: argparse.ArgumentParser):
@@ -36,16 +44,72 @@ def add_base_args(parser: argparse.ArgumentParser):
     )
 
 
-def load_map(args: argparse.Namespace):
-    return data.load_map(args.map, args.road_layer, set([args.road_type]))
+def add_pool_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        help="Compute distances in a pool of this many processes (0 for none, the default).",
+        default=0,
+    )
 
 
-def one_tile():
-    parser = argparse.ArgumentParser(
-        description="Compute the distance-to-closest-road for all pixels in a tile.",
-        add_help=False,
+def add_metres_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--metres",
+        action=argparse.BooleanOptionalAction,
+        help="Distances in metres over the map projected to its UTM zone, instead of degrees (needs pyproj).",
+    )
+
+
+def add_max_distance_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--max_distance",
+        type=float,
+        help="Search roads only this far (in degrees, or metres with --metres), farther distances are reported as this value.",
+        default=None,
+    )
+
+
+def add_raster_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--raster",
+        type=str,
+        help="Folder with a raster built with `roadster-build-raster`, distances inside it are looked up there.",
+        default=None,
+    )
+
+
+def add_class_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--classes",
+        type=str,
+        nargs="*",
+        help="Distance to the closest road of each of these road types (e.g., 'primary secondary'), all computed in one pass, instead of the distance to the closest road. With no types, all the road types of the map.",
+        default=None,
+    )
+    parser.add_argument(
+        "--ids",
+        action=argparse.BooleanOptionalAction,
+        help="With --classes, also the OSM id of the closest road of each type.",
+    )
+
+
+def add_tile_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=data.IMAGE_FORMATS,
+        help="Output format: 8-bit or 16-bit PNG of the boosted distances, or the raw float32 distances (no boost, no roads drawn) as a `.npy` array or a compressed GeoTIFF. By default from the extension, `.npy` and `.tif` are raw.",
+        default=None,
+    )
+    parser.add_argument(
+        "-b",
+        "--boost",
+        type=float,
+        help="Boost to the signal, the distances are multiplied by it and capped at 1.0 (default: 1000.0, or 0.01 with --metres, both saturating at about 100 metres). Try smaller numbers if the image is all white.",
+        default=None,
     )
-    add_base_args(parser)
     parser.add_argument(
         "-z",
         "--zero_roads",
@@ -53,23 +117,30 @@ def one_tile():
         help="Set road distance to zero.",
     )
     parser.add_argument(
-        "-w", "--tile_width", type=int, help="Tile width, in pixels.", required=True
-    )
-    parser.add_argument(
-        "-h", "--tile_height", type=int, help="Tile height, in pixels.", required=True
+        "--line_width",
+        type=int,
+        help="Width of the drawn roads, in pixels (default: 1).",
+        default=1,
     )
     parser.add_argument(
-        "-o",
-        "--output_file",
-        type=str,
-        help="Output file, should include the extension, any of the formats understood by scikit-image.",
-        required=True,
+        "--antialias",
+        action=argparse.BooleanOptionalAction,
+        help="Blend the pixels the roads only partly cover.",
     )
     parser.add_argument(
         "-t",
         "--type",
-        choices=["brute", "kriging"],
-        help="Type of computation of the tile, either brute force (distance computed for each pixel) or ordinary Kriging interpolation. If not specified, brute-force is used for tiles up to 128x128 pixels.",
+        choices=[
+            "brute",
+            "edt",
+            "kriging",
+            "bilinear",
+            "bicubic",
+            "idw",
+            "hierarchical",
+            "raster",
+        ],
+        help="Type of computation of the tile, either brute force (distance computed for each pixel), Euclidean distance transform over the rasterized roads, ordinary Kriging interpolation, bilinear or bicubic upsampling of a coarse grid of exact distances, inverse distance weighting of the samples, coarse-to-fine computation with bounded error or lookup in a precomputed raster (see --raster). If not specified, brute-force is used for tiles up to 128x128 pixels and the distance transform for bigger tiles.",
         default="auto",
     )
     parser.add_argument(
@@ -79,30 +150,243 @@ def one_tile():
         help="Sample points for interpolation, an integer is used as an absolute number, a floating point between 0 and 1 it is used as a percentage (default: 1%).",
         default=0.01,
     )
+    parser.add_argument(
+        "--sampling",
+        choices=["uniform", "adaptive"],
+        help="How to choose the sample points for interpolation, uniformly at random or refining a coarse grid where the distance field bends.",
+        default="uniform",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="Maximum error, in degrees, of the hierarchical computation (default: a pixel diagonal, or a gray level of the output if that is more). Below a pixel diagonal, and without boost, every pixel is computed.",
+        default=None,
+    )
+
+
+def boost_of(args: argparse.Namespace, raw: bool):
+    """The boost of the tile arguments, None for the raw formats."""
+    if raw:
+        return None
+    if args.boost is not None:
+        return args.boost
+    return data.default_boost(args.metres)
+
+
+def open_raster(args: argparse.Namespace):
+    if args.raster is None:
+        return None
+    return raster.Raster.open(args.raster)
+
+
+def start_pool(args: argparse.Namespace, mapdata):
+    if not args.processes:
+        return None
+    if getattr(args, "metres", False):
+        mapdata = mapdata.projected()
+    return pool.DistancePool(args.processes, preload=[mapdata])
+
+
+def class_distances(args: argparse.Namespace, mapdata, coords):
+    """The classes of the arguments, the (N,K) distances to them and, with --ids,
+    the (N,K) OSM ids of the closest roads (-1 for none)."""
+    if "fclass" not in mapdata.properties:
+        raise SystemExit("the map has no road types")
+    classes = args.classes or sorted(set(mapdata.properties["fclass"]))
+    dists, nearest = point.class_distances(
+        mapdata,
+        coords,
+        classes,
+        nearest=True,
+        metres=bool(args.metres),
+        max_distance=args.max_distance,
+    )
+    ids = None
+    if args.ids:
+        if "osm_id" not in mapdata.properties:
+            raise SystemExit("the map has no OSM ids")
+        ids = np.where(nearest >= 0, mapdata.properties["osm_id"][nearest], -1)
+    return classes, dists, ids
+
+
+def source_of(args: argparse.Namespace):
+    """The map file, layer and road type of the arguments, see `update.update_raster`."""
+    return {"map": args.map, "road_layer": args.road_layer, "road_type": args.road_type}
+
+
+def load_map(args: argparse.Namespace):
+    return data.load_map(args.map, args.road_layer, set([args.road_type]))
+
+
+def one_tile():
+    parser = argparse.ArgumentParser(
+        description="Compute the distance-to-closest-road for all pixels in a tile.",
+        add_help=False,
+    )
+    add_base_args(parser)
+    parser.add_argument(
+        "-w", "--tile_width", type=int, help="Tile width, in pixels.", required=True
+    )
+    parser.add_argument(
+        "-h", "--tile_height", type=int, help="Tile height, in pixels.", required=True
+    )
+    parser.add_argument(
+        "-o",
+        "--output_file",
+        type=str,
+        help="Output file, should include the extension, any of the formats understood by scikit-image (8-bit), or `.npy` and `.tif` for the raw distances (see --format).",
+        required=True,
+    )
+    add_tile_args(parser)
+    add_pool_args(parser)
+    add_metres_args(parser)
+    add_max_distance_args(parser)
+    add_raster_args(parser)
     parser.add_argument("wnlat", type=float, help="West North GPS latitude.")
     parser.add_argument("wnlon", type=float, help="West North GPS longitude.")
     parser.add_argument("eslat", type=float, help="East South GPS latitude.")
     parser.add_argument("eslon", type=float, help="East South GPS longitude.")
     args = parser.parse_args()
     mapdata = load_map(args)
+    distance_pool = start_pool(args, mapdata)
+    image_format = args.format or data.format_of(args.output_file)
+    raw = image_format in data.RAW_FORMATS
     image = data.create_image(args.tile_width, args.tile_height)
-    tile.plot(
+    try:
+        tile.plot(
+            image,
+            mapdata,
+            args.type,
+            (args.wnlon, args.wnlat),
+            (args.eslon, args.eslat),
+            verbose=args.verbose,
+            points=args.samples,
+            boost=boost_of(args, raw),
+            pool=distance_pool,
+            sampling=args.sampling,
+            tolerance=args.tolerance,
+            metres=bool(args.metres),
+            raster=open_raster(args),
+            max_distance=args.max_distance,
+        )
+    finally:
+        if distance_pool is not None:
+            distance_pool.close()
+    if not raw:
+        data.plot_roads(
+            image,
+            mapdata,
+            (args.wnlon, args.wnlat),
+            (args.eslon, args.eslat),
+            road_value=0.0 if args.zero_roads else 1.0,
+            width=args.line_width,
+            antialias=bool(args.antialias),
+        )
+    data.save_image(
         image,
-        mapdata,
-        args.type,
+        args.output_file,
+        image_format,
         (args.wnlon, args.wnlat),
         (args.eslon, args.eslat),
-        verbose=args.verbose,
-        points=args.samples,
     )
-    data.plot_roads(
-        image,
-        mapdata,
-        (args.wnlon, args.wnlat),
-        (args.eslon, args.eslat),
-        road_value=0.0 if args.zero_roads else 1.0,
+
+
+def tiles():
+    parser = argparse.ArgumentParser(
+        description="Compute the distance-to-closest-road tiles covering a region.",
+        add_help=False,
+    )
+    add_base_args(parser)
+    parser.add_argument(
+        "-w", "--tile_width", type=int, help="Tile width, in pixels.", default=256
     )
-    data.save_image(image, args.output_file)
+    parser.add_argument(
+        "-h", "--tile_height", type=int, help="Tile height, in pixels.", default=256
+    )
+    parser.add_argument(
+        "-o",
+        "--output_folder",
+        type=str,
+        help="Output folder, tiles are saved as `{x}/{y}.png` in it (`{zoom}/{x}/{y}.png` with --zoom, `.npy` or `.tif` for the raw formats).",
+        required=True,
+    )
+    tiling = parser.add_mutually_exclusive_group(required=True)
+    tiling.add_argument(
+        "--zoom", type=int, help="Web Mercator (slippy map) tiles at this zoom level."
+    )
+    tiling.add_argument(
+        "--tile_degrees",
+        type=float,
+        help="Tiles of this size, in degrees, from the west north corner.",
+    )
+    parser.add_argument(
+        "--bounds",
+        type=float,
+        nargs=4,
+        metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+        help="Region to cover.",
+        required=True,
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        help="Neighbouring tiles are computed together in batches of this many tiles squared (default: 4).",
+        default=4,
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        help="Compute the batches in a pool of this many processes (0 for none, the default).",
+        default=0,
+    )
+    add_tile_args(parser)
+    add_metres_args(parser)
+    add_max_distance_args(parser)
+    add_raster_args(parser)
+    args = parser.parse_args()
+    mapdata = load_map(args)
+    west, south, east, north = args.bounds
+    if args.zoom is not None:
+        planned = tile.xyz_tiles(args.zoom, west, south, east, north)
+        folder = os.path.join(args.output_folder, str(args.zoom))
+    else:
+        planned = tile.grid_tiles((west, north), (east, south), args.tile_degrees)
+        folder = args.output_folder
+    image_format = args.format or "png"
+    raw = image_format in data.RAW_FORMATS
+    extension = {"npy": "npy", "tiff": "tif"}.get(image_format, "png")
+    corners = {key: (ul, lb) for key, ul, lb in planned}
+    done = 0
+    for (x, y), image in tile.plot_many(
+        mapdata,
+        args.type,
+        planned,
+        args.tile_width,
+        args.tile_height,
+        batch=args.batch,
+        processes=args.processes,
+        road_value=None if raw else 0.0 if args.zero_roads else 1.0,
+        line_width=args.line_width,
+        antialias=bool(args.antialias),
+        boost=boost_of(args, raw),
+        points=args.samples,
+        sampling=args.sampling,
+        tolerance=args.tolerance,
+        metres=bool(args.metres),
+        raster=open_raster(args),
+        max_distance=args.max_distance,
+    ):
+        os.makedirs(os.path.join(folder, str(x)), exist_ok=True)
+        data.save_image(
+            image,
+            os.path.join(folder, str(x), f"{y}.{extension}"),
+            image_format,
+            *corners[(x, y)],
+        )
+        done += 1
+        if args.verbose:
+            print(f"Saved {done:,} of {len(planned):,} tiles", file=sys.stderr)
 
 
 def one_coord():
@@ -112,17 +396,350 @@ def one_coord():
     add_base_args(parser)
     parser.add_argument("lat", type=float, help="GPS latitude")
     parser.add_argument("lon", type=float, help="GPS longitude")
+    add_metres_args(parser)
+    add_max_distance_args(parser)
+    add_raster_args(parser)
+    add_class_args(parser)
+
+    args = parser.parse_args()
+    mapdata = load_map(args)
+    if args.classes is not None:
+        classes, dists, ids = class_distances(args, mapdata, [(args.lon, args.lat)])
+        for column, name in enumerate(classes):
+            values = [name, dists[0, column]]
+            if ids is not None:
+                values.append(ids[0, column])
+            print(*values)
+        return
+    print(
+        point.distance(
+            mapdata,
+            (args.lon, args.lat),
+            metres=bool(args.metres),
+            raster=open_raster(args),
+            max_distance=args.max_distance,
+        )
+    )
+
+
+def many_coords():
+    parser = argparse.ArgumentParser(
+        description="Compute the distance-to-closest-road for all GPS coordinates in a file."
+    )
+    add_base_args(parser)
+    parser.add_argument(
+        "-i",
+        "--input_file",
+        type=str,
+        help="Input file, either a CSV file with a header (use `-` for standard input) or a `.npy` file with an array of lat/lon rows.",
+        default="-",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_file",
+        type=str,
+        help="Output file, a CSV file with the input columns plus the distance (use `-` for standard output). If both input and output are `.npy` files, the output is an array of distances.",
+        default="-",
+    )
+    parser.add_argument(
+        "--lat_column", type=str, help="CSV column with the latitude.", default="lat"
+    )
+    parser.add_argument(
+        "--lon_column", type=str, help="CSV column with the longitude.", default="lon"
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk_size",
+        type=int,
+        help="Coordinates read, computed and written at a time.",
+        default=100000,
+    )
+    add_pool_args(parser)
+    add_metres_args(parser)
+    add_max_distance_args(parser)
+    add_raster_args(parser)
+    add_class_args(parser)
+    args = parser.parse_args()
+    if args.classes is not None and (args.raster or args.processes):
+        parser.error("--classes works without --raster and --processes")
+    mapdata = load_map(args)
+    if args.classes is not None:
+        return many_class_coords(args, mapdata)
+    distance_pool = start_pool(args, mapdata)
+    compute = point.distances if distance_pool is None else distance_pool.distances
+    lookup = open_raster(args)
+
+    def distances(mapdata, coords):
+        return compute(
+            mapdata,
+            coords,
+            metres=bool(args.metres),
+            raster=lookup,
+            max_distance=args.max_distance,
+        )
 
+    in_npy = args.input_file.endswith(".npy")
+    if in_npy and args.output_file.endswith(".npy"):
+        try:
+            size = len(np.load(args.input_file, mmap_mode="r"))
+            output = np.lib.format.open_memmap(
+                args.output_file, mode="w+", shape=(size,)
+            )
+            start = 0
+            for coords in data.read_npy_coords(args.input_file, args.chunk_size):
+                output[start : start + len(coords)] = distances(mapdata, coords)
+                start += len(coords)
+                if args.verbose:
+                    print(f"Computed {start:,} distances", file=sys.stderr)
+            output.flush()
+        finally:
+            if distance_pool is not None:
+                distance_pool.close()
+        return
+
+    infile = sys.stdin if args.input_file == "-" else open(args.input_file, newline="")
+    outfile = (
+        sys.stdout
+        if args.output_file == "-"
+        else open(args.output_file, "w", newline="")
+    )
+    writer = csv.writer(outfile)
+    try:
+        if in_npy:
+            writer.writerow([args.lat_column, args.lon_column, "distance"])
+            chunks = (
+                (None, coords[:, ::-1].tolist(), coords)
+                for coords in data.read_npy_coords(args.input_file, args.chunk_size)
+            )
+        else:
+            chunks = data.read_csv_coords(
+                infile, args.chunk_size, args.lat_column, args.lon_column
+            )
+        done = 0
+        for header, rows, coords in chunks:
+            if header is not None and not done:
+                writer.writerow(header + ["distance"])
+            dists = distances(mapdata, coords)
+            writer.writerows(row + [dist] for row, dist in zip(rows, dists))
+            outfile.flush()
+            done += len(rows)
+            if args.verbose:
+                print(f"Computed {done:,} distances", file=sys.stderr)
+    finally:
+        if distance_pool is not None:
+            distance_pool.close()
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+def many_class_coords(args: argparse.Namespace, mapdata):
+    in_npy = args.input_file.endswith(".npy")
+    if in_npy and args.output_file.endswith(".npy"):
+        size = len(np.load(args.input_file, mmap_mode="r"))
+        output = None
+        start = 0
+        for coords in data.read_npy_coords(args.input_file, args.chunk_size):
+            classes, dists, _ = class_distances(args, mapdata, coords)
+            if output is None:
+                output = np.lib.format.open_memmap(
+                    args.output_file, mode="w+", shape=(size, len(classes))
+                )
+            output[start : start + len(coords)] = dists
+            start += len(coords)
+            if args.verbose:
+                print(f"Computed {start:,} distances", file=sys.stderr)
+        if output is not None:
+            output.flush()
+        return
+
+    infile = sys.stdin if args.input_file == "-" else open(args.input_file, newline="")
+    outfile = (
+        sys.stdout
+        if args.output_file == "-"
+        else open(args.output_file, "w", newline="")
+    )
+    writer = csv.writer(outfile)
+    try:
+        if in_npy:
+            chunks = (
+                ([args.lat_column, args.lon_column], coords[:, ::-1].tolist(), coords)
+                for coords in data.read_npy_coords(args.input_file, args.chunk_size)
+            )
+        else:
+            chunks = data.read_csv_coords(
+                infile, args.chunk_size, args.lat_column, args.lon_column
+            )
+        done = 0
+        for header, rows, coords in chunks:
+            classes, dists, ids = class_distances(args, mapdata, coords)
+            if not done:
+                names = [f"distance_{name}" for name in classes]
+                if ids is not None:
+                    names += [f"osm_id_{name}" for name in classes]
+                writer.writerow(header + names)
+            values = dists.tolist()
+            if ids is not None:
+                values = [d + i for d, i in zip(values, ids.tolist())]
+            writer.writerows(row + value for row, value in zip(rows, values))
+            outfile.flush()
+            done += len(rows)
+            if args.verbose:
+                print(f"Computed {done:,} distances", file=sys.stderr)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+def prepare():
+    parser = argparse.ArgumentParser(
+        description="Convert a map layer into flat arrays that load near-instantly."
+    )
+    add_base_args(parser)
+    parser.add_argument(
+        "-c",
+        "--cache_dir",
+        type=str,
+        help="Folder for the prepared maps, by default `prepared` next to the map file. Other commands and the server look for prepared maps in the default folder.",
+        default=None,
+    )
+    add_metres_args(parser)
+    args = parser.parse_args()
+    prepared = data.prepare_map(
+        args.map,
+        args.road_layer,
+        set([args.road_type]),
+        args.cache_dir,
+        metres=bool(args.metres),
+    )
+    if args.verbose:
+        print(f"Prepared map in {prepared}")
+
+
+def update_map():
+    parser = argparse.ArgumentParser(
+        description="Update a prepared map from a new version of its shape file, and the tiles and rasters computed from it."
+    )
+    add_base_args(parser)
+    parser.add_argument(
+        "-c",
+        "--cache_dir",
+        type=str,
+        help="Folder for the prepared maps, by default `prepared` next to the map file.",
+        default=None,
+    )
+    parser.add_argument(
+        "--tiles",
+        type=str,
+        help="Folder of the server tile cache (`ROADSTER_TILE_CACHE`), the tiles the changes can affect are removed.",
+        default=None,
+    )
+    parser.add_argument(
+        "--rasters",
+        type=str,
+        nargs="*",
+        help="Rasters built with `roadster-build-raster` from this map, the nodes the changes can affect are computed again.",
+        default=[],
+    )
+    add_pool_args(parser)
+    args = parser.parse_args()
+    changes = update.update_map(
+        args.map, args.road_layer, set([args.road_type]), args.cache_dir
+    )
+    if changes.everything:
+        print("No previous version to compare with, everything changed")
+    else:
+        print(
+            f"{len(changes.removed):,} roads removed or changed, {len(changes.added):,} added or changed"
+        )
+    if not changes:
+        return
+    if args.tiles is not None:
+        removed = update.invalidate_tiles(
+            cache.TileCache(args.tiles), args.map, args.road_layer, changes
+        )
+        print(f"{removed:,} tiles removed")
+    distance_pool = start_pool(args, changes.new) if args.rasters else None
+    try:
+        for folder in args.rasters:
+            nodes = update.update_raster(
+                folder, changes, pool=distance_pool, verbose=args.verbose
+            )
+            print(f"{nodes:,} nodes computed again in {folder}")
+    finally:
+        if distance_pool is not None:
+            distance_pool.close()
+
+
+def build_raster():
+    parser = argparse.ArgumentParser(
+        description="Precompute the distance-to-closest-road on a grid over a whole map."
+    )
+    add_base_args(parser)
+    parser.add_argument(
+        "-o",
+        "--output_folder",
+        type=str,
+        help="Folder for the raster, a memory-mapped `distance.npy` and its `raster.json` description.",
+        required=True,
+    )
+    parser.add_argument(
+        "--resolution",
+        type=float,
+        help="Distance between grid nodes, in degrees.",
+        required=True,
+    )
+    parser.add_argument(
+        "--bounds",
+        type=float,
+        nargs=4,
+        metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+        help="Extent of the grid, by default the extent of the map.",
+        default=None,
+    )
+    add_pool_args(parser)
+    add_metres_args(parser)
     args = parser.parse_args()
     mapdata = load_map(args)
-    print(point.distance(mapdata, (args.lon, args.lat)))
+    distance_pool = start_pool(args, mapdata)
+    try:
+        built = raster.build_raster(
+            mapdata,
+            args.output_folder,
+            args.resolution,
+            bounds=args.bounds,
+            pool=distance_pool,
+            metres=bool(args.metres),
+            verbose=args.verbose,
+            source=source_of(args),
+        )
+    finally:
+        if distance_pool is not None:
+            distance_pool.close()
+    if args.verbose:
+        height, width = built.values.shape
+        print(f"Raster of {width:,}x{height:,} nodes in {args.output_folder}")
 
 
 def list_layers():
     parser = argparse.ArgumentParser(description="List layers in shape file.")
     add_base_args(parser)
+    parser.add_argument(
+        "--sizes",
+        action=argparse.BooleanOptionalAction,
+        help="Count the features of every layer, with --no-sizes only the names are listed.",
+        default=True,
+    )
     args = parser.parse_args()
-    layers = data.list_layers(args.map)
+    layers = data.list_layers(args.map, args.sizes)
+    if not args.sizes:
+        print("Num.\tLayer")
+        for idx, layer, _ in layers:
+            print(f"{idx}\t{layer}")
+        return
     print("Num.\tLayer\tSize")
     for idx, layer, size in layers:
         print(f"{idx}\t{layer}\t{size}")
@@ -1,4 +1,13 @@
+import csv
+import hashlib
+import io
+import itertools
+import json
+import shutil
+import tempfile
+import weakref
 import fiona
+import shapely
 import shapely.geometry as sg
 import multiprocessing
 import numpy as np
@@ -9,113 +18,827 @@ import sys
 import os.path
 
 from skimage.io import imsave, imread
-from skimage import img_as_ubyte
-from skimage.draw import line as skline
+from skimage import img_as_ubyte, img_as_uint
+import imageio.v3 as iio
+from scipy import ndimage
 
+import roadster.project as project
+import roadster.timing as timing
 
-def load_map(map_file: str, road_layer: int = 0, road_type: set = set(["all"])):
-    """Load the geometry objects in a given layer from a compressed shape file."""
+
+class MapData:
+    """Road geometries together with a spatial index (STRtree) over them.
+
+    Behaves like a read-only list of Shapely geometries, so code written against
+    plain lists of geometries keeps working. A MapData read from a prepared map
+    (see `prepare_map`) keeps the geometries as flat coordinate and offset arrays,
+    memory-mapped from disk, and only builds Shapely objects when needed.
+
+    `properties` maps attribute names (e.g., "fclass") to arrays with one value per
+    geometry. `crs` is the coordinate system of the geometries, None for lon/lat
+    degrees (see `projected`).
+    """
+
+    def __init__(
+        self,
+        geoms=(),
+        ragged=None,
+        segments=None,
+        segment_offsets=None,
+        properties=None,
+        crs=None,
+    ):
+        self.properties = dict(properties or {})
+        self.crs = crs
+        self._geoms = None
+        self._ragged = ragged
+        if ragged is None:
+            self._geoms = np.empty(len(geoms), dtype=object)
+            self._geoms[:] = list(geoms)
+        self._tree = None
+        self._segments = segments
+        self._segment_offsets = segment_offsets
+        self._shared = None
+        self._projected = dict()
+        self._classes = dict()
+        self.folder = None
+
+    @property
+    def geoms(self):
+        """The geometries as a NumPy array of Shapely objects."""
+        if self._geoms is None:
+            self._geoms = shapely.from_ragged_array(*self._ragged)
+        return self._geoms
+
+    @property
+    def ragged(self):
+        """The geometries as (geometry type, coordinates, offsets) flat arrays.
+
+        Raises ValueError for maps mixing geometry types (e.g., points and lines).
+        """
+        if self._ragged is None:
+            self._ragged = shapely.to_ragged_array(self._geoms)
+        return self._ragged
+
+    @property
+    def coords(self):
+        """The flat (N, 2) coordinates of all geometries, in order."""
+        if self._geoms is None:
+            return self._ragged[1]
+        return shapely.get_coordinates(self._geoms)
+
+    def _mixed(self):
+        """Whether the map has no flat arrays, e.g., points together with lines."""
+        if self._ragged is not None:
+            return False
+        try:
+            self.ragged
+        except ValueError:
+            return True
+        return False
+
+    @property
+    def tree(self):
+        """The STRtree over the geometries, built on first use."""
+        if self._tree is None:
+            self._tree = shapely.STRtree(self.geoms)
+        return self._tree
+
+    @property
+    def segments(self):
+        """Flat (4, segments) array with the x0, y0, x1, y1 of every road segment.
+
+        Segments are sorted by geometry, points become zero-length segments and
+        polygons contribute their boundary.
+        """
+        if self._segments is None:
+            self._build_segments()
+        return self._segments
+
+    @property
+    def segment_offsets(self):
+        """The segments of geometry `i` are `segments[:, offsets[i] : offsets[i + 1]]`."""
+        if self._segment_offsets is None:
+            self._build_segments()
+        return self._segment_offsets
+
+    def segments_of(self, indices):
+        """The (4, S) segments of the geometries at the given indices."""
+        indices = np.asarray(indices, dtype=int)
+        offsets = self.segment_offsets
+        return self.segments[:, _ranges(offsets[indices], offsets[indices + 1])]
+
+    def _build_segments(self):
+        geoms = self.geoms.copy()
+        polygons = np.isin(shapely.get_type_id(geoms), [3, 6])
+        geoms[polygons] = shapely.boundary(geoms[polygons])
+        parts, part_geom = shapely.get_parts(geoms, return_index=True)
+        coords, coord_part = shapely.get_coordinates(parts, return_index=True)
+
+        starts = np.flatnonzero(coord_part[1:] == coord_part[:-1])
+        counts = np.bincount(coord_part, minlength=len(parts))
+        singles = np.searchsorted(coord_part, np.flatnonzero(counts == 1))
+        order = np.argsort(np.concatenate([starts, singles]), kind="stable")
+        first = np.concatenate([starts, singles])[order]
+        second = np.concatenate([starts + 1, singles])[order]
+
+        self._segments = np.ascontiguousarray(
+            np.concatenate([coords[first], coords[second]], axis=1).T
+        )
+        seg_geom = part_geom[coord_part[first]]
+        self._segment_offsets = np.searchsorted(
+            seg_geom, np.arange(len(self.geoms) + 1)
+        )
+
+    def build_index(self):
+        """Build the spatial index and the segment arrays now rather than on first query."""
+        self.tree
+        self.segments
+        return self
+
+    def subset(self, indices):
+        """A new MapData with the geometries at the given indices.
+
+        Maps without Shapely objects yet (e.g., prepared or just read) are subset
+        on their flat arrays, without building any.
+        """
+        indices = np.asarray(indices, dtype=int)
+        properties = {name: values[indices] for name, values in self.properties.items()}
+        if self._geoms is None:
+            return MapData(
+                ragged=_ragged_subset(self._ragged, indices),
+                properties=properties,
+                crs=self.crs,
+            )
+        return MapData(self.geoms[indices], properties=properties, crs=self.crs)
+
+    def select(self, road_type: set):
+        """A new MapData with the roads of the given types (fclass), "all" keeps all."""
+        if "all" in road_type:
+            return self
+        if "fclass" not in self.properties:
+            raise ValueError("map has no road types")
+        return self.subset(
+            np.flatnonzero(np.isin(self.properties["fclass"], list(road_type)))
+        )
+
+    def by_class(self, by="fclass"):
+        """The roads grouped by their `by` property, as a dict from each class to
+        the indices of its roads and a MapData with them.
+
+        The groups are built once and kept with the map, like `projected` maps.
+        """
+        if by not in self.properties:
+            raise ValueError(f"map has no {by} property")
+        if by not in self._classes:
+            labels = np.asarray(self.properties[by])
+            classes, class_of = np.unique(labels, return_inverse=True)
+            members = np.split(
+                np.argsort(class_of, kind="stable"),
+                np.cumsum(np.bincount(class_of.ravel(), minlength=len(classes)))[:-1],
+            )
+            self._classes[by] = {
+                label: (indices, self.subset(indices))
+                for label, indices in zip(classes.tolist(), members)
+            }
+        return self._classes[by]
+
+    @property
+    def nbytes(self):
+        """Rough estimate of the memory used by the map, in bytes."""
+        if self._geoms is None:
+            coords = len(self._ragged[1])
+        else:
+            coords = int(shapely.get_num_coordinates(self._geoms).sum())
+        return (
+            coords * 16 * 3  # flat arrays, GEOS copy and index
+            + self.segments.nbytes
+            + self.segment_offsets.nbytes
+            + sum(values.nbytes for values in self.properties.values())
+            + len(self) * 200  # Shapely objects
+            + sum(mapdata.nbytes for mapdata in self._projected.values())
+            + sum(
+                mapdata.nbytes
+                for groups in self._classes.values()
+                for _, mapdata in groups.values()
+            )
+        )
+
+    def projected(self, crs=None):
+        """This map projected to `crs`, by default the UTM zone of its center.
+
+        Distances over the projected map are in metres. The projection is done once
+        and kept with the map, maps opened from a folder (see `open`) keep it in a
+        subfolder too, so later loads only memory-map it.
+        """
+        if crs is None:
+            coords = self.coords
+            if not len(coords):
+                raise ValueError("projection of an empty map")
+            crs = project.utm_crs(*(coords.min(axis=0) + coords.max(axis=0)) / 2)
+        if crs == self.crs:
+            return self
+        if crs not in self._projected:
+            folder = None
+            if self.folder is not None:
+                folder = os.path.join(self.folder, "projected-" + crs.replace(":", "-"))
+            if folder is not None and os.path.exists(os.path.join(folder, "meta.json")):
+                mapdata = MapData.open(folder)
+            elif self._mixed():
+                geoms = shapely.transform(
+                    self.geoms, lambda coords: project.project(coords, crs)
+                )
+                mapdata = MapData(geoms, properties=self.properties, crs=crs)
+            else:
+                geom_type, coords, offsets = self.ragged
+                ragged = (geom_type, project.project(coords, crs), offsets)
+                mapdata = MapData(ragged=ragged, properties=self.properties, crs=crs)
+                if folder is not None:
+                    try:
+                        mapdata.save(folder)
+                        mapdata = MapData.open(folder)
+                    except OSError:
+                        pass  # read-only folder, keep it in memory
+            self._projected[crs] = mapdata.build_index()
+        return self._projected[crs]
+
+    def save(self, folder: str, meta=None):
+        """Save the flat arrays to a folder, replacing any previous content.
+
+        Maps mixing geometry types have no flat arrays, their geometries are saved
+        as WKB instead and read back into Shapely objects by `open`.
+        """
+        arrays = {"segments": self.segments, "segment_offsets": self.segment_offsets}
+        meta = dict(meta or {})
+        if self._mixed():
+            wkb = shapely.to_wkb(self.geoms)
+            lengths = [len(geom) for geom in wkb]
+            arrays["wkb"] = np.frombuffer(b"".join(wkb), dtype=np.uint8)
+            arrays["wkb_offsets"] = np.concatenate([[0], np.cumsum(lengths, dtype=int)])
+            meta["geometry_type"] = None
+            meta["offsets"] = 0
+        else:
+            geom_type, coords, offsets = self.ragged
+            arrays["coords"] = coords
+            for idx, offset in enumerate(offsets):
+                arrays[f"offsets_{idx}"] = offset
+            meta["geometry_type"] = int(geom_type)
+            meta["offsets"] = len(offsets)
+        for name, values in self.properties.items():
+            arrays[f"property_{name}"] = values
+        meta["properties"] = list(self.properties)
+        meta["size"] = len(self)
+        if self.crs is not None:
+            meta["crs"] = self.crs
+
+        parent = os.path.dirname(os.path.abspath(folder))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        with open(os.path.join(tmp, "meta.json"), "w") as meta_file:
+            json.dump(meta, meta_file)
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        os.rename(tmp, folder)
+
+    @classmethod
+    def open(cls, folder: str):
+        """Memory-map a MapData saved with `save`."""
+        with open(os.path.join(folder, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+
+        def load(name):
+            return np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r")
+
+        geoms, ragged = (), None
+        if meta["geometry_type"] is None:
+            wkb, offsets = load("wkb"), load("wkb_offsets")
+            geoms = shapely.from_wkb(
+                [wkb[start:end].tobytes() for start, end in zip(offsets, offsets[1:])]
+            )
+        else:
+            offsets = tuple(load(f"offsets_{idx}") for idx in range(meta["offsets"]))
+            geom_type = shapely.GeometryType(meta["geometry_type"])
+            ragged = (geom_type, load("coords"), offsets)
+        mapdata = cls(
+            geoms,
+            ragged=ragged,
+            segments=load("segments"),
+            segment_offsets=load("segment_offsets"),
+            properties={
+                name: load(f"property_{name}") for name in meta.get("properties", [])
+            },
+            crs=meta.get("crs"),
+        )
+        mapdata.folder = folder
+        return mapdata
+
+    def share(self):
+        """A copy of this MapData backed by memory-mapped files.
+
+        Pickling a memory-mapped MapData only sends its folder, so threads,
+        processes in a pool and separate server workers all map the same physical
+        copy of the flat arrays. Each process still builds its own Shapely objects
+        and STRtree from them, about twice the size of the arrays. In-memory maps
+        are saved to a temporary folder, removed once the returned object is
+        garbage collected.
+        """
+        if self.folder is not None:
+            return self
+        if self._shared is None:
+            tmp = tempfile.mkdtemp(prefix="roadster-")
+            self.save(os.path.join(tmp, "map"))
+            self._shared = MapData.open(os.path.join(tmp, "map"))
+            weakref.finalize(self._shared, shutil.rmtree, tmp, True)
+        return self._shared
+
+    def __len__(self):
+        if self._geoms is None:
+            return (
+                len(self._ragged[2][-1]) - 1
+                if self._ragged[2]
+                else len(self._ragged[1])
+            )
+        return len(self._geoms)
+
+    def __iter__(self):
+        return iter(self.geoms)
+
+    def __getitem__(self, idx):
+        return self.geoms[idx]
+
+    def __getstate__(self):
+        # the index is cheap to rebuild, do not ship it to other processes
+        if self.folder is not None:
+            return {"folder": self.folder}
+        return {"geoms": self.geoms, "properties": self.properties, "crs": self.crs}
+
+    def __setstate__(self, state):
+        if "folder" in state:
+            self.__dict__.update(MapData.open(state["folder"]).__dict__)
+        else:
+            self.__init__(
+                state["geoms"], properties=state["properties"], crs=state.get("crs")
+            )
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray):
+    """Concatenation of `arange(start, end)` for all pairs."""
+    lens = ends - starts
+    shifts = np.repeat(starts - np.cumsum(lens) + lens, lens)
+    return shifts + np.arange(lens.sum())
+
+
+def _ragged_subset(ragged: tuple, indices: np.ndarray):
+    """The (geometry type, coordinates, offsets) of the geometries at the given indices."""
+    geom_type, coords, offsets = ragged
+    new_offsets = list()
+    # offsets go from the coordinates up to the geometries, walk them down
+    for offset in reversed(offsets):
+        starts, ends = offset[indices], offset[indices + 1]
+        new_offsets.append(np.concatenate([[0], np.cumsum(ends - starts)]))
+        indices = _ranges(starts, ends)
+    return geom_type, np.asarray(coords[indices]), tuple(reversed(new_offsets))
+
+
+def as_mapdata(mapdata):
+    """Wrap a list of geometries into a MapData, MapData objects are returned as-is."""
+    if isinstance(mapdata, MapData):
+        return mapdata
+    return MapData(mapdata)
+
+
+def map_path(map_file: str):
+    """The path to the compressed shape file for a map suffix or file name."""
     if map_file.endswith(".shp.zip"):
-        fname = f"zip://{map_file}"
-    else:
-        fname = f"zip://download/{map_file}.shp.zip"
+        return map_file
+    return f"download/{map_file}.shp.zip"
+
+
+def prepared_path(
+    map_file: str, road_layer: int = 0, road_type: set = set(["all"]), cache_dir=None
+):
+    """The folder holding the prepared map, by default `prepared` next to the shape file."""
+    source = map_path(map_file)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(source), "prepared")
+    name = os.path.basename(source)[: -len(".shp.zip")]
+    types = "+".join(sorted(road_type))
+    return os.path.join(cache_dir, f"{name}-{road_layer}-{types}")
+
+
+def _source_stamp(source: str, with_hash=False):
+    stat = os.stat(source)
+    stamp = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(source, "rb") as src:
+            for block in iter(lambda: src.read(1 << 20), b""):
+                digest.update(block)
+        stamp["sha256"] = digest.hexdigest()
+    return stamp
+
+
+def _is_fresh(prepared: str, source: str):
+    """Whether the prepared map was computed from the current source file."""
+    try:
+        with open(os.path.join(prepared, "meta.json")) as meta_file:
+            prepared_stamp = json.load(meta_file)["source"]
+    except (OSError, ValueError, KeyError):
+        return False
+    stamp = _source_stamp(source)
+    if stamp["size"] != prepared_stamp["size"]:
+        return False
+    if stamp["mtime_ns"] == prepared_stamp["mtime_ns"]:
+        return True
+    # same size but touched or copied, compare contents
+    return _source_stamp(source, True)["sha256"] == prepared_stamp["sha256"]
+
+
+def _where(road_types: list):
+    """OGR SQL filter for the features with any of the road types, None for all."""
+    if any("all" in road_type for road_type in road_types):
+        return None
+    labels = sorted(set().union(*road_types))
+    quoted = ", ".join("'{}'".format(label.replace("'", "''")) for label in labels)
+    return f"fclass IN ({quoted})"
+
+
+class _RaggedReader:
+    """Accumulates feature geometries into flat arrays, without Shapely objects.
 
+    Points, lines and multi-lines go straight into coordinate lists, other
+    geometries (e.g., polygons) are kept as Shapely objects.
+    """
+
+    def __init__(self):
+        self.kinds = list()
+        self.points = list()
+        self.line_coords = list()
+        self.part_lengths = list()
+        self.geom_parts = list()
+        self.others = list()
+
+    def add(self, geometry):
+        kind = geometry.type
+        if kind == "Point":
+            self.points.append(geometry.coordinates[:2])
+        elif kind == "LineString":
+            self.line_coords.extend(geometry.coordinates)
+            self.part_lengths.append(len(geometry.coordinates))
+            self.geom_parts.append(1)
+        elif kind == "MultiLineString":
+            for part in geometry.coordinates:
+                self.line_coords.extend(part)
+                self.part_lengths.append(len(part))
+            self.geom_parts.append(len(geometry.coordinates))
+        else:
+            kind = "other"
+            self.others.append(sg.shape(geometry))
+        self.kinds.append(kind)
+
+    def _lines(self):
+        coords = np.array(self.line_coords, dtype=float).reshape(
+            len(self.line_coords), -1
+        )[:, :2]
+        part_offsets = np.concatenate([[0], np.cumsum(self.part_lengths, dtype=int)])
+        if any(parts != 1 for parts in self.geom_parts):
+            geom_offsets = np.concatenate([[0], np.cumsum(self.geom_parts, dtype=int)])
+            return (
+                shapely.GeometryType.MULTILINESTRING,
+                coords,
+                (part_offsets, geom_offsets),
+            )
+        return shapely.GeometryType.LINESTRING, coords, (part_offsets,)
+
+    def mapdata(self, properties):
+        kinds = set(self.kinds)
+        if kinds == {"Point"}:
+            coords = np.array(self.points, dtype=float).reshape(-1, 2)
+            return MapData(
+                ragged=(shapely.GeometryType.POINT, coords, ()), properties=properties
+            )
+        if kinds and kinds <= {"LineString", "MultiLineString"}:
+            return MapData(ragged=self._lines(), properties=properties)
+
+        # mixed geometry types, only then build Shapely objects
+        kinds = np.array(self.kinds, dtype=object)
+        geoms = np.empty(len(kinds), dtype=object)
+        if len(self.points):
+            geoms[kinds == "Point"] = shapely.points(self.points)
+        lines = np.isin(kinds, ["LineString", "MultiLineString"])
+        if lines.any():
+            geoms[lines] = shapely.from_ragged_array(*self._lines())
+        if self.others:
+            geoms[kinds == "other"] = self.others
+        return MapData(geoms, properties=properties)
+
+
+def _as_ids(ids: np.ndarray):
+    """OSM ids as integers, they come as strings in the shape files."""
+    try:
+        return ids.astype(np.int64)
+    except ValueError:
+        return ids
+
+
+def read_maps(
+    map_file: str,
+    road_layer: int = 0,
+    road_types: list = (set(["all"]),),
+    bbox=None,
+):
+    """Read several sets of road types (fclass) of a layer in a single pass.
+
+    Features are streamed from the compressed shape file. The road types and the
+    `bbox` (west, south, east, north) are handed to the OGR driver, so features
+    outside of them are skipped before Python sees them, and coordinates go
+    straight into flat arrays. Returns one MapData per set of road types, with
+    their "fclass" and "osm_id" properties when the layer has them.
+    """
+    fname = f"zip://{map_path(map_file)}"
+    reader = _RaggedReader()
     with fiona.open(fname, layer=road_layer) as src:
+        names = [
+            name for name in ("fclass", "osm_id") if name in src.schema["properties"]
+        ]
+        values = {name: list() for name in names}
+        has_fclass = "fclass" in names
+        where = _where(road_types)
+        # without road types, only "all" selects anything
+        if has_fclass or where is None:
+            for obj in src.filter(bbox=bbox, where=where):
+                if obj.geometry is None:
+                    continue
+                reader.add(obj.geometry)
+                for name in names:
+                    values[name].append(obj.properties[name])
+    properties = {name: np.array(values[name], dtype=str) for name in names}
+    if "osm_id" in properties:
+        properties["osm_id"] = _as_ids(properties["osm_id"])
+    mapdata = reader.mapdata(properties)
+
+    result = list()
+    for road_type in road_types:
         if "all" in road_type:
-            mapdata = [sg.shape(obj["geometry"]) for obj in src]
+            result.append(mapdata)
+        elif has_fclass:
+            result.append(mapdata.select(road_type))
         else:
-            mapdata = [
-                sg.shape(obj["geometry"])
-                for obj in src
-                if obj["properties"]["fclass"] in road_type
-            ]
-    return mapdata
+            result.append(MapData())
+    return result
 
 
-def list_layers(map_file: str):
-    """List layers in file, together with their size."""
-    if map_file.endswith(".shp.zip"):
-        fname = f"zip://{map_file}"
-    else:
-        fname = f"zip://download/{map_file}.shp.zip"
+def read_map(
+    map_file: str, road_layer: int = 0, road_type: set = set(["all"]), bbox=None
+):
+    """Read the geometry objects in a given layer from a compressed shape file.
+
+    With `bbox` (west, south, east, north), only the roads crossing it.
+    """
+    return read_maps(map_file, road_layer, [road_type], bbox)[0]
+
+
+def prepare_map(
+    map_file: str,
+    road_layer: int = 0,
+    road_type: set = set(["all"]),
+    cache_dir=None,
+    metres=False,
+):
+    """Read a map and save it as flat arrays so `load_map` can memory-map it.
+
+    With `metres`, its projection for distances in metres (see
+    `MapData.projected`) is saved too. Returns the folder with the prepared map.
+    """
+    source = map_path(map_file)
+    prepared = prepared_path(map_file, road_layer, road_type, cache_dir)
+    stamp = _source_stamp(source, True)
+    mapdata = read_map(map_file, road_layer, road_type)
+    mapdata.save(prepared, {"source": stamp})
+    if metres:
+        MapData.open(prepared).projected()
+    return prepared
+
+
+def load_map(
+    map_file: str,
+    road_layer: int = 0,
+    road_type: set = set(["all"]),
+    cache_dir=None,
+    bbox=None,
+):
+    """Load the geometry objects in a given layer from a compressed shape file.
+
+    If the map has been prepared (see `prepare_map`) and the shape file has not
+    changed since, the prepared arrays are memory-mapped instead. Prepared maps
+    hold whole layers, with `bbox` the roads crossing it are read from the shape
+    file. The returned MapData has its spatial index already built.
+    """
+    return load_maps(map_file, road_layer, [road_type], cache_dir, bbox)[0]
+
+
+def load_maps(
+    map_file: str,
+    road_layer: int = 0,
+    road_types: list = (set(["all"]),),
+    cache_dir=None,
+    bbox=None,
+):
+    """Load several sets of road types of a layer, like `load_map`.
+
+    The sets without a fresh prepared map are read in a single pass over the
+    shape file (see `read_maps`).
+    """
+    with timing.stage("map_load"):
+        result = [None] * len(road_types)
+        to_read = list()
+        for idx, road_type in enumerate(road_types):
+            prepared = prepared_path(map_file, road_layer, road_type, cache_dir)
+            if bbox is None and _is_fresh(prepared, map_path(map_file)):
+                result[idx] = MapData.open(prepared)
+            else:
+                to_read.append(idx)
+        if to_read:
+            read = read_maps(
+                map_file, road_layer, [road_types[idx] for idx in to_read], bbox
+            )
+            for idx, mapdata in zip(to_read, read):
+                result[idx] = mapdata
+        return [mapdata.build_index() for mapdata in result]
+
+
+def list_layers(map_file: str, sizes=True):
+    """List layers in file, together with their size.
+
+    Counting the features opens every layer, without `sizes` the sizes are None.
+    """
+    fname = f"zip://{map_path(map_file)}"
     result = list()
     for idx, layername in enumerate(fiona.listlayers(fname)):
+        if not sizes:
+            result.append((idx, layername, None))
+            continue
         with fiona.open(fname, layer=idx) as src:
             result.append((idx, layername, len(src)))
     return result
 
 
 def create_image(tile_width: int, tile_height: int):
-    """Create a grayscale, floating point image of given width and height."""
-    return np.zeros((tile_height, tile_width))
+    """Create a grayscale, floating point (float32) image of given width and height."""
+    return np.zeros((tile_height, tile_width), dtype=np.float32)
 
 
-def pre_filter(mapdata: list, ul: tuple, lb: tuple, multiplier=2.5):
-    """Prefilter the data to only include roads within a multiplier radious from the tile."""
-    ul_p = sg.Point(*ul)
-    lb_p = sg.Point(*lb)
+def pre_filter(mapdata: list, ul: tuple, lb: tuple, multiplier=None, max_distance=None):
+    """Prefilter the data to only include roads that can be the closest to a point of the tile.
 
-    gps_w = lb[0] - ul[0]
-    gps_h = lb[1] - ul[1]
+    The distance field is 1-Lipschitz, so no point of the tile is further from a
+    road than the distance from the tile center to its closest road plus half the
+    tile diagonal. Only roads within that radius of the tile can be the closest to
+    any of its points, they are found with the spatial index. If `multiplier` is
+    given, the radius is also capped to `multiplier` times the tile size; points
+    further than that from every road then get a larger distance than the exact
+    one. With `max_distance`, only the roads that close to the tile are kept, the
+    result is empty if there are none.
+    """
+    mapdata = as_mapdata(mapdata)
+    if not len(mapdata):
+        return mapdata
+    low = np.minimum(ul, lb)
+    high = np.maximum(ul, lb)
 
-    max_d = max(abs(multiplier * gps_w), abs(multiplier * gps_h))
+    center = sg.Point(*((low + high) / 2))
+    half = np.hypot(*(high - low)) / 2
+    _, center_d = mapdata.tree.query_nearest(
+        center,
+        max_distance=None if max_distance is None else max_distance + half,
+        return_distance=True,
+    )
+    if not len(center_d):
+        return mapdata.subset([])
+    max_d = center_d[0] + half
+    if multiplier is not None:
+        max_d = min(max_d, multiplier * max(high - low))
+    if max_distance is not None:
+        max_d = min(max_d, max_distance)
 
-    result = list()
-    for obj in mapdata:
-        ul_d = obj.distance(ul_p)
-        lb_d = obj.distance(lb_p)
-        if min(ul_d, lb_d) < max_d:
-            result.append(obj)
-    return result
+    candidates = mapdata.tree.query(
+        shapely.box(*low, *high), predicate="dwithin", distance=max_d
+    )
+    return mapdata.subset(np.sort(candidates))
 
 
-def plot_roads(image: np.ndarray, mapdata: list, ul: tuple, lb: tuple, road_value=1.0):
-    """Draw the roads that lie within a given tile, the roads are set to road_value."""
-    h, w = image.shape
+def _clip_segments(x0, y0, x1, y1, width: float, height: float):
+    """Clip segments to the [0, width] x [0, height] window (Liang-Barsky).
 
-    ul_p = sg.Point(*ul)
-    lb_p = sg.Point(*lb)
+    Returns the clipped end points of the segments crossing the window.
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    t0 = np.zeros(len(x0))
+    t1 = np.ones(len(x0))
+    keep = (dx != 0) | (dy != 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, x0), (dx, width - x0), (-dy, y0), (dy, height - y0)):
+            t = q / p
+            t0 = np.where(p < 0, np.maximum(t0, t), t0)
+            t1 = np.where(p > 0, np.minimum(t1, t), t1)
+            keep &= (p != 0) | (q >= 0)
+    keep &= t0 <= t1
+    x0, y0, dx, dy, t0, t1 = (a[keep] for a in (x0, y0, dx, dy, t0, t1))
+    return x0 + t0 * dx, y0 + t0 * dy, x0 + t1 * dx, y0 + t1 * dy
 
-    gps_w = lb[0] - ul[0] * 1.0
-    gps_h = lb[1] - ul[1] * 1.0
 
-    w_dot = gps_w / w
-    h_dot = gps_h / h
+def _steps(lengths: np.ndarray):
+    """Segment index and step number for `lengths[i]` steps of every segment i."""
+    segment = np.repeat(np.arange(len(lengths)), lengths)
+    step = np.arange(len(segment)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return segment, step
 
-    def coord2px(c):
-        x = (c[0] - ul[0]) * 1.0 / w_dot
-        y = (c[1] - ul[1]) * 1.0 / h_dot
 
-        x, y = y, x
+@timing.stage("road_rasterization")
+def plot_roads(
+    image: np.ndarray,
+    mapdata: list,
+    ul: tuple,
+    lb: tuple,
+    road_value=1.0,
+    width=1,
+    antialias=False,
+):
+    """Draw the roads that lie within a given tile, the roads are set to road_value.
 
-        return (max(0, min(int(x), h - 1)), max(0, min(int(y), w - 1)))
+    All segments in the tile are clipped and drawn at once. Lines are `width`
+    pixels wide, with `antialias` the pixels a line only partly covers are blended
+    with road_value instead.
+    """
+    h, w = image.shape
+    mapdata = as_mapdata(mapdata)
+    if not len(mapdata):
+        return
 
-    tile = sg.Polygon([ul, (ul[0], lb[1]), lb, (lb[0], ul[1])])
-    chopped = list()
-    for obj in mapdata:
-        if tile.intersects(obj):
-            chopped.append(obj.intersection(tile))
-    for curve in chopped:
-        ls = list()
-        if curve.type == "GeometryCollection" or curve.type == "MultiLineString":
-            ls = [part for part in curve.geoms]
-        elif curve.type == "LineString":
-            ls = [curve]
-        elif curve.type == "Point":
-            ls = []  # ignore
-        else:
-            ls = []
-            print("missing type", curve.type)
-        for cc in ls:
-            ps = list(cc.coords)
-            prev = ps[0]
-            ps = ps[1:]
-            prev = coord2px(prev)
-            for curr in ps:
-                curr = coord2px(curr)
-                rr, cc = skline(*prev, *curr)
-                image[rr, cc] = road_value
-                prev = curr
+    w_dot = (lb[0] - ul[0]) / w
+    h_dot = (lb[1] - ul[1]) / h
+
+    near = mapdata.tree.query(shapely.box(*np.minimum(ul, lb), *np.maximum(ul, lb)))
+    x0, y0, x1, y1 = mapdata.segments_of(np.sort(near))
+    # pixel coordinates, rows go along latitude and columns along longitude
+    c0, r0, c1, r1 = _clip_segments(
+        (x0 - ul[0]) / w_dot,
+        (y0 - ul[1]) / h_dot,
+        (x1 - ul[0]) / w_dot,
+        (y1 - ul[1]) / h_dot,
+        w,
+        h,
+    )
+
+    coverage = np.zeros((h, w))
+    if antialias:
+        # pixel centers are at .5, step along the major axis one pixel at a time
+        # and split each step between the two closest pixels on the minor axis
+        steep = abs(r1 - r0) > abs(c1 - c0)
+        a0, a1 = np.where(steep, r0, c0) - 0.5, np.where(steep, r1, c1) - 0.5
+        b0, b1 = np.where(steep, c0, r0) - 0.5, np.where(steep, c1, r1) - 0.5
+        a0, a1, b0, b1 = np.where(a0 <= a1, [a0, a1, b0, b1], [a1, a0, b1, b0])
+        first = np.rint(a0).astype(int)
+        segment, step = _steps(np.rint(a1).astype(int) - first + 1)
+        major = first[segment] + step
+        span = a1 - a0
+        t = (major - a0[segment]) / np.where(span > 0, span, 1.0)[segment]
+        minor = b0[segment] + np.clip(t, 0.0, 1.0) * (b1 - b0)[segment]
+        steep = steep[segment]
+        low = np.floor(minor)
+        frac = minor - low
+        low = low.astype(int)
+        for offset, weight in ((0, 1.0 - frac), (1, frac)):
+            pix_r = np.where(steep, major, low + offset)
+            pix_c = np.where(steep, low + offset, major)
+            inside = (pix_r >= 0) & (pix_r < h) & (pix_c >= 0) & (pix_c < w)
+            np.maximum.at(coverage, (pix_r[inside], pix_c[inside]), weight[inside])
+    else:
+        c0, c1 = (np.clip(np.floor(c), 0, w - 1).astype(int) for c in (c0, c1))
+        r0, r1 = (np.clip(np.floor(r), 0, h - 1).astype(int) for r in (r0, r1))
+        steps = np.maximum(abs(c1 - c0), abs(r1 - r0)) + 1
+        segment, step = _steps(steps)
+        t = step / np.maximum(steps - 1, 1)[segment]
+        rows = r0[segment] + np.rint(t * (r1 - r0)[segment]).astype(int)
+        cols = c0[segment] + np.rint(t * (c1 - c0)[segment]).astype(int)
+        coverage[rows, cols] = 1.0
+
+    if width > 1:
+        # a disk `width` pixels across, centered between two pixels for even widths
+        span = np.arange(int(width)) - (int(width) - 1) / 2
+        disk = np.hypot(span[:, None], span[None, :]) <= width / 2
+        coverage = ndimage.grey_dilation(coverage, footprint=disk)
+
+    drawn = coverage > 0
+    coverage = coverage[drawn]
+    image[drawn] = np.where(
+        coverage >= 1.0,
+        road_value,
+        image[drawn] * (1.0 - coverage) + road_value * coverage,
+    )
 
 
 def boost(image: np.ndarray, level=1000.0):
@@ -125,6 +848,134 @@ def boost(image: np.ndarray, level=1000.0):
     image[image < 0.0] = 0.0
 
 
-def save_image(image: np.ndarray, output_file: str):
-    """Save the image as a greyscale 8-bit."""
-    imsave(output_file, img_as_ubyte(image))
+def default_boost(metres=False):
+    """The default boost, saturating at a thousandth of a degree or, for distances
+    in metres, at a hundred metres."""
+    return 0.01 if metres else 1000.0
+
+
+# "png" and "png16" are boosted images (see `boost`), "npy" and "tiff" (float32
+# GeoTIFF) are raw distances
+IMAGE_FORMATS = ("png", "png16", "npy", "tiff")
+RAW_FORMATS = ("npy", "tiff")
+MIME_TYPES = {
+    "png": "image/png",
+    "png16": "image/png",
+    "npy": "application/x-npy",
+    "tiff": "image/tiff",
+}
+
+
+def format_of(output_file: str):
+    """The format of an output file from its extension, None for the formats of
+    scikit-image."""
+    extension = os.path.splitext(output_file)[1].lower()
+    return {".npy": "npy", ".tif": "tiff", ".tiff": "tiff"}.get(extension)
+
+
+def _geotiff_tags(image: np.ndarray, ul: tuple, lb: tuple):
+    """GeoTIFF tags placing the pixels of a tile, as tifffile `extratags`."""
+    h, w = image.shape
+    w_dot = (lb[0] - ul[0]) / w
+    h_dot = (ul[1] - lb[1]) / h
+    keys = [
+        (1, 1, 0, 3),  # version, revision, number of keys
+        (1024, 0, 1, 2),  # GTModelTypeGeoKey: geographic
+        (1025, 0, 1, 2),  # GTRasterTypeGeoKey: pixels are points, at their corner
+        (2048, 0, 1, 4326),  # GeographicTypeGeoKey: WGS 84
+    ]
+    return [
+        (33550, "d", 3, (w_dot, h_dot, 0.0), True),  # ModelPixelScaleTag
+        (33922, "d", 6, (0.0, 0.0, 0.0, ul[0], ul[1], 0.0), True),  # ModelTiepointTag
+        (34735, "H", 16, sum(keys, ()), True),  # GeoKeyDirectoryTag
+    ]
+
+
+_chunk_bytes = 1 << 20
+
+
+def _slices(raw: memoryview):
+    """The bytes of `raw`, a copy of up to `_chunk_bytes` at a time."""
+    for start in range(0, len(raw), _chunk_bytes):
+        yield raw[start : start + _chunk_bytes].tobytes()
+
+
+def encode_image(image: np.ndarray, image_format="png", ul=None, lb=None):
+    """Encode the image in one of `IMAGE_FORMATS`, as an iterable of bytes chunks.
+
+    "png" is 8-bit and "png16" 16-bit greyscale, "npy" the float32 array (its
+    header, then slices of up to 1 MiB copied as they are consumed) and "tiff" a
+    deflate-compressed float32 TIFF, a GeoTIFF in lon/lat if the `ul` and `lb`
+    corners of the tile are given.
+    """
+    if image_format == "png":
+        return [iio.imwrite("<bytes>", img_as_ubyte(image), extension=".png")]
+    if image_format == "png16":
+        return [iio.imwrite("<bytes>", img_as_uint(image), extension=".png")]
+    image = np.ascontiguousarray(image, dtype=np.float32)
+    if image_format == "npy":
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(
+            header, np.lib.format.header_data_from_array_1_0(image)
+        )
+        # WSGI servers only take bytes, sent a slice at a time
+        return itertools.chain(
+            [header.getvalue()], _slices(memoryview(image).cast("B"))
+        )
+    if image_format == "tiff":
+        import tifffile
+
+        tags = [] if ul is None or lb is None else _geotiff_tags(image, ul, lb)
+        result = io.BytesIO()
+        tifffile.imwrite(result, image, compression="zlib", extratags=tags)
+        return [result.getvalue()]
+    raise ValueError(f"unknown image format {image_format}")
+
+
+def save_image(
+    image: np.ndarray, output_file: str, image_format=None, ul=None, lb=None
+):
+    """Save the image, as a greyscale 8-bit by default.
+
+    `image_format` is one of `IMAGE_FORMATS` (see `encode_image`), by default taken
+    from the extension (see `format_of`), any of the formats understood by
+    scikit-image otherwise.
+    """
+    if image_format is None:
+        image_format = format_of(output_file)
+    if image_format is None:
+        imsave(output_file, img_as_ubyte(image))
+        return
+    with open(output_file, "wb") as output:
+        for chunk in encode_image(image, image_format, ul, lb):
+            output.write(chunk)
+
+
+def read_csv_coords(stream, chunk_size=100000, lat_column="lat", lon_column="lon"):
+    """Read a CSV file with a header, in chunks.
+
+    Yields (header, rows, coords) where rows are the raw CSV rows and coords is an
+    (N,2) array of lon/lat values taken from the given columns.
+    """
+    reader = csv.reader(stream)
+    header = next(reader)
+    lat_idx = header.index(lat_column)
+    lon_idx = header.index(lon_column)
+    while True:
+        rows = list(itertools.islice(reader, chunk_size))
+        if not rows:
+            break
+        coords = np.array(
+            [(float(row[lon_idx]), float(row[lat_idx])) for row in rows]
+        ).reshape(-1, 2)
+        yield header, rows, coords
+
+
+def read_npy_coords(npy_file, chunk_size=100000):
+    """Read an (N,2) array of lat/lon values, in chunks, memory-mapping files.
+
+    Yields (N,2) arrays of lon/lat values.
+    """
+    latlon = np.load(npy_file, mmap_mode="r")
+    for start in range(0, len(latlon), chunk_size):
+        yield np.asarray(latlon[start : start + chunk_size, ::-1], dtype=float)
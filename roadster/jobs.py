@@ -0,0 +1,153 @@
+import queue
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+
+
+class QueueFull(Exception):
+    """Raised when submitting a job to a queue with no room left."""
+
+
+class Job:
+    """A unit of work submitted to a `JobQueue`.
+
+    `status` is one of "pending", "running", "done", "failed" or "cancelled". Done
+    jobs have their `result`, failed ones the `error` message.
+    """
+
+    def __init__(self, key, work):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "pending"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.last_seen = self.created
+        self._work = work
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the job to finish, True if it did within `timeout` seconds."""
+        return self._done.wait(timeout)
+
+    def touch(self):
+        """Record that a client is still interested in the job."""
+        self.last_seen = time.time()
+
+    def _finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self._work = None
+        self._done.set()
+
+
+class JobQueue:
+    """Bounded queue of jobs run by a fixed number of worker threads.
+
+    At most `max_pending` jobs wait to run and at most `workers` run at a time.
+    Submitting a job with the same key as one that is pending, running or done
+    returns that job instead of running it again. Pending jobs nobody asked about
+    for `abandon_after` seconds (clients gone, see `Job.touch`) are cancelled
+    instead of run. Finished jobs are kept, up to `keep` of them, for clients to
+    collect their results.
+    """
+
+    def __init__(self, workers=2, max_pending=64, keep=256, abandon_after=60.0):
+        self.abandon_after = abandon_after
+        self.keep = keep
+        self._queue = queue.Queue(max_pending)
+        self._jobs = OrderedDict()
+        self._by_key = dict()
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, work):
+        """The job computing `work()` for `key`, an existing one if there is one.
+
+        Raises QueueFull if a new job is needed and there is no room for it.
+        """
+        with self._lock:
+            job = self._by_key.get(key)
+            if job is not None:
+                job.touch()
+                return job
+            job = Job(key, work)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull(f"{self._queue.maxsize} jobs already pending")
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            return job
+
+    def get(self, job_id: str):
+        """The job with the given id, None if unknown (or already dropped)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.touch()
+        return job
+
+    def cancel(self, job_id: str):
+        """Cancel a job, running jobs finish but their result is dropped."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and not job.finished:
+                self._forget(job)
+                job._finish("cancelled")
+                self._prune()
+            return job
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _forget(self, job):
+        # called with the lock held, later submissions of the key start anew
+        if self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
+
+    def _prune(self):
+        # called with the lock held, oldest finished jobs go first
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in finished[: max(0, len(finished) - self.keep)]:
+            del self._jobs[job.id]
+            self._forget(job)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.finished:
+                    continue
+                if time.time() - job.last_seen > self.abandon_after:
+                    self._forget(job)
+                    job._finish("cancelled", error="abandoned")
+                    self._prune()
+                    continue
+                job.status = "running"
+                work = job._work
+            try:
+                status, result, error = "done", work(), None
+            except Exception as e:
+                status, result, error = "failed", None, f"{type(e).__name__}: {e}"
+            with self._lock:
+                if not job.finished:
+                    if status == "failed":
+                        self._forget(job)
+                    job._finish(status, result, error)
+                self._prune()
@@ -3,11 +3,547 @@ import time
 import random
 
 import roadster.data as data
+import roadster.project as project
 
+import shapely
 import shapely.geometry as sg
 
 
-def distance(mapdata: list, point: tuple):
-    """Distance to the closest road."""
+def distance(mapdata: list, point: tuple, metres=False, raster=None, max_distance=None):
+    """Distance to the closest road, using the map spatial index.
+
+    In degrees, or in metres over the projected map (see `MapData.projected`). If
+    a `raster.Raster` covering the point is given, it is looked up there instead.
+    With `max_distance`, the search stops there and farther roads count as being
+    at `max_distance`.
+    """
+    if raster is not None:
+        return float(
+            distances(
+                mapdata,
+                [point],
+                metres=metres,
+                raster=raster,
+                max_distance=max_distance,
+            )[0]
+        )
+    mapdata = data.as_mapdata(mapdata)
+    if not len(mapdata):
+        raise ValueError("distance to an empty map")
+    if metres:
+        mapdata = mapdata.projected()
+        point = project.project(point, mapdata.crs)[0]
     point = sg.Point(*point)
-    return min([point.distance(obj) for obj in mapdata])
+    _, dists = mapdata.tree.query_nearest(
+        point, max_distance=max_distance, return_distance=True
+    )
+    # nothing within max_distance
+    return float(dists[0]) if len(dists) else float(max_distance)
+
+
+def _zorder(coords: np.ndarray):
+    """Sort key interleaving the bits of the quantized coordinates (Morton order)."""
+    low = coords.min(axis=0)
+    span = np.maximum(coords.max(axis=0) - low, 1e-12)
+    quant = ((coords - low) / span * 0xFFFF).astype(np.uint64)
+    key = np.zeros(len(coords), dtype=np.uint64)
+    for bit in range(16):
+        for dim in range(2):
+            key |= ((quant[:, dim] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(
+                2 * bit + dim
+            )
+    return key
+
+
+def segment_distances(coords: np.ndarray, segments: np.ndarray, budget=1 << 20):
+    """Minimum distance from each of the (N,2) coords to the (4,S) segments.
+
+    Works in blocks of at most `budget` point-segment pairs to bound memory.
+    """
+    result = np.full(len(coords), np.inf)
+    if not segments.shape[1]:
+        return result
+    seg_step = min(segments.shape[1], budget)
+    row_step = max(1, budget // seg_step)
+    for seg_start in range(0, segments.shape[1], seg_step):
+        x0, y0, x1, y1 = segments[:, seg_start : seg_start + seg_step]
+        dx = x1 - x0
+        dy = y1 - y0
+        len2 = dx * dx + dy * dy
+        inv = np.divide(1.0, len2, out=np.zeros_like(len2), where=len2 > 0)
+        for row in range(0, len(coords), row_step):
+            chunk = coords[row : row + row_step]
+            px = chunk[:, 0:1] - x0
+            py = chunk[:, 1:2] - y0
+            t = np.clip((px * dx + py * dy) * inv, 0.0, 1.0)
+            px -= t * dx
+            py -= t * dy
+            best = np.min(px * px + py * py, axis=1)
+            np.minimum(result[row : row + row_step], best, out=best)
+            result[row : row + row_step] = best
+    return np.sqrt(result, out=result)
+
+
+def grouped_distances(
+    coords: np.ndarray, segments: np.ndarray, starts, budget=1 << 16, nearest=False
+):
+    """Minimum distance from each of the (N,2) coords to each group of the (4,S)
+    segments, as an (N,G) array.
+
+    Group `g` are the segments from `starts[g]` to the next start. With `nearest`,
+    also returns the (N,G) indices of the closest segments.
+    """
+    starts = np.asarray(starts, dtype=int)
+    result = np.empty((len(coords), len(starts)))
+    index = np.empty((len(coords), len(starts)), dtype=int)
+    x0, y0, x1, y1 = segments
+    dx = x1 - x0
+    dy = y1 - y0
+    len2 = dx * dx + dy * dy
+    inv = np.divide(1.0, len2, out=np.zeros_like(len2), where=len2 > 0)
+    row_step = max(1, budget // max(1, segments.shape[1]))
+    for row in range(0, len(coords), row_step):
+        chunk = coords[row : row + row_step]
+        px = chunk[:, 0:1] - x0
+        py = chunk[:, 1:2] - y0
+        t = np.clip((px * dx + py * dy) * inv, 0.0, 1.0)
+        px -= t * dx
+        py -= t * dy
+        d2 = px * px + py * py
+        best = np.minimum.reduceat(d2, starts, axis=1)
+        result[row : row + row_step] = best
+        if nearest:
+            # first segment of each group at the minimum
+            lengths = np.diff(np.append(starts, len(len2)))
+            at_min = d2 == np.repeat(best, lengths, axis=1)
+            positions = np.where(at_min, np.arange(len(len2)), len(len2))
+            index[row : row + row_step] = np.minimum.reduceat(positions, starts, axis=1)
+    np.sqrt(result, out=result)
+    return (result, index) if nearest else result
+
+
+def _nearest(mapdata, coords: np.ndarray, max_distance=None, nearest=False):
+    """Distances from the (N,2) coords with a nearest query on the spatial index,
+    `max_distance` where no road is that close. With `nearest`, also returns the
+    indices of the closest roads (-1 for none)."""
+    found, dists = mapdata.tree.query_nearest(
+        shapely.points(coords),
+        max_distance=max_distance,
+        return_distance=True,
+        all_matches=False,
+    )
+    result = np.full(
+        len(coords), np.inf if max_distance is None else float(max_distance)
+    )
+    result[found[0]] = dists
+    if not nearest:
+        return result
+    index = np.full(len(coords), -1)
+    index[found[0]] = found[1]
+    return result, index
+
+
+# chunks of up to this many points too crowded for the segment kernel are
+# answered by the spatial index instead, like batches of up to `_small_batch`
+_few_rows = 32
+_small_batch = 1024
+
+
+def distances(
+    mapdata: list,
+    coords: np.ndarray,
+    chunk_size=4096,
+    candidates=None,
+    split=1 << 16,
+    metres=False,
+    raster=None,
+    max_distance=None,
+):
+    """Distance to the closest road for an (N,2) array of lon/lat coordinates.
+
+    The coordinates are processed in spatially coherent chunks of `chunk_size`
+    points. For each chunk, the spatial index gives the roads that can be closest
+    to any point in the chunk and the distances are computed in NumPy over their
+    segments only. Chunks needing more than `split` point-segment distances are
+    split first, down to a few points, past which (and for small batches) a
+    nearest query on the spatial index is faster. If `candidates` (an array of
+    geometry indices) is given, the search is restricted to those roads instead.
+    With `metres`, the coordinates are projected in one batch and the distances
+    are computed in metres over the projected map. If a `raster.Raster` is given,
+    the distances are looked up there and only the coordinates outside of it are
+    computed. With `max_distance`, the distances are capped there: only the roads
+    that close to a chunk are searched, and chunks with none are skipped
+    altogether.
+    """
+    mapdata = data.as_mapdata(mapdata)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if raster is not None:
+        if raster.units != ("metres" if metres else "degrees"):
+            raise ValueError(f"raster distances are in {raster.units}")
+        result = raster.distances(coords)
+        missing = np.isnan(result)
+        if missing.any():
+            result[missing] = distances(
+                mapdata,
+                coords[missing],
+                chunk_size,
+                candidates,
+                split,
+                metres,
+                max_distance=max_distance,
+            )
+        if max_distance is not None:
+            np.minimum(result, max_distance, out=result)
+        return result
+    if not len(mapdata):
+        raise ValueError("distance to an empty map")
+    if metres:
+        mapdata = mapdata.projected()
+        coords = project.project(coords, mapdata.crs)
+
+    if candidates is not None:
+        candidates = np.unique(np.asarray(candidates, dtype=int))
+        result = segment_distances(coords, mapdata.segments_of(candidates))
+        if max_distance is not None:
+            np.minimum(result, max_distance, out=result)
+        return result
+    return _closest(mapdata, coords, chunk_size, split, max_distance)
+
+
+def _closest(
+    mapdata, coords: np.ndarray, chunk_size, split, max_distance, nearest=False
+):
+    """The chunked search of `distances` over the whole map. With `nearest`, also
+    returns the indices of the closest roads (-1 for none)."""
+    if len(coords) <= _small_batch:
+        return _nearest(mapdata, coords, max_distance, nearest)
+    offsets = mapdata.segment_offsets
+    result = np.empty(len(coords))
+    index = np.full(len(coords), -1)
+    scattered = list()
+    order = np.argsort(_zorder(coords), kind="stable") if len(coords) else []
+    pending = [
+        order[start : start + chunk_size] for start in range(0, len(coords), chunk_size)
+    ]
+    while pending:
+        rows = pending.pop()
+        chunk = coords[rows]
+        low = chunk.min(axis=0)
+        high = chunk.max(axis=0)
+        # the distance field is 1-Lipschitz, no point in the chunk is further
+        # than this from a road
+        half = np.hypot(*(high - low)) / 2
+        center = sg.Point(*((low + high) / 2))
+        _, center_d = mapdata.tree.query_nearest(
+            center,
+            max_distance=None if max_distance is None else max_distance + half,
+            return_distance=True,
+        )
+        if not len(center_d):
+            # every point of the chunk is further than max_distance
+            result[rows] = max_distance
+            continue
+        radius = center_d[0] + half
+        if max_distance is not None:
+            # roads further from the chunk can only give capped distances
+            radius = min(radius, max_distance)
+        # envelope-only query, a superset of the roads within radius of the chunk
+        near = mapdata.tree.query(shapely.box(*(low - radius), *(high + radius)))
+        near = np.sort(near)
+        pairs = len(rows) * (offsets[near + 1] - offsets[near]).sum()
+        if pairs > split:
+            if len(rows) <= _few_rows:
+                # too spread out for the kernel to share the candidates
+                scattered.append(rows)
+                continue
+            # spread out chunk, smaller ones have fewer candidates each
+            parts = min(len(rows) // _few_rows, -(-pairs // split))
+            pending += np.array_split(rows, max(2, parts))
+            continue
+        if nearest:
+            dists, segment = grouped_distances(
+                chunk, mapdata.segments_of(near), [0], nearest=True
+            )
+            result[rows] = dists[:, 0]
+            index[rows] = np.repeat(near, offsets[near + 1] - offsets[near])[
+                segment[:, 0]
+            ]
+        else:
+            result[rows] = segment_distances(chunk, mapdata.segments_of(near))
+    if scattered:
+        rows = np.concatenate(scattered)
+        if nearest:
+            result[rows], index[rows] = _nearest(
+                mapdata, coords[rows], max_distance, nearest=True
+            )
+        else:
+            result[rows] = _nearest(mapdata, coords[rows], max_distance)
+    if max_distance is not None:
+        np.minimum(result, max_distance, out=result)
+    return (result, index) if nearest else result
+
+
+def bounded_distances(
+    mapdata: list, coords: np.ndarray, bounds: np.ndarray, budget=1 << 20
+):
+    """Distance to the closest road for an (N,2) array of coordinates, given an
+    upper bound on the distance of each (e.g., from the distances around it, the
+    distance field is 1-Lipschitz).
+
+    Only the roads within its bound of each coordinate are searched, in one query
+    on the spatial index for all the coordinates. Coordinates with no road within
+    their bound get their bound, the ones with an infinite bound are searched like
+    in `distances`. Works in blocks of about `budget` point-segment pairs to bound
+    memory.
+    """
+    mapdata = data.as_mapdata(mapdata)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    bounds = np.broadcast_to(np.asarray(bounds, dtype=float), len(coords))
+    result = np.array(bounds)
+    far = np.isinf(bounds)
+    if far.any():
+        result[far] = distances(mapdata, coords[far])
+    offsets = mapdata.segment_offsets
+    rows = np.flatnonzero(~far)
+    # the first block guesses at a few dozen segments per coordinate
+    step = max(1, budget // 64)
+    while len(rows):
+        block, rows = rows[:step], rows[step:]
+        low = coords[block] - bounds[block, None]
+        high = coords[block] + bounds[block, None]
+        within, road = mapdata.tree.query(shapely.box(*low.T, *high.T))
+        within = np.repeat(within, offsets[road + 1] - offsets[road])
+        x0, y0, x1, y1 = mapdata.segments_of(road)
+        dx = np.subtract(x1, x0, out=x1)
+        dy = np.subtract(y1, y0, out=y1)
+        len2 = dx * dx + dy * dy
+        np.divide(1.0, len2, out=len2, where=len2 > 0)
+        chunk = coords[block]
+        px = chunk[within, 0] - x0
+        py = chunk[within, 1] - y0
+        t = px * dx
+        t += py * dy
+        t *= len2
+        np.clip(t, 0.0, 1.0, out=t)
+        dx *= t
+        dy *= t
+        px -= dx
+        py -= dy
+        px *= px
+        py *= py
+        px += py
+        best = np.full(len(block), np.inf)
+        np.minimum.at(best, within, px)
+        result[block] = np.minimum(result[block], np.sqrt(best))
+        # about `budget` pairs in the next block
+        step = max(1, int(budget * len(block) / max(1, len(within))))
+    return result
+
+
+def _per_class(roads, points, classes):
+    """Whether a `distances` pass per class is cheaper than a single pass for all.
+
+    The single pass only pays off with many classes and points for the size of
+    the map, a pass per class over fewer roads wins otherwise (the threshold is
+    measured on the synthetic maps of `benchmarks/run.py`).
+    """
+    return classes * classes * points <= 48 * roads
+
+
+def class_distances(
+    mapdata: list,
+    coords: np.ndarray,
+    classes=None,
+    by="fclass",
+    nearest=False,
+    chunk_size=4096,
+    split=1 << 16,
+    metres=False,
+    max_distance=None,
+):
+    """Distance to the closest road of each class for an (N,2) array of lon/lat
+    coordinates.
+
+    Roads are grouped by their `by` property, the road type by default (load the
+    map with all road types). `classes` lists the classes to compute, by default
+    all of them, sorted. Returns an (N,K) array with a column per class, inf
+    where the map has no road of the class. With `nearest`, also returns the
+    (N,K) indices of the closest roads (-1 for none), e.g., to look up their
+    `mapdata.properties["osm_id"]`.
+
+    With few classes, or few coordinates for the size of the map, this is a
+    `distances` pass over the roads of each class (grouped once and kept with the
+    map, see `MapData.by_class`). Otherwise, the classes come out of the same
+    traversal of the spatial index: for each chunk, the query is widened until it
+    reaches a road of every class and the distances to all the classes are
+    computed at once, over the roads that can be the closest of their class. The
+    query is not widened past `split` pairs for any class, the classes still
+    lacking then (e.g., rare ones, far from the chunk) are found with a nearest
+    query over the roads of the class alone. With `max_distance`, the query is not
+    widened past it and the distances are capped there (with no closest road).
+    """
+    mapdata = data.as_mapdata(mapdata)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if by not in mapdata.properties:
+        raise ValueError(f"map has no {by} property")
+    labels = mapdata.properties[by]
+    if classes is None:
+        classes = np.unique(labels)
+    classes = list(classes)
+    # class column of every road, -1 for the classes not asked for
+    class_of = np.full(len(mapdata), -1)
+    for column, label in enumerate(classes):
+        class_of[labels == label] = column
+    present = np.bincount(class_of[class_of >= 0], minlength=len(classes)) > 0
+    result = np.full((len(coords), len(classes)), np.inf)
+    index = np.full((len(coords), len(classes)), -1)
+    if not len(coords) or not present.any():
+        return (result, index) if nearest else result
+    if metres:
+        mapdata = mapdata.projected()
+        coords = project.project(coords, mapdata.crs)
+
+    groups = mapdata.by_class(by)
+    if _per_class(len(mapdata), len(coords), int(present.sum())):
+        for column, label in enumerate(classes):
+            if not present[column]:
+                continue
+            members, subset = groups[label]
+            closest = _closest(subset, coords, chunk_size, split, max_distance, nearest)
+            if nearest:
+                result[:, column], found = closest
+                index[:, column] = np.where(found >= 0, members[found], -1)
+            else:
+                result[:, column] = closest
+        if max_distance is not None:
+            index[result >= max_distance] = -1
+        return (result, index) if nearest else result
+
+    road_boxes = shapely.bounds(mapdata.geoms)
+    west, south, east, north = road_boxes.T.copy()
+    offsets = mapdata.segment_offsets
+    # first vertex of every road, none for empty ones
+    first = np.full((2, len(mapdata)), np.inf)
+    sized = offsets[1:] > offsets[:-1]
+    first[:, sized] = mapdata.segments[:2, offsets[:-1][sized]]
+    map_low = np.nanmin(road_boxes[:, :2], axis=0)
+    map_high = np.nanmax(road_boxes[:, 2:], axis=0)
+    order = np.argsort(_zorder(coords), kind="stable")
+    pending = [
+        order[start : start + chunk_size] for start in range(0, len(coords), chunk_size)
+    ]
+    # rows of the chunks each class was left out of
+    left = [list() for _ in classes]
+    while pending:
+        rows = pending.pop()
+        chunk = coords[rows]
+        low = chunk.min(axis=0)
+        high = chunk.max(axis=0)
+        half = np.hypot(*(high - low)) / 2
+        # past this radius, every road is within reach
+        reach = np.hypot(*np.maximum(high - map_low, map_high - low))
+        if max_distance is not None:
+            reach = min(reach, max_distance)
+        middle = (low + high) / 2
+        _, center_d = mapdata.tree.query_nearest(
+            sg.Point(*middle),
+            max_distance=None if max_distance is None else max_distance + half,
+            return_distance=True,
+        )
+        if not len(center_d):
+            # every point of the chunk is further than max_distance
+            continue
+        radius = min(center_d[0] + half, reach)
+        # bound on the distance from the center to a road of each class
+        bound = np.full(len(classes), np.inf)
+        # the last query that was not crowded
+        last = None
+        while True:
+            near = mapdata.tree.query(shapely.box(*(low - radius), *(high + radius)))
+            near = near[class_of[near] >= 0]
+            columns = class_of[near]
+            sizes = offsets[near + 1] - offsets[near]
+            pairs = len(rows) * np.bincount(columns, sizes, minlength=len(classes))
+            crowded = len(rows) > 1 and pairs.max() > split
+            if crowded:
+                break
+            missing = np.isinf(bound[columns])
+            # any vertex of a road bounds the distance to it
+            gap = first[:, near[missing]] - middle[:, None]
+            np.minimum.at(bound, columns[missing], np.hypot(*gap))
+            # the distance field of each class is 1-Lipschitz too, roads further
+            # than this from the chunk are never the closest of their class
+            needed = bound + half
+            if max_distance is not None:
+                needed = np.minimum(needed, max_distance)
+            within = needed[columns]
+            reachable = west[near] <= high[0] + within
+            reachable &= south[near] <= high[1] + within
+            reachable &= east[near] >= low[0] - within
+            reachable &= north[near] >= low[1] - within
+            near, columns = near[reachable], columns[reachable]
+            sizes = offsets[near + 1] - offsets[near]
+            pairs = len(rows) * np.bincount(columns, sizes, minlength=len(classes))
+            crowded = len(rows) > 1 and pairs.max() > split
+            if crowded:
+                break
+            last = near, columns, sizes, radius
+            lacking = present & (needed > radius)
+            if not lacking.any() or radius >= reach:
+                break
+            if np.isinf(needed[lacking]).any():
+                radius = max(
+                    2 * radius, np.max(needed[lacking & np.isfinite(needed)], initial=0)
+                )
+            else:
+                radius = np.max(needed[lacking])
+            radius = min(radius, reach)
+        if last is None:
+            # spread out chunk, smaller ones have fewer candidates each
+            half_rows = len(rows) // 2
+            pending += [rows[:half_rows], rows[half_rows:]]
+            continue
+        near, columns, sizes, radius = last
+        lacking = present & (needed > radius)
+        if lacking.any():
+            # widening more would bring in the roads of every other class too,
+            # the classes still lacking are queried on their own
+            for column in np.flatnonzero(lacking):
+                left[column].append(rows)
+            keep = ~lacking[columns]
+            near, columns, sizes = near[keep], columns[keep], sizes[keep]
+
+        by_class = np.argsort(columns, kind="stable")
+        near, columns, sizes = near[by_class], columns[by_class], sizes[by_class]
+        found, starts = np.unique(columns, return_index=True)
+        if not len(found):
+            continue
+        segment_starts = np.cumsum(np.append(0, sizes))[starts]
+        found_rows = rows[:, None], found[None, :]
+        if nearest:
+            result[found_rows], segment = grouped_distances(
+                chunk, mapdata.segments_of(near), segment_starts, nearest=True
+            )
+            index[found_rows] = np.repeat(near, sizes)[segment]
+        else:
+            result[found_rows] = grouped_distances(
+                chunk, mapdata.segments_of(near), segment_starts
+            )
+
+    for column, chunks in enumerate(left):
+        if not chunks:
+            continue
+        rows = np.concatenate(chunks)
+        members, subset = groups[classes[column]]
+        found, dists = subset.tree.query_nearest(
+            shapely.points(coords[rows]),
+            max_distance=max_distance,
+            return_distance=True,
+            all_matches=False,
+        )
+        result[rows[found[0]], column] = dists
+        index[rows[found[0]], column] = members[found[1]]
+    if max_distance is not None:
+        index[result > max_distance] = -1
+        np.minimum(result, max_distance, out=result)
+    return (result, index) if nearest else result
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+
+from collections import OrderedDict
+
+import roadster.data as data
+import roadster.point as point
+import roadster.project as project
+
+import numpy as np
+
+# maps opened by this worker process, by folder, with the stamp of their files
+_maps = OrderedDict()
+_max_maps = 8
+
+
+def _stamp(folder: str):
+    """Identifies the version of a saved map, `MapData.save` replaces its files."""
+    stat = os.stat(os.path.join(folder, "meta.json"))
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _get_map(folder: str):
+    stamp = _stamp(folder)
+    cached = _maps.get(folder)
+    if cached is None or cached[0] != stamp:
+        # new, or saved again since (e.g., by `update.update_map`)
+        cached = (stamp, data.MapData.open(folder).build_index())
+        _maps[folder] = cached
+        while len(_maps) > _max_maps:
+            _maps.popitem(last=False)
+    _maps.move_to_end(folder)
+    return cached[1]
+
+
+def _preload(folders: list):
+    for folder in folders:
+        _get_map(folder)
+
+
+def _distances(task):
+    folder, coords, max_distance = task
+    return point.distances(_get_map(folder), coords, max_distance=max_distance)
+
+
+class DistancePool:
+    """Long-lived pool of processes computing distances to closest road.
+
+    Workers memory-map the maps they are asked about once and keep them (and
+    their spatial index) for later calls, so a pool can be reused across tiles
+    and requests. A map saved again in the same folder is opened again. Maps
+    listed in `preload` are opened when the workers start.
+    """
+
+    def __init__(self, processes=None, preload=(), chunk_size=2048):
+        self.chunk_size = chunk_size
+        self._folders = [data.as_mapdata(mapdata).share().folder for mapdata in preload]
+        self._pool = multiprocessing.Pool(
+            processes, initializer=_preload, initargs=[self._folders]
+        )
+
+    def distances(
+        self,
+        mapdata: list,
+        coords: np.ndarray,
+        metres=False,
+        raster=None,
+        max_distance=None,
+    ):
+        """Same as `point.distances`, split in chunks over the workers."""
+        mapdata = data.as_mapdata(mapdata)
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        if raster is not None:
+            if raster.units != ("metres" if metres else "degrees"):
+                raise ValueError(f"raster distances are in {raster.units}")
+            result = raster.distances(coords)
+            missing = np.isnan(result)
+            if missing.any():
+                result[missing] = self.distances(
+                    mapdata, coords[missing], metres, max_distance=max_distance
+                )
+            if max_distance is not None:
+                np.minimum(result, max_distance, out=result)
+            return result
+        if metres:
+            mapdata = mapdata.projected()
+            coords = project.project(coords, mapdata.crs)
+        shared = mapdata.share()
+        tasks = [
+            (shared.folder, coords[start : start + self.chunk_size], max_distance)
+            for start in range(0, len(coords), self.chunk_size)
+        ]
+        if not tasks:
+            return np.empty(0)
+        return np.concatenate(self._pool.map(_distances, tasks))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
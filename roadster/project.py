@@ -0,0 +1,38 @@
+import functools
+
+import numpy as np
+
+
+def utm_crs(lon: float, lat: float):
+    """The UTM zone containing a lon/lat position, as an EPSG code."""
+    zone = min(int((lon + 180.0) // 6.0) + 1, 60)
+    return f"EPSG:{(32600 if lat >= 0 else 32700) + zone}"
+
+
+@functools.lru_cache(maxsize=32)
+def _transformer(crs: str):
+    try:
+        import pyproj
+    except ImportError:
+        raise ImportError(
+            "distances in metres need pyproj, install it with `pip install Roadster[metres]`"
+        )
+    return pyproj.Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+
+
+def project(coords: np.ndarray, crs: str):
+    """Project an (N,2) array of lon/lat coordinates to `crs`, all at once."""
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    xs, ys = _transformer(crs).transform(coords[:, 0], coords[:, 1])
+    return np.column_stack([xs, ys])
+
+
+def scale(crs: str, lon: float, lat: float, step=1e-4):
+    """Metres per degree of longitude and of latitude around a position.
+
+    The UTM projection is conformal, so around the position the projected
+    longitude and latitude directions stay at right angles and these two factors
+    describe distances completely.
+    """
+    points = project([(lon, lat), (lon + step, lat), (lon, lat + step)], crs)
+    return tuple(np.hypot(*(points[1:] - points[0]).T) / step)
@@ -0,0 +1,192 @@
+import json
+import os
+import time
+
+import roadster.data as data
+import roadster.point as point
+
+import numpy as np
+
+
+class Raster:
+    """Distances to the closest road precomputed on a regular lon/lat grid.
+
+    Node `(row, col)` of `values` holds the distance at longitude
+    `west + col * resolution` and latitude `north - row * resolution`. Distances
+    in between are interpolated bilinearly, so looking one up costs four array
+    reads whatever the size of the map. Rasters saved with `build_raster` are
+    memory-mapped, only the parts being read are loaded, and pickled as their
+    folder.
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        west: float,
+        north: float,
+        resolution: float,
+        units="degrees",
+    ):
+        self.values = values
+        self.west = west
+        self.north = north
+        self.resolution = resolution
+        self.units = units
+        self.folder = None
+        self.source = None
+
+    @classmethod
+    def open(cls, folder: str):
+        """Memory-map a raster saved with `build_raster`."""
+        with open(os.path.join(folder, "raster.json")) as meta_file:
+            meta = json.load(meta_file)
+        values = np.load(os.path.join(folder, "distance.npy"), mmap_mode="r")
+        raster = cls(
+            values, meta["west"], meta["north"], meta["resolution"], meta["units"]
+        )
+        raster.folder = folder
+        raster.source = meta.get("source")
+        return raster
+
+    def __getstate__(self):
+        if self.folder is not None:
+            return {"folder": self.folder}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if "values" not in state:
+            state = Raster.open(state["folder"]).__dict__
+        self.__dict__.update(state)
+
+    @property
+    def bounds(self):
+        """The (west, south, east, north) extent of the grid."""
+        height, width = self.values.shape
+        return (
+            self.west,
+            self.north - (height - 1) * self.resolution,
+            self.west + (width - 1) * self.resolution,
+            self.north,
+        )
+
+    def crop(self, low: tuple, high: tuple):
+        """The part of the raster covering the lon/lat box, read into memory."""
+        height, width = self.values.shape
+        col0 = int(
+            np.clip(np.floor((low[0] - self.west) / self.resolution), 0, width - 1)
+        )
+        col1 = int(
+            np.clip(np.ceil((high[0] - self.west) / self.resolution), 0, width - 1)
+        )
+        row0 = int(
+            np.clip(np.floor((self.north - high[1]) / self.resolution), 0, height - 1)
+        )
+        row1 = int(
+            np.clip(np.ceil((self.north - low[1]) / self.resolution), 0, height - 1)
+        )
+        return Raster(
+            np.array(self.values[row0 : row1 + 1, col0 : col1 + 1]),
+            self.west + col0 * self.resolution,
+            self.north - row0 * self.resolution,
+            self.resolution,
+            self.units,
+        )
+
+    def distances(self, coords: np.ndarray):
+        """Bilinear interpolation for an (N,2) array of lon/lat, NaN outside the grid."""
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        height, width = self.values.shape
+        rows = (self.north - coords[:, 1]) / self.resolution
+        cols = (coords[:, 0] - self.west) / self.resolution
+        inside = (rows >= 0) & (rows <= height - 1) & (cols >= 0) & (cols <= width - 1)
+        row0 = np.clip(np.floor(rows), 0, max(0, height - 2)).astype(int)
+        col0 = np.clip(np.floor(cols), 0, max(0, width - 2)).astype(int)
+        row1 = np.minimum(row0 + 1, height - 1)
+        col1 = np.minimum(col0 + 1, width - 1)
+        fr = np.clip(rows - row0, 0.0, 1.0)
+        fc = np.clip(cols - col0, 0.0, 1.0)
+        values = self.values
+        result = (
+            values[row0, col0] * (1 - fr) * (1 - fc)
+            + values[row0, col1] * (1 - fr) * fc
+            + values[row1, col0] * fr * (1 - fc)
+            + values[row1, col1] * fr * fc
+        )
+        return np.where(inside, result, np.nan)
+
+    def distance(self, point: tuple):
+        return float(self.distances([point])[0])
+
+
+def build_raster(
+    mapdata: list,
+    folder: str,
+    resolution: float,
+    bounds=None,
+    block=1 << 20,
+    pool=None,
+    metres=False,
+    verbose=False,
+    source=None,
+):
+    """Compute the distances on a grid over `bounds` and save them in `folder`.
+
+    `bounds` is (west, south, east, north), by default the extent of the map. The
+    grid is computed in blocks of rows of about `block` nodes, with `pool` (a
+    `pool.DistancePool`) splitting each block over its workers, and written to a memory-mapped
+    `distance.npy` (float32) next to a `raster.json` describing the grid, and the
+    `source` of the map (e.g., its file, layer and road type) if given, so the
+    raster can be updated with the map (see `update.update_raster`). Returns the
+    opened Raster.
+    """
+    mapdata = data.as_mapdata(mapdata)
+    if bounds is None:
+        coords = mapdata.coords
+        bounds = (*coords.min(axis=0), *coords.max(axis=0))
+    west, south, east, north = bounds
+    width = int(np.ceil((east - west) / resolution)) + 1
+    height = int(np.ceil((north - south) / resolution)) + 1
+
+    os.makedirs(folder, exist_ok=True)
+    # the description goes last, half-built rasters cannot be opened
+    if os.path.exists(os.path.join(folder, "raster.json")):
+        os.remove(os.path.join(folder, "raster.json"))
+    values = np.lib.format.open_memmap(
+        os.path.join(folder, "distance.npy"),
+        mode="w+",
+        dtype=np.float32,
+        shape=(height, width),
+    )
+    lons = west + np.arange(width) * resolution
+    started = time.time()
+    rows = max(1, block // width)
+    for row in range(0, height, rows):
+        lats = north - np.arange(row, min(height, row + rows)) * resolution
+        grid = np.stack(np.meshgrid(lons, lats), axis=-1).reshape(-1, 2)
+        if pool is None:
+            dists = point.distances(mapdata, grid, metres=metres)
+        else:
+            dists = pool.distances(mapdata, grid, metres=metres)
+        values[row : row + len(lats)] = dists.reshape(len(lats), width)
+        if verbose:
+            print(
+                "Computed {:,} of {:,} rows in {:,} secs".format(
+                    row + len(lats), height, time.time() - started
+                )
+            )
+    values.flush()
+    del values
+
+    meta = {
+        "west": west,
+        "north": north,
+        "resolution": resolution,
+        "width": width,
+        "height": height,
+        "units": "metres" if metres else "degrees",
+    }
+    if source is not None:
+        meta["source"] = source
+    with open(os.path.join(folder, "raster.json"), "w") as meta_file:
+        json.dump(meta, meta_file)
+    return Raster.open(folder)
@@ -1,28 +1,387 @@
-import time
-import random
+import heapq
+import math
 import multiprocessing
+import random
 
 import roadster.data as data
 import roadster.point as point
+import roadster.pool
+import roadster.project as project
+import roadster.timing as timing
 
 import numpy as np
-import shapely.geometry as sg
+from scipy import ndimage, spatial
 import pykrige.kriging_tools as kt
 from pykrige.ok import OrdinaryKriging
 
-_mapdata = None
+
+def xyz_bounds(z: int, x: int, y: int):
+    """West-north and east-south lon/lat corners of a Web Mercator (slippy map) tile.
+
+    Tiles are rendered linearly in lon/lat between the corners, which is a good
+    approximation of the Mercator projection at the zoom levels used for roads.
+    """
+    n = 2**z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return (x / n * 360.0 - 180.0, lat(y)), ((x + 1) / n * 360.0 - 180.0, lat(y + 1))
+
+
+def xyz_tiles(z: int, west: float, south: float, east: float, north: float):
+    """The Web Mercator tiles at zoom `z` covering a lon/lat box.
+
+    Returns a list of ((x, y), ul, lb), see `xyz_bounds`.
+    """
+    n = 2**z
+
+    def col(lon):
+        return min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+
+    def row(lat):
+        y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+        return min(n - 1, max(0, int(y)))
+
+    return [
+        ((x, y), *xyz_bounds(z, x, y))
+        for y in range(row(north), row(south) + 1)
+        for x in range(col(west), col(east) + 1)
+    ]
+
+
+def grid_tiles(ul: tuple, lb: tuple, size: float):
+    """Tiles of `size` degrees covering the box from `ul` to `lb`, west to east and
+    north to south.
+
+    Returns a list of ((column, row), ul, lb), the last column and row may go
+    past `lb`.
+    """
+    columns = max(1, math.ceil(round((lb[0] - ul[0]) / size, 9)))
+    rows = max(1, math.ceil(round((ul[1] - lb[1]) / size, 9)))
+    return [
+        (
+            (x, y),
+            (ul[0] + x * size, ul[1] - y * size),
+            (ul[0] + (x + 1) * size, ul[1] - (y + 1) * size),
+        )
+        for y in range(rows)
+        for x in range(columns)
+    ]
 
 
-def _set_mapdata(data):
-    global _mapdata
-    _mapdata = data
+def _adaptive_samples(exact, ul: tuple, lb: tuple, points: int, max_depth=10):
+    """Sample the distance field on a coarse grid, then refine where it bends.
+
+    Each grid cell is scored by how far the exact distance at its center is from
+    the average of its corners (zero where the field is linear, large near roads
+    and where the closest road changes). The worst cells are split in four until
+    `points` samples have been taken. `exact` computes the distances for an (N,2)
+    array of coordinates. Returns an (N,3) array of lon, lat, distance.
+    """
+    seed = max(1, int(math.sqrt(points / 4)))
+    size = 2**max_depth
+    scale = seed * size
+    values = dict()
+
+    def evaluate(keys):
+        keys = [key for key in dict.fromkeys(keys) if key not in values]
+        if keys:
+            lattice = np.array(keys, dtype=float) / scale
+            coords = np.column_stack(
+                [
+                    ul[0] + lattice[:, 0] * (lb[0] - ul[0]),
+                    ul[1] + lattice[:, 1] * (lb[1] - ul[1]),
+                ]
+            )
+            values.update(zip(keys, exact(coords)))
+
+    def split(cells):
+        # the corners and center of each cell, center last
+        keys = list()
+        for x, y, step in cells:
+            half = step // 2
+            keys += [(x, y), (x + step, y), (x, y + step), (x + step, y + step)]
+            keys.append((x + half, y + half))
+        evaluate(keys)
+        for x, y, step in cells:
+            half = step // 2
+            corners = (
+                values[(x, y)]
+                + values[(x + step, y)]
+                + values[(x, y + step)]
+                + values[(x + step, y + step)]
+            )
+            error = abs(values[(x + half, y + half)] - corners / 4)
+            if half > 1:
+                heapq.heappush(heap, (-error * step, x, y, step))
+
+    heap = list()
+    split([(x * size, y * size, size) for x in range(seed) for y in range(seed)])
+    while heap and len(values) < points:
+        # a split costs up to 5 new corners and 4 new centers
+        batch = max(1, (points - len(values)) // 9)
+        cells = list()
+        while heap and len(cells) < batch * 4:
+            _, x, y, step = heapq.heappop(heap)
+            half = step // 2
+            cells += [
+                (x, y, half),
+                (x + half, y, half),
+                (x, y + half, half),
+                (x + half, y + half, half),
+            ]
+        split(cells)
+
+    lattice = np.array(list(values.keys()), dtype=float) / scale
+    return np.column_stack(
+        [
+            ul[0] + lattice[:, 0] * (lb[0] - ul[0]),
+            ul[1] + lattice[:, 1] * (lb[1] - ul[1]),
+            np.array(list(values.values())),
+        ]
+    )
+
+
+def _upsample(image: np.ndarray, exact, ul: tuple, lb: tuple, points: int, order):
+    """Exact distances on a coarse grid spanning the tile, interpolated with a spline
+    of the given order (1 for bilinear, 3 for bicubic)."""
+    h, w = image.shape
+    grid_w = min(w, max(2, int(round(math.sqrt(points * w / h)))))
+    grid_h = min(h, max(2, int(round(points / grid_w))))
+
+    xs = np.linspace(0, w - 1, grid_w)
+    ys = np.linspace(0, h - 1, grid_h)
+    grid_xs, grid_ys = np.meshgrid(xs, ys)
+    w_dot = (lb[0] - ul[0]) / w
+    h_dot = (lb[1] - ul[1]) / h
+    coarse = exact(_coords(ul, w_dot, h_dot, grid_xs.ravel(), grid_ys.ravel()))
+
+    rows = np.arange(h) * ((grid_h - 1) / max(1, h - 1))
+    cols = np.arange(w) * ((grid_w - 1) / max(1, w - 1))
+    rows, cols = np.meshgrid(rows, cols, indexing="ij")
+    image[:, :] = ndimage.map_coordinates(
+        coarse.reshape(grid_h, grid_w), [rows, cols], order=order, mode="nearest"
+    )
+    # cubic splines overshoot below zero next to roads
+    np.maximum(image, 0.0, out=image)
+
+
+def _idw(image: np.ndarray, kdata: np.ndarray, ul: tuple, lb: tuple, neighbours=8):
+    """Inverse distance weighting of the (N,3) lon, lat, distance samples, using the
+    closest `neighbours` samples of each pixel (in pixel space) from a KD-tree."""
+    h, w = image.shape
+    w_dot = (lb[0] - ul[0]) / w
+    h_dot = (lb[1] - ul[1]) / h
+    sample_px = np.column_stack(
+        [(kdata[:, 0] - ul[0]) / w_dot, (kdata[:, 1] - ul[1]) / h_dot]
+    )
+    tree = spatial.cKDTree(sample_px)
+    ys, xs = np.indices((h, w)).reshape(2, -1)
+    neighbours = min(neighbours, len(kdata))
+    dist, idx = tree.query(np.column_stack([xs, ys]), k=neighbours)
+    dist = dist.reshape(len(xs), neighbours)
+    idx = idx.reshape(len(xs), neighbours)
+    weights = 1.0 / np.maximum(dist, 1e-9) ** 2
+    values = np.sum(weights * kdata[idx, 2], axis=1) / np.sum(weights, axis=1)
+    image[:, :] = values.reshape(h, w)
 
 
-def _one_distance(task):
-    global _mapdata
+def _hierarchical(
+    image: np.ndarray,
+    exact,
+    ul: tuple,
+    lb: tuple,
+    tolerance: float,
+    cap: float,
+    scale=(1.0, 1.0),
+    bounded=None,
+):
+    """Coarse-to-fine computation with bounded error.
+
+    The distance field is 1-Lipschitz, so the exact distances at the corners of a
+    block give, for every pixel in it, a lower and an upper bound. Pixels whose
+    bounds are within `2 * tolerance` of each other (or whose lower bound is over
+    `cap`, where the feature saturates) are set to the middle of their bounds and
+    blocks with pixels left are split in four, down to 2x2 blocks, whose pixels left
+    are computed exactly. Every pixel ends within `tolerance` of its exact value (or
+    over `cap`, if its exact value is). `scale` converts degrees of longitude and
+    latitude into the units of `exact`. Past the first corners, the upper bounds
+    also bound the search: `bounded(coords, bounds)` (see
+    `point.bounded_distances`), if given, computes the pixels only against the
+    roads within their bound, instead of `exact`.
+    """
+    h, w = image.shape
+    w_dot = (lb[0] - ul[0]) / w
+    h_dot = (lb[1] - ul[1]) / h
+    w_unit = abs(w_dot) * scale[0]
+    h_unit = abs(h_dot) * scale[1]
+
+    size = 1
+    while size < 64 and size < max(h, w):
+        size *= 2
+    top = size
+    padded_h = -(-h // size) * size
+    padded_w = -(-w // size) * size
+    result = np.zeros((padded_h, padded_w))
+    known = np.full((padded_h + 1, padded_w + 1), np.nan)
+
+    def compute(ys, xs, bounds):
+        coords = _coords(ul, w_dot, h_dot, xs, ys)
+        if bounded is None:
+            return exact(coords)
+        # the first corners have no bound
+        first = np.isinf(bounds)
+        values = np.empty(len(coords))
+        if first.any():
+            values[first] = exact(coords[first])
+        if not first.all():
+            values[~first] = bounded(coords[~first], bounds[~first])
+        return values
+
+    block_ys, block_xs = np.meshgrid(
+        np.arange(0, padded_h, size), np.arange(0, padded_w, size), indexing="ij"
+    )
+    block_ys = block_ys.ravel()
+    block_xs = block_xs.ravel()
+    while len(block_ys):
+        corners_y = np.stack([block_ys, block_ys, block_ys + size, block_ys + size])
+        corners_x = np.stack([block_xs, block_xs + size, block_xs, block_xs + size])
+        missing = np.isnan(known[corners_y, corners_x])
+        if missing.any():
+            todo = np.unique(corners_y[missing] * known.shape[1] + corners_x[missing])
+            todo_y, todo_x = np.divmod(todo, known.shape[1])
+            bounds = np.full(len(todo), np.inf)
+            if size < top:
+                # new corners are halfway between the corners of the bigger blocks
+                step_y = todo_y % (2 * size)
+                step_x = todo_x % (2 * size)
+                bounds = np.hypot(step_y * h_unit, step_x * w_unit)
+                bounds += np.minimum(
+                    known[todo_y - step_y, todo_x - step_x],
+                    known[todo_y + step_y, todo_x + step_x],
+                )
+            known[todo_y, todo_x] = compute(todo_y, todo_x, bounds)
+
+        # distance from each pixel of a block to each of its corners
+        offsets = np.arange(size)
+        corner_offsets = np.array([[0, 0], [0, size], [size, 0], [size, size]])
+        to_corner = np.hypot(
+            (offsets[None, :, None] - corner_offsets[:, 0, None, None]) * h_unit,
+            (offsets[None, None, :] - corner_offsets[:, 1, None, None]) * w_unit,
+        )
+
+        unsettled = np.zeros(len(block_ys), dtype=bool)
+        left, left_upper = list(), list()
+        step = max(1, (1 << 18) // (size * size))
+        for start in range(0, len(block_ys), step):
+            batch = slice(start, start + step)
+            corner_d = known[corners_y[:, batch], corners_x[:, batch]]
+            corner_d = corner_d[:, :, None, None]
+            lower = corner_d[0] - to_corner[0]
+            upper = corner_d[0] + to_corner[0]
+            for corner in range(1, 4):
+                np.maximum(lower, corner_d[corner] - to_corner[corner], out=lower)
+                np.minimum(upper, corner_d[corner] + to_corner[corner], out=upper)
+            settled = upper - lower <= 2 * tolerance
+            settled |= lower >= cap
+
+            # the pixels left are written over by the smaller blocks
+            rows = block_ys[batch, None, None] + offsets[None, :, None]
+            cols = block_xs[batch, None, None] + offsets[None, None, :]
+            pixels = rows * padded_w + cols
+            result.ravel()[pixels] = (lower + upper) / 2
+            unsettled[batch] = ~settled.all(axis=(1, 2))
+            if size == 2:
+                left.append(pixels[~settled])
+                left_upper.append(upper[~settled])
+
+        if size == 2:
+            # a pixel is the top-left corner of its own block, the ones left are
+            # computed exactly rather than all the corners of their blocks
+            left_y, left_x = np.divmod(np.concatenate(left), padded_w)
+            left_upper = np.concatenate(left_upper)
+            missing = np.isnan(known[left_y, left_x])
+            known[left_y[missing], left_x[missing]] = compute(
+                left_y[missing], left_x[missing], left_upper[missing]
+            )
+            result[left_y, left_x] = known[left_y, left_x]
+            break
+
+        # single pixels are their own corner, they are always settled
+        half = size // 2
+        block_ys = block_ys[unsettled]
+        block_xs = block_xs[unsettled]
+        block_ys = np.concatenate(
+            [block_ys, block_ys, block_ys + half, block_ys + half]
+        )
+        block_xs = np.concatenate(
+            [block_xs, block_xs + half, block_xs, block_xs + half]
+        )
+        size = half
+    image[:, :] = result[:h, :w]
+
+
+def _coords(ul: tuple, w_dot: float, h_dot: float, xs: np.ndarray, ys: np.ndarray):
+    """The (N,2) GPS coordinates of the pixels at columns `xs` and rows `ys`."""
+    return np.column_stack([ul[0] + xs * w_dot, ul[1] + ys * h_dot])
+
+
+def _edt(
+    image: np.ndarray,
+    good: list,
+    exact,
+    ul: tuple,
+    lb: tuple,
+    pad: float,
+    scale=(1.0, 1.0),
+    max_distance=None,
+):
+    """Distance transform over the roads rasterized on a padded grid.
+
+    Pixels further away than the padding from any rasterized road could have their
+    closest road outside the grid, these are computed with `exact` instead.
+    `scale` converts degrees of longitude and latitude into the units of `exact`.
+    With `max_distance`, the padding stops about there and pixels further away
+    are capped instead.
+    """
+    h, w = image.shape
+
+    w_dot = (lb[0] - ul[0]) / w
+    h_dot = (lb[1] - ul[1]) / h
 
-    sample, px, py = task
-    return sample, px, py, point.distance(_mapdata, (px, py))
+    pad_w = int(np.ceil(w * pad))
+    pad_h = int(np.ceil(h * pad))
+    if max_distance is not None:
+        pad_w = min(pad_w, int(np.ceil(max_distance / (abs(w_dot) * scale[0]))) + 1)
+        pad_h = min(pad_h, int(np.ceil(max_distance / (abs(h_dot) * scale[1]))) + 1)
+
+    grid = data.create_image(w + 2 * pad_w, h + 2 * pad_h)
+    data.plot_roads(
+        grid,
+        good,
+        (ul[0] - pad_w * w_dot, ul[1] - pad_h * h_dot),
+        (lb[0] + pad_w * w_dot, lb[1] + pad_h * h_dot),
+        road_value=1.0,
+    )
+
+    if grid.any():
+        dist = ndimage.distance_transform_edt(
+            grid == 0, sampling=(abs(h_dot) * scale[1], abs(w_dot) * scale[0])
+        )
+        image[:, :] = dist[pad_h : pad_h + h, pad_w : pad_w + w]
+        max_d = min(pad_w * abs(w_dot) * scale[0], pad_h * abs(h_dot) * scale[1])
+        far = image > max_d
+        if max_distance is not None and max_distance <= max_d:
+            # the closest road of every pixel within max_distance is in the grid
+            np.minimum(image, max_distance, out=image)
+            far[:] = False
+    else:
+        far = np.ones(image.shape, dtype=bool)
+
+    ys, xs = np.nonzero(far)
+    if len(ys):
+        image[ys, xs] = exact(_coords(ul, w_dot, h_dot, xs, ys))
 
 
 def plot(
@@ -35,147 +394,398 @@ def plot(
     points=None,
     boost=1000.0,
     seed=42,
+    pad=0.5,
+    pool=None,
+    sampling="uniform",
+    tolerance=None,
+    metres=False,
+    raster=None,
+    max_distance=None,
 ):
-    """Plot the feature in a given tile."""
+    """Plot the feature in a given tile.
+
+    `inter_type` is one of "brute" (exact distance for each pixel), "edt"
+    (Euclidean distance transform over the rasterized roads, exact up to the pixel
+    size), "kriging" (ordinary Kriging over `points` samples), "bilinear" or
+    "bicubic" (exact distances on a grid of about `points` nodes, upsampled),
+    "idw" (inverse distance weighting of the `points` samples), "hierarchical"
+    (coarse-to-fine exact computation, every pixel within `tolerance` of its
+    exact value, by default a pixel diagonal or a gray level after boosting), "raster"
+    (bilinear lookup in a precomputed `raster.Raster`) or "auto" (brute
+    force for tiles up to 128x128 pixels, edt otherwise). `pad` is the fraction
+    of the tile size added around it when rasterizing roads for "edt". `points`
+    is a number of samples or a fraction of the pixels (1% by default), at least
+    16 or every pixel of smaller tiles. The Kriging and IDW samples are computed
+    in a `pool.DistancePool`, if given. They are taken uniformly at random
+    (`sampling="uniform"`) or refined where the distance field bends
+    (`sampling="adaptive"`, see `_adaptive_samples`).
+    Distances are in degrees or, with `metres`, in metres over the projected map
+    (see `MapData.projected`), `metres` can also be the CRS to project to. The
+    distances are multiplied by `boost` and capped at 1.0 (see `data.boost`), with
+    `boost=None` the image keeps the raw distances. With `max_distance`, the
+    distances are capped there and only the roads that close to the tile are
+    searched. For "brute", "edt" and "raster" it defaults to where the boosted
+    feature saturates, `1 / boost` ("hierarchical" already stops there).
+    """
 
     h, w = image.shape
 
     if not points:
-        points = int(h * w * 0.01)
-    elif points < 1:
-        points = int(h * w * points)
-    else:
-        points = int(points)
+        points = 0.01
+    if points < 1:
+        points = h * w * points
+    # small tiles still get a few samples, Kriging needs at least three
+    points = max(min(h * w, 16), int(points))
 
     rnd = random.Random(seed)
 
-    ul_p = sg.Point(*ul)
-    lb_p = sg.Point(*lb)
-
     gps_w = lb[0] - ul[0]
     gps_h = lb[1] - ul[1]
 
     w_dot = gps_w / w
     h_dot = gps_h / h
 
-    good = data.pre_filter(mapdata, ul, lb)
+    if inter_type == "auto":
+        inter_type = "brute" if h * w <= 128 * 128 else "edt"
+
+    cap = max_distance
+    if cap is None and boost and inter_type in ("brute", "edt", "raster"):
+        # the boosted pixels saturate there anyway, a bit further for rounding
+        cap = 1.001 / boost
+
+    scale = (1.0, 1.0)
+    reach = cap
+    if metres:
+        if isinstance(metres, str):
+            crs = metres
+        else:
+            crs = data.as_mapdata(mapdata).projected().crs
+        scale = project.scale(crs, *(np.add(ul, lb) / 2))
+        if cap is not None:
+            # in degrees, with the fewest metres per degree around the tile
+            lat = max(abs(ul[1]), abs(lb[1])) + cap / 110000.0
+            reach = cap / (
+                0.99 * 111320.0 * max(0.01, math.cos(math.radians(min(89.0, lat))))
+            )
+
+    with timing.stage("pre_filter", verbose):
+        good = data.pre_filter(mapdata, ul, lb, max_distance=reach)
     if verbose:
         print("Roads around tile: {:,}".format(len(good)))
 
     if not good:
         if verbose:
             print("No roads nearby, bailing out.")
+        if cap is not None and len(data.as_mapdata(mapdata)):
+            # every pixel is further than the cap
+            image[:, :] = cap
+            if boost is not None:
+                data.boost(image, level=boost)
         return image
 
-    def coord2px(c):
-        x = (c[0] - ul[0]) * 1.0 / w_dot
-        y = (c[1] - ul[1]) * 1.0 / h_dot
+    if metres:
+        good_metres = good.projected(crs)
 
-        x, y = y, x
+    def local(coords, cap=cap):
+        if metres:
+            return point.distances(
+                good_metres, project.project(coords, crs), max_distance=cap
+            )
+        return point.distances(good, coords, max_distance=cap)
 
-        return (max(0, min(int(x), w - 1)), max(0, min(int(y), h - 1)))
+    def exact(coords, cap=cap):
+        if pool is not None:
+            return pool.distances(mapdata, coords, metres=metres, max_distance=cap)
+        return local(coords, cap)
 
-    if inter_type == "kriging" or (inter_type == "auto" and h * w > 128 * 128):
-        if verbose:
-            print("Doing ordinary kriging")
-        kdata = np.zeros((points, 3), dtype=float)
-
-        if False:
-            started = time.time()
-            for sample in range(points):
-                c0 = rnd.random()
-                c1 = rnd.random()
-                px = ul[0] + c0 * gps_w
-                py = ul[1] + c1 * gps_h
-                point = sg.Point(px, py)
-                kdata[sample] = [px, py, min([point.distance(obj) for obj in good])]
-
-                if verbose and (sample + 1) % 1000 == 0:
-                    print(
-                        "Sampled: {:,} ({}%) in {:,} secs".format(
-                            sample + 1,
-                            (sample + 1) / points * 100.0,
-                            time.time() - started,
-                        )
-                    )
-                    print(np.histogram(kdata[:sample, 2])[1])
-        else:
-            tasks = list()
-            started = time.time()
-            for sample in range(points):
-                c0 = rnd.random()
-                c1 = rnd.random()
-                px = ul[0] + c0 * gps_w
-                py = ul[1] + c1 * gps_h
-                tasks.append((sample, px, py))
-
-            with multiprocessing.Pool(
-                initializer=_set_mapdata, initargs=[good]
-            ) as pool:
-                completed = 0
-                for sample, px, py, dist in pool.imap_unordered(_one_distance, tasks):
-                    kdata[sample] = [px, py, dist]
-                    completed += 1
-                    if verbose and (completed + 1) % 1000 == 0:
-                        print(
-                            "Sampled: {:,} ({}%) in {:,} secs".format(
-                                completed + 1,
-                                (completed + 1) / points * 100.0,
-                                time.time() - started,
-                            )
-                        )
-                        print(np.histogram(kdata[:, 2])[1])
-        if verbose:
-            print(
-                "Sampling {:,} points took {:,} secs".format(
-                    points, time.time() - started
-                )
+    def bounded(coords, bounds):
+        if metres:
+            return point.bounded_distances(
+                good_metres, project.project(coords, crs), bounds
             )
+        return point.bounded_distances(good, coords, bounds)
+
+    def samples():
+        with timing.stage("sampling", verbose):
+            if sampling == "adaptive":
+                kdata = _adaptive_samples(exact, ul, lb, points)
+            else:
+                kdata = np.zeros((points, 3), dtype=float)
+                for sample in range(points):
+                    c0 = rnd.random()
+                    c1 = rnd.random()
+                    kdata[sample, 0] = ul[0] + c0 * gps_w
+                    kdata[sample, 1] = ul[1] + c1 * gps_h
+                kdata[:, 2] = exact(kdata[:, :2])
+        if verbose:
+            print("Sampled {:,} points".format(len(kdata)))
             print("lat", np.histogram(kdata[:, 0])[1])
             print("lng", np.histogram(kdata[:, 1])[1])
+        return kdata
 
-        started = time.time()
-        OK = OrdinaryKriging(
-            kdata[:, 0],
-            kdata[:, 1],
-            kdata[:, 2],
-            variogram_model="gaussian",
-            coordinates_type="geographic",
-            nlags=20,
-            verbose=verbose,
-            enable_plotting=False,
-        )
-        if verbose:
-            print("Kriging model took {:,} secs".format(time.time() - started))
+    if inter_type == "kriging":
+        kdata = samples()
 
-        started = time.time()
+        with timing.stage("kriging_fit", verbose):
+            OK = OrdinaryKriging(
+                kdata[:, 0],
+                kdata[:, 1],
+                kdata[:, 2],
+                variogram_model="gaussian",
+                coordinates_type="geographic",
+                nlags=20,
+                verbose=verbose,
+                enable_plotting=False,
+            )
 
-        gridx = np.arange(ul[0], lb[0], w_dot)
-        gridy = np.arange(ul[1], lb[1], h_dot)
+        with timing.stage("kriging_execute", verbose):
+            gridx = np.arange(ul[0], lb[0], w_dot)
+            gridy = np.arange(ul[1], lb[1], h_dot)
 
-        z, ss = OK.execute("grid", gridx, gridy, backend="C", n_closest_points=100)
+            # the closest samples of each pixel, fewer than all of them
+            closest = min(100, len(kdata) - 1)
+            z, ss = OK.execute(
+                "grid", gridx, gridy, backend="C", n_closest_points=closest
+            )
         if verbose:
             print(np.histogram(z))
-            print(
-                "Executing Kriging model took {:,} secs".format(time.time() - started)
-            )
 
         image[:, :] = z
+    elif inter_type in ("bilinear", "bicubic"):
+        with timing.stage("upsampling", verbose):
+            order = 1 if inter_type == "bilinear" else 3
+            _upsample(image, exact, ul, lb, points, order)
+    elif inter_type == "idw":
+        kdata = samples()
+        with timing.stage("idw", verbose):
+            _idw(image, kdata, ul, lb)
+    elif inter_type == "hierarchical":
+        # the distance changes up to a pixel diagonal from a pixel to the next
+        pixel = math.hypot(w_dot * scale[0], h_dot * scale[1])
+        if tolerance is None:
+            # about the accuracy of "edt", or a gray level of the 8-bit output
+            tolerance = max(pixel, 1.0 / (255 * boost) if boost else 0.0)
+        saturation = 1.0 / boost if boost else np.inf
+        if cap is not None:
+            saturation = min(saturation, cap)
+        if tolerance < pixel and saturation == np.inf:
+            # nearly every block would be split down to single pixels
+            with timing.stage("brute", verbose):
+                ys, xs = np.indices((h, w)).reshape(2, -1)
+                image[:, :] = local(_coords(ul, w_dot, h_dot, xs, ys)).reshape(h, w)
+        else:
+            with timing.stage("hierarchical", verbose):
+                # the bounds need the distances past the cap, it saturates itself
+                uncapped = lambda coords: exact(coords, None)
+                _hierarchical(
+                    image,
+                    uncapped,
+                    ul,
+                    lb,
+                    tolerance,
+                    saturation,
+                    scale,
+                    bounded,
+                )
+    elif inter_type == "raster":
+        if raster is None:
+            raise ValueError("raster tiles need a raster")
+        if raster.units != ("metres" if metres else "degrees"):
+            raise ValueError(f"raster distances are in {raster.units}")
+        with timing.stage("raster_lookup", verbose):
+            window = raster.crop(np.minimum(ul, lb), np.maximum(ul, lb))
+            ys, xs = np.indices((h, w)).reshape(2, -1)
+            coords = _coords(ul, w_dot, h_dot, xs, ys)
+            values = window.distances(coords)
+            # pixels outside of the raster are computed
+            missing = np.isnan(values)
+            if missing.any():
+                values[missing] = local(coords[missing])
+            image[:, :] = values.reshape(h, w)
+    elif inter_type == "edt":
+        with timing.stage("edt", verbose):
+            _edt(image, good, local, ul, lb, pad, scale, cap)
     else:
-        if verbose:
-            print("Doing brute-force")
-        started = time.time()
-        completed = 0
-        for x in range(w):
-            for y in range(h):
-                point = sg.Point(ul[0] + x * w_dot, ul[1] + y * h_dot)
-                image[y, x] = min([point.distance(obj) for obj in good])
-                completed += 1
-                if verbose and completed % 1000 == 0:
-                    print(
-                        "Completed: {:,} ({}%) in {:,} secs".format(
-                            completed, completed / (h * w) * 100, time.time() - started
-                        )
-                    )
-
-    data.boost(image, level=boost)
+        with timing.stage("brute", verbose):
+            ys, xs = np.indices((h, w)).reshape(2, -1)
+            image[:, :] = local(_coords(ul, w_dot, h_dot, xs, ys)).reshape(h, w)
+
+    if cap is not None:
+        np.minimum(image, cap, out=image)
+    if boost is not None:
+        data.boost(image, level=boost)
+
+
+def plot_classes(
+    stack: np.ndarray,
+    mapdata: list,
+    ul: tuple,
+    lb: tuple,
+    classes=None,
+    verbose=False,
+    boost=1000.0,
+    by="fclass",
+    metres=False,
+    max_distance=None,
+):
+    """Plot the feature of each class of roads in a given tile.
+
+    `stack` is a (K,h,w) array with an image per class, in the order of `classes`
+    (see `point.class_distances`, by default all the classes of the map, sorted).
+    Every pixel is exact, like "brute" in `plot`, and the distances to all the
+    classes are computed together, then boosted like in `plot` (and capped at
+    `max_distance` the same way). Returns the classes.
+    """
+    mapdata = data.as_mapdata(mapdata)
+    if classes is None:
+        classes = np.unique(mapdata.properties[by])
+    k, h, w = stack.shape
+    if k != len(classes):
+        raise ValueError(f"{k} images for {len(classes)} classes")
+    ys, xs = np.indices((h, w)).reshape(2, -1)
+    coords = _coords(ul, (lb[0] - ul[0]) / w, (lb[1] - ul[1]) / h, xs, ys)
+    if max_distance is None and boost:
+        max_distance = 1.001 / boost
+    with timing.stage("class_distances", verbose):
+        dists = point.class_distances(
+            mapdata, coords, classes, by, metres=metres, max_distance=max_distance
+        )
+    stack[:] = dists.T.reshape(k, h, w)
+    if boost is not None:
+        for image in stack:
+            data.boost(image, level=boost)
+    return list(classes)
+
+
+def _regular(tiles: list):
+    """Whether the tiles are a full block of the same lon/lat grid, so they can be
+    plotted as a single image."""
+    cols = sorted(set(key[0] for key, _, _ in tiles))
+    rows = sorted(set(key[1] for key, _, _ in tiles))
+    if len(cols) * len(rows) != len(tiles) or len(cols) != cols[-1] - cols[0] + 1:
+        return False
+    if len(rows) != rows[-1] - rows[0] + 1:
+        return False
+    (c0, r0), ul0, lb0 = min(tiles, key=lambda tile: (tile[0][1], tile[0][0]))
+    w, h = lb0[0] - ul0[0], lb0[1] - ul0[1]
+    for (c, r), ul, lb in tiles:
+        expected = (ul0[0] + (c - c0) * w, ul0[1] + (r - r0) * h)
+        if not np.allclose(
+            [ul, lb], [expected, np.add(expected, (w, h))], rtol=0, atol=1e-9
+        ):
+            return False
+    return True
+
+
+def _blocks(tiles: list, stitch: bool):
+    """Split a batch in blocks of tiles plotted together as a single image.
+
+    A regular grid is a single block, otherwise each row is (Web Mercator tiles of
+    a row share their latitudes, not their heights).
+    """
+    if not stitch:
+        return [[tile] for tile in tiles]
+    if _regular(tiles):
+        return [tiles]
+    blocks = list()
+    for y in sorted(set(key[1] for key, _, _ in tiles)):
+        row = [tile for tile in tiles if tile[0][1] == y]
+        blocks += [row] if _regular(row) else [[tile] for tile in row]
+    return blocks
+
+
+def _plot_batch(mapdata, tiles, tile_width, tile_height, inter_type, draw, options):
+    """Plot a batch of neighbouring tiles, returns a list of (key, image)."""
+    low = np.min([np.minimum(ul, lb) for _, ul, lb in tiles], axis=0)
+    high = np.max([np.maximum(ul, lb) for _, ul, lb in tiles], axis=0)
+    # roads that can be the closest to any pixel of the batch, the tiles are
+    # pre-filtered from these
+    candidates = data.pre_filter(mapdata, (low[0], high[1]), (high[0], low[1]))
+
+    result = list()
+    for block in _blocks(tiles, inter_type != "kriging"):
+        c0 = min(key[0] for key, _, _ in block)
+        r0 = min(key[1] for key, _, _ in block)
+        (c1, r1), _, lb = max(block, key=lambda tile: (tile[0][1], tile[0][0]))
+        ul = min(block, key=lambda tile: (tile[0][1], tile[0][0]))[1]
+        image = data.create_image(
+            tile_width * (c1 - c0 + 1), tile_height * (r1 - r0 + 1)
+        )
+        # the padding of "edt" is relative to the image, keep it about a tile
+        pad = options.get("pad", 0.5) / max(c1 - c0 + 1, r1 - r0 + 1)
+        block_options = {**options, "pad": pad}
+        points = options.get("points")
+        if points is not None and points >= 1:
+            # a number of samples per tile, fractions are of the pixels already
+            block_options["points"] = int(points) * len(block)
+        plot(image, candidates, inter_type, ul, lb, **block_options)
+        if draw is not None:
+            road_value, width, antialias = draw
+            data.plot_roads(image, candidates, ul, lb, road_value, width, antialias)
+        for (c, r), _, _ in block:
+            top, left = (r - r0) * tile_height, (c - c0) * tile_width
+            result.append(
+                ((c, r), image[top : top + tile_height, left : left + tile_width])
+            )
+    return result
+
+
+def _plot_batch_task(task):
+    folder, *args = task
+    return _plot_batch(roadster.pool._get_map(folder), *args)
+
+
+def plot_many(
+    mapdata: list,
+    inter_type: str,
+    tiles: list,
+    tile_width: int,
+    tile_height: int,
+    batch=4,
+    processes=0,
+    road_value=1.0,
+    line_width=1,
+    antialias=False,
+    **options,
+):
+    """Plot many tiles, yielding (key, image) as they are done.
+
+    `tiles` is a list of ((column, row), ul, lb), e.g., from `xyz_tiles` or
+    `grid_tiles`. Neighbouring tiles are plotted in batches of up to `batch` x
+    `batch`: the roads around a batch are pre-filtered once, and tiles on a
+    common lon/lat grid are plotted as a single image, sharing the samples,
+    roads and rasterization along their borders (Kriging tiles are plotted one
+    at a time, its cost grows too fast with the size). With `processes`, batches
+    are plotted in that many processes. Roads are drawn with `road_value` (None
+    for no roads), `line_width` and `antialias` (see `data.plot_roads`), the
+    other `options` are those of `plot` (a number of `points` is per tile).
+    """
+    mapdata = data.as_mapdata(mapdata)
+    if inter_type == "auto":
+        inter_type = "brute" if tile_width * tile_height <= 128 * 128 else "edt"
+    if options.get("metres"):
+        # the projection of the whole map, not of each batch
+        options["metres"] = mapdata.projected().crs
+    draw = None if road_value is None else (road_value, line_width, antialias)
+
+    batches = dict()
+    for tile in tiles:
+        key = (tile[0][0] // batch, tile[0][1] // batch)
+        batches.setdefault(key, list()).append(tile)
+    args = (tile_width, tile_height, inter_type, draw, options)
+
+    if not processes:
+        for tiles in batches.values():
+            yield from _plot_batch(mapdata, tiles, *args)
+        return
+
+    shared = mapdata.share()
+    if options.get("metres"):
+        # saved next to the shared map, workers only open it
+        shared.projected(options["metres"])
+    tasks = [(shared.folder, tiles, *args) for tiles in batches.values()]
+    with multiprocessing.Pool(
+        processes, initializer=roadster.pool._preload, initargs=[[shared.folder]]
+    ) as workers:
+        for result in workers.imap_unordered(_plot_batch_task, tasks):
+            yield from result
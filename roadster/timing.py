@@ -0,0 +1,111 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# callables receiving (stage, seconds) for every timed stage, in any thread
+_listeners = list()
+_local = threading.local()
+
+
+def add_listener(listener):
+    """Call `listener(stage, seconds)` each time a stage finishes."""
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+@contextlib.contextmanager
+def stage(name: str, verbose=False):
+    """Time a block of code as the given stage.
+
+    The time goes to the listeners and to the recordings active in this thread,
+    with `verbose` it is also printed.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        if verbose:
+            print("{} took {:,} secs".format(name, seconds))
+        for listener in list(_listeners):
+            listener(name, seconds)
+        for recording in getattr(_local, "recordings", ()):
+            recording.stages.append((name, seconds))
+
+
+class Recording:
+    """The stages timed in the current thread while the recording is active.
+
+    Used as a context manager, e.g., around a request. `stages` is the list of
+    (stage, seconds) in the order they finished.
+    """
+
+    def __init__(self):
+        self.stages = list()
+
+    def __enter__(self):
+        if not hasattr(_local, "recordings"):
+            _local.recordings = list()
+        _local.recordings.append(self)
+        return self
+
+    def __exit__(self, *args):
+        _local.recordings.remove(self)
+
+    def totals(self):
+        """Total seconds per stage, stages repeated are added up."""
+        totals = dict()
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+
+class Histograms:
+    """Prometheus-style histograms of durations, one per label value.
+
+    Can be used directly as a listener (see `add_listener`), the label is then
+    the stage.
+    """
+
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=None):
+        if buckets is not None:
+            self.buckets = tuple(buckets)
+        self._counts = dict()
+        self._sums = dict()
+        self._lock = threading.Lock()
+
+    def __call__(self, label: str, seconds: float):
+        self.observe(label, seconds)
+
+    def observe(self, label: str, seconds: float):
+        with self._lock:
+            counts = self._counts.setdefault(label, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._sums[label] = self._sums.get(label, 0.0) + seconds
+
+    def count(self, label: str):
+        return sum(self._counts.get(label, ()))
+
+    def prometheus(self, name: str, label_name: str, help_text=""):
+        """The histograms in the Prometheus text format."""
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        with self._lock:
+            for label in sorted(self._counts):
+                counts = self._counts[label]
+                total = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    total += count
+                    lines.append(
+                        f'{name}_bucket{{{label_name}="{label}",le="{bound}"}} {total}'
+                    )
+                lines.append(
+                    f'{name}_sum{{{label_name}="{label}"}} {self._sums[label]}'
+                )
+                lines.append(f'{name}_count{{{label_name}="{label}"}} {total}')
+        return "\n".join(lines) + "\n"
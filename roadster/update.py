@@ -0,0 +1,331 @@
+import json
+import math
+import os
+import shutil
+
+import roadster.data as data
+import roadster.point as point
+import roadster.project as project
+import roadster.tile as tile
+
+import numpy as np
+import shapely
+
+
+class Changes:
+    """The roads that differ between two versions of a map, matched by OSM id.
+
+    `removed` are the indices in `old` of the roads that were removed or changed,
+    `added` the indices in `new` of the roads that were added or changed. With
+    `everything`, the roads could not be matched (no previous version or no OSM
+    ids) and everything has to be considered changed.
+    """
+
+    def __init__(self, old, new, removed=(), added=(), everything=False):
+        self.old = old
+        self.new = new
+        self.removed = np.asarray(removed, dtype=int)
+        self.added = np.asarray(added, dtype=int)
+        self.everything = everything
+
+    def __len__(self):
+        return len(self.removed) + len(self.added)
+
+    def __bool__(self):
+        return self.everything or len(self) > 0
+
+    def select(self, road_type: set):
+        """The changes to the roads of the given types (fclass)."""
+        if "all" in road_type or self.everything:
+            return self
+
+        def of_type(mapdata, indices):
+            if not len(indices) or "fclass" not in mapdata.properties:
+                return indices
+            fclass = mapdata.properties["fclass"][indices]
+            return indices[np.isin(fclass, list(road_type))]
+
+        return Changes(
+            self.old,
+            self.new,
+            of_type(self.old, self.removed),
+            of_type(self.new, self.added),
+        )
+
+    @property
+    def geoms(self):
+        """The removed and added roads, as Shapely objects."""
+        removed = self.old.subset(self.removed).geoms if len(self.removed) else []
+        added = self.new.subset(self.added).geoms if len(self.added) else []
+        return np.concatenate([np.asarray(removed), np.asarray(added)])
+
+    @property
+    def bounds(self):
+        """The (N,4) west, south, east, north boxes of the changed roads."""
+        return shapely.bounds(self.geoms).reshape(-1, 4)
+
+
+def _coord_ranges(mapdata):
+    """Start and end in the flat coordinates (`MapData.coords`) of every geometry."""
+    if mapdata._mixed():
+        counts = shapely.get_num_coordinates(mapdata.geoms)
+        return np.cumsum(counts) - counts, np.cumsum(counts)
+    _, _, offsets = mapdata.ragged
+    starts = np.arange(len(mapdata))
+    ends = starts + 1
+    for offset in reversed(offsets):
+        starts, ends = offset[starts], offset[ends]
+    return starts, ends
+
+
+def diff_maps(old, new):
+    """The Changes from the `old` to the `new` version of a map.
+
+    Roads are matched by their "osm_id" property, matched roads with other
+    coordinates or other properties count as changed.
+    """
+    if old is None or "osm_id" not in old.properties:
+        return Changes(old, new, added=np.arange(len(new)), everything=True)
+    if "osm_id" not in new.properties:
+        return Changes(old, new, added=np.arange(len(new)), everything=True)
+
+    _, old_idx, new_idx = np.intersect1d(
+        old.properties["osm_id"], new.properties["osm_id"], return_indices=True
+    )
+    changed = np.zeros(len(old_idx), dtype=bool)
+    for name, values in old.properties.items():
+        if name in new.properties:
+            changed |= values[old_idx] != new.properties[name][new_idx]
+        else:
+            changed[:] = True
+
+    old_starts, old_ends = _coord_ranges(old)
+    new_starts, new_ends = _coord_ranges(new)
+    lengths = old_ends[old_idx] - old_starts[old_idx]
+    changed |= lengths != new_ends[new_idx] - new_starts[new_idx]
+    same = np.flatnonzero(~changed)
+    if len(same):
+        # compare the coordinates of the roads of the same length, all at once
+        old_coords = old.coords[
+            data._ranges(old_starts[old_idx[same]], old_ends[old_idx[same]])
+        ]
+        new_coords = new.coords[
+            data._ranges(new_starts[new_idx[same]], new_ends[new_idx[same]])
+        ]
+        differs = np.any(old_coords != new_coords, axis=1)
+        road = np.repeat(np.arange(len(same)), lengths[same])
+        changed[same] = np.bincount(road, weights=differs, minlength=len(same)) > 0
+
+    removed = np.setdiff1d(np.arange(len(old)), old_idx[~changed])
+    added = np.setdiff1d(np.arange(len(new)), new_idx[~changed])
+    return Changes(old, new, removed, added)
+
+
+def update_map(
+    map_file: str,
+    road_layer: int = 0,
+    road_type: set = set(["all"]),
+    cache_dir=None,
+):
+    """Bring a prepared map (see `data.prepare_map`) up to date with its shape file.
+
+    The new version is compared to the prepared one by OSM id and saved in its
+    place, projections saved with the previous version are computed again.
+    Returns the Changes, empty if the prepared map was already up to date.
+    """
+    source = data.map_path(map_file)
+    prepared = data.prepared_path(map_file, road_layer, road_type, cache_dir)
+    if data._is_fresh(prepared, source):
+        mapdata = data.MapData.open(prepared)
+        return Changes(mapdata, mapdata)
+
+    old = None
+    projections = list()
+    if os.path.exists(os.path.join(prepared, "meta.json")):
+        old = data.MapData.open(prepared)
+        projections = [
+            name[len("projected-") :].replace("-", ":", 1)
+            for name in os.listdir(prepared)
+            if name.startswith("projected-")
+        ]
+    new = data.read_map(map_file, road_layer, road_type)
+    changes = diff_maps(old, new)
+
+    # the old arrays stay mapped (and readable) after their files are replaced
+    new.save(prepared, {"source": data._source_stamp(source, True)})
+    mapdata = data.MapData.open(prepared)
+    for crs in projections:
+        mapdata.projected(crs)
+    changes.new = mapdata
+    return changes
+
+
+def _tile_radius(options: dict, lat: float):
+    """How far from a changed road, in degrees, the tiles rendered with the given
+    options can change, None if there is no limit."""
+    boost = float(options.get("boost", data.default_boost("metres" in options)))
+    if boost <= 0:
+        return None
+    # distances saturate at 1 / boost
+    radius = 1.0 / boost
+    if "metres" in options:
+        # a degree of longitude is the shortest at the highest latitude
+        radius /= 111320.0 * max(0.01, math.cos(math.radians(min(89.0, abs(lat)))))
+    return radius
+
+
+def _tile_spread(options: dict, size: int):
+    """How far, in pixels, the distance computed at a point can change the pixels
+    of the tiles rendered with the given options."""
+    type_ = options.get("type", "auto")
+    if type_ == "bilinear":
+        # the nodes of the coarse grid, see `tile._upsample`
+        points = float(options.get("samples", 0.01)) or 0.01
+        if points < 1:
+            points *= size * size
+        nodes = min(size, max(2, int(round(math.sqrt(points)))))
+        return (size - 1) / (nodes - 1)
+    if type_ in ("bicubic", "idw", "kriging"):
+        # the splines and the samples span the whole tile
+        return size
+    if type_ == "hierarchical":
+        # the pixels are bounded from the corners of their block
+        return 64
+    return 0
+
+
+def invalidate_tiles(tiles, map_file: str, road_layer: int, changes: Changes):
+    """Remove from a `cache.TileCache` the tiles of a map layer that the changes
+    can affect, returns the number of tiles removed.
+
+    A pixel only changes if a changed road is (or was) the closest to it, and
+    boosted distances saturate, so only the tiles within `1 / boost` of a changed
+    road are removed. Interpolated tile types widen that by how far their samples
+    reach (see `_tile_spread`). Tiles rendered with unknown options (see
+    `TileCache.describe`) or without saturation are all removed.
+    """
+    folder = os.path.join(tiles.root, os.path.basename(map_file), str(road_layer))
+    if not changes or not os.path.isdir(folder):
+        return 0
+    removed = 0
+    for digest in os.listdir(folder):
+        key = os.path.join(os.path.basename(map_file), str(road_layer), digest)
+        options = tiles.options(key)
+        boxes = None
+        if options is not None and not changes.everything:
+            selected = changes.select(set([options.get("road_type", "all")]))
+            if not selected:
+                continue
+            boxes = selected.bounds
+            lat = np.max(np.abs(boxes[:, [1, 3]])) if len(boxes) else 0.0
+            radius = _tile_radius(options, lat)
+            if radius is None:
+                boxes = None
+        if boxes is None:
+            # everything may have changed, drop the whole folder
+            for z in os.listdir(os.path.join(tiles.root, key)):
+                if z.isdigit():
+                    removed += sum(
+                        len(files)
+                        for _, _, files in os.walk(os.path.join(tiles.root, key, z))
+                    )
+                    shutil.rmtree(os.path.join(tiles.root, key, z))
+            continue
+
+        size = int(options.get("size", 256))
+        # roads are drawn up to `line_width` pixels away
+        pixels = int(options.get("line_width", 1)) + _tile_spread(options, size)
+        for z in os.listdir(os.path.join(tiles.root, key)):
+            if not z.isdigit():
+                continue
+            margin = radius + pixels * 360.0 / 2 ** int(z) / size
+            for west, south, east, north in boxes:
+                for (x, y), _, _ in tile.xyz_tiles(
+                    int(z),
+                    west - margin,
+                    max(-85.0511, south - margin),
+                    east + margin,
+                    min(85.0511, north + margin),
+                ):
+                    try:
+                        os.remove(tiles.path(key, int(z), x, y))
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+    return removed
+
+
+def update_raster(
+    folder: str, changes: Changes, block=1 << 20, pool=None, verbose=False
+):
+    """Recompute the nodes of a raster (see `raster.build_raster`) that the
+    changes can affect, in place. Returns the number of nodes recomputed.
+
+    A node only changes if a changed road is (or was) the closest to it, so only
+    the nodes at most their current distance away from a changed road are
+    computed again, over the new version of the map.
+    """
+    with open(os.path.join(folder, "raster.json")) as meta_file:
+        meta = json.load(meta_file)
+    metres = meta["units"] == "metres"
+    values = np.load(os.path.join(folder, "distance.npy"), mmap_mode="r+")
+    height, width = values.shape
+    resolution = meta["resolution"]
+    lons = meta["west"] + np.arange(width) * resolution
+    mapdata = changes.new
+
+    if changes.everything:
+        geoms = None
+    else:
+        geoms = changes.geoms
+        if not len(geoms):
+            return 0
+        low = shapely.bounds(geoms)[:, :2].min(axis=0)
+        high = shapely.bounds(geoms)[:, 2:].max(axis=0)
+        if metres:
+            crs = mapdata.projected().crs
+            geoms = data.MapData(geoms).projected(crs).geoms
+            # conservative metres per degree, for the distance to the box
+            lat = max(abs(meta["north"]), abs(meta["north"] - height * resolution))
+            per_degree = 0.99 * 111320.0 * max(0.01, math.cos(math.radians(lat)))
+        else:
+            per_degree = 1.0
+        changed = shapely.STRtree(geoms)
+
+    done = 0
+    rows = max(1, block // width)
+    for row in range(0, height, rows):
+        lats = meta["north"] - np.arange(row, min(height, row + rows)) * resolution
+        grid = np.stack(np.meshgrid(lons, lats), axis=-1).reshape(-1, 2)
+        current = np.asarray(values[row : row + len(lats)]).reshape(-1)
+        if geoms is None:
+            stale = np.arange(len(grid))
+        else:
+            # cheap bound first, the distance to the box of the changes
+            gap = np.maximum(0, np.maximum(low - grid, grid - high))
+            near = np.flatnonzero(np.hypot(*gap.T) * per_degree <= current * 1.0001)
+            coords = grid[near]
+            if metres:
+                coords = project.project(coords, crs)
+            (found, _), dists = changed.query_nearest(
+                shapely.points(coords), return_distance=True, all_matches=False
+            )
+            nearest = np.full(len(near), np.inf)
+            nearest[found] = dists
+            stale = near[nearest <= current[near] * 1.0001 + 1e-12]
+        if len(stale):
+            if pool is None:
+                dists = point.distances(mapdata, grid[stale], metres=metres)
+            else:
+                dists = pool.distances(mapdata, grid[stale], metres=metres)
+            current[stale] = dists
+            values[row : row + len(lats)] = current.reshape(len(lats), width)
+            done += len(stale)
+        if verbose:
+            print(
+                "Recomputed {:,} nodes in {:,} of {:,} rows".format(
+                    done, row + len(lats), height
+                )
+            )
+    values.flush()
+    return done
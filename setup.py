@@ -15,19 +15,25 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     keywords="GIS feature engineering osm openstreetmap road data science",
     install_requires=[
-        "Shapely>=1.8.0",
+        "Shapely>=2.0",
         "PyKrige>=1.6.1",
-        "Fiona>=1.8.20",
+        "Fiona>=1.9",
         "numpy>=1.21.4",
         "scikit-image>=0.19.1",
+        "scipy>=1.7",
         "Flask>=2.0",
     ],
-    extras_require={},
+    extras_require={"metres": ["pyproj>=3.0"]},
     tests_require=["pytest"],
     entry_points={
         "console_scripts": [
             "roadster-one-tile=roadster.cli:one_tile",
+            "roadster-tiles=roadster.cli:tiles",
             "roadster-one-coord=roadster.cli:one_coord",
+            "roadster-many-coords=roadster.cli:many_coords",
+            "roadster-prepare=roadster.cli:prepare",
+            "roadster-build-raster=roadster.cli:build_raster",
+            "roadster-update=roadster.cli:update_map",
             "list-layers=roadster.cli:list_layers",
         ],
     },
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import zipfile
+
+import fiona
+import shapely.geometry as sg
+
+
+def write_roads(map_file, roads, properties=None, crs=None):
+    """Write a `.shp.zip` like the Geofabrik ones, with the `roads` in layer 1.
+
+    Layer 0 has a single place. `properties` maps names (e.g., "osm_id" or
+    "fclass") to a string value per road.
+    """
+    properties = dict(properties or {})
+    folder = tempfile.mkdtemp()
+    try:
+        with fiona.open(
+            os.path.join(folder, "places.shp"),
+            "w",
+            driver="ESRI Shapefile",
+            schema={"geometry": "Point", "properties": {"name": "str"}},
+            crs=crs,
+        ) as dst:
+            dst.write(
+                {
+                    "geometry": {"type": "Point", "coordinates": (0.0, 0.0)},
+                    "properties": {"name": "origin"},
+                }
+            )
+        with fiona.open(
+            os.path.join(folder, "roads.shp"),
+            "w",
+            driver="ESRI Shapefile",
+            schema={
+                "geometry": "LineString",
+                "properties": {name: "str" for name in properties},
+            },
+            crs=crs,
+        ) as dst:
+            dst.writerecords(
+                {
+                    "geometry": sg.mapping(road),
+                    "properties": {
+                        name: str(values[idx]) for name, values in properties.items()
+                    },
+                }
+                for idx, road in enumerate(roads)
+            )
+        with zipfile.ZipFile(map_file, "w") as archive:
+            for name in sorted(os.listdir(folder)):
+                archive.write(os.path.join(folder, name), name)
+    finally:
+        shutil.rmtree(folder)
+    return map_file
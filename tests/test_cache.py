@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import roadster.cache as cache
+import roadster.data as data
+
+import numpy as np
+import shapely.geometry as sg
+
+
+def _loader(loads):
+    def load(map_file, road_layer, road_type):
+        loads.append((map_file, road_layer, road_type))
+        time.sleep(0.1)
+        mapdata = data.MapData(
+            [
+                sg.LineString([(100, 100), (50, 50)]),
+                sg.LineString([(10, 10), (20, 20)]),
+            ],
+            properties={"fclass": np.array(["primary", "residential"])},
+        )
+        return mapdata.select(road_type).build_index()
+
+    return load
+
+
+def test_get():
+    loads = list()
+    maps = cache.MapCache(loader=_loader(loads))
+    mapdata = maps.get("map", 1)
+    assert len(mapdata) == 2
+    assert maps.get("map", 1) is mapdata
+    assert len(loads) == 1
+    assert maps.hits == 1
+    assert maps.misses == 1
+
+
+def test_single_flight():
+    loads = list()
+    maps = cache.MapCache(loader=_loader(loads))
+    results = list()
+    threads = [
+        threading.Thread(target=lambda: results.append(maps.get("map", 1)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert all(mapdata is results[0] for mapdata in results)
+
+
+def test_subset():
+    loads = list()
+    maps = cache.MapCache(loader=_loader(loads))
+    maps.get("map", 1)
+    primary = maps.get("map", 1, set(["primary"]))
+    assert len(loads) == 1
+    assert len(primary) == 1
+    assert primary[0].coords[0] == (100, 100)
+
+
+def test_evict():
+    loads = list()
+    maps = cache.MapCache(loader=_loader(loads))
+    maps.max_bytes = maps.get("map", 1).nbytes
+    maps.get("map", 2)
+    assert len(maps) == 1
+    assert maps.evictions == 1
+    maps.get("map", 1)
+    assert len(loads) == 3
+
+
+def test_tile_cache():
+    tiles = cache.TileCache(tempfile.mkdtemp())
+    key = cache.TileCache.key("map", 1, {"boost": 10})
+    assert key != cache.TileCache.key("map", 1, {"boost": 100})
+    assert tiles.get(key, 3, 1, 2) is None
+    tiles.put(key, 3, 1, 2, b"png")
+    assert tiles.get(key, 3, 1, 2) == b"png"
+    assert os.path.exists(os.path.join(tiles.root, key, "3", "1", "2.png"))
+    assert tiles.hits == 1
+    assert tiles.misses == 1
+    shutil.rmtree(tiles.root)
@@ -1,5 +1,10 @@
+import io
 import tempfile
 import os
+import pickle
+import shutil
+
+import pytest
 
 import roadster.data as data
 
@@ -9,6 +14,8 @@ import shapely.geometry as sg
 from skimage import img_as_ubyte
 from skimage.io import imread
 
+from tests.shapefiles import write_roads
+
 
 def test_load():
     mapdata = data.load_map("prince-edward-island-latest-free")
@@ -19,6 +26,105 @@ def test_load():
     assert len(mapdata) == 476
 
 
+def test_mapdata():
+    mapdata = data.MapData(
+        [
+            sg.LineString([(100, 100), (50, 50)]),
+            sg.LineString([(10, 10), (20, 20)]),
+        ]
+    )
+    assert len(mapdata) == 2
+    assert list(mapdata.tree.query(sg.box(0, 0, 30, 30))) == [1]
+    subset = mapdata.subset([1])
+    assert len(subset) == 1
+    assert subset[0].coords[0] == (10, 10)
+    assert data.as_mapdata(mapdata) is mapdata
+
+
+def test_prepare():
+    cache_dir = tempfile.mkdtemp()
+    prepared = data.prepare_map(
+        "prince-edward-island-latest-free", 11, set(["primary"]), cache_dir
+    )
+    assert os.path.exists(os.path.join(prepared, "meta.json"))
+    mapdata = data.load_map(
+        "prince-edward-island-latest-free", 11, set(["primary"]), cache_dir
+    )
+    assert len(mapdata) == 476
+    assert isinstance(mapdata.segments, np.memmap)
+    shutil.rmtree(cache_dir)
+
+
+def test_save_open():
+    mapdata = data.MapData(
+        [
+            sg.LineString([(100, 100), (50, 50)]),
+            sg.LineString([(10, 10), (20, 20), (30, 10)]),
+        ]
+    )
+    folder = os.path.join(tempfile.mkdtemp(), "map")
+    mapdata.save(folder)
+    opened = data.MapData.open(folder)
+    assert len(opened) == 2
+    assert opened[1].equals(mapdata[1])
+    assert np.all(opened.segments == mapdata.segments)
+    assert np.all(opened.segment_offsets == [0, 1, 3])
+    shutil.rmtree(os.path.dirname(folder))
+
+
+def test_save_open_mixed():
+    mapdata = data.MapData(
+        [
+            sg.LineString([(100, 100), (50, 50)]),
+            sg.Point(70, 0),
+            sg.MultiLineString([[(10, 10), (20, 20)], [(30, 10), (40, 10)]]),
+        ],
+        properties={"fclass": np.array(["primary", "crossing", "residential"])},
+    )
+    assert mapdata.nbytes > 0 and mapdata._ragged is None
+    assert len(mapdata.coords) == 7
+    folder = os.path.join(tempfile.mkdtemp(), "map")
+    mapdata.save(folder)
+    opened = data.MapData.open(folder)
+    assert len(opened) == 3
+    assert all(geom.equals(other) for geom, other in zip(opened, mapdata))
+    assert list(opened.properties["fclass"]) == ["primary", "crossing", "residential"]
+    assert np.all(opened.segment_offsets == [0, 1, 2, 4])
+    shutil.rmtree(os.path.dirname(folder))
+
+
+def test_projected():
+    pytest.importorskip("pyproj")
+    mapdata = data.MapData([sg.LineString([(-63.0, 46.0), (-63.0, 46.01)])])
+    folder = os.path.join(tempfile.mkdtemp(), "map")
+    mapdata.save(folder)
+    projected = data.MapData.open(folder).projected()
+    assert projected.crs == "EPSG:32620"
+    assert projected[0].length == pytest.approx(1111.6, rel=1e-3)
+    # kept next to the map arrays, reopening it does not project again
+    assert projected.folder.startswith(folder)
+    reopened = data.MapData.open(folder).projected()
+    assert reopened.folder == projected.folder
+    assert np.all(reopened.segments == projected.segments)
+    assert mapdata.projected() is mapdata.projected()
+    shutil.rmtree(os.path.dirname(folder))
+
+
+def test_share():
+    mapdata = data.MapData([sg.LineString([(10, 10), (20, 20)])])
+    shared = mapdata.share()
+    assert shared.folder is not None
+    assert mapdata.share() is shared
+    copy = pickle.loads(pickle.dumps(shared))
+    assert copy.folder == shared.folder
+    assert isinstance(copy.segments, np.memmap)
+    assert copy[0].equals(mapdata[0])
+
+    mixed = data.MapData([sg.LineString([(10, 10), (20, 20)]), sg.Point(0, 0)])
+    copy = pickle.loads(pickle.dumps(mixed.share()))
+    assert copy[1].equals(mixed[1])
+
+
 def test_list():
     layers = data.list_layers("prince-edward-island-latest-free")
     print(layers)
@@ -28,12 +134,46 @@ def test_list():
     assert layers[11][2] == 22243
 
 
+def test_read_maps():
+    folder = tempfile.mkdtemp()
+    map_file = os.path.join(folder, "roads.shp.zip")
+    roads = [
+        ("primary", sg.LineString([(0, 0), (1, 1)])),
+        ("secondary", sg.LineString([(10, 10), (11, 10), (11, 11)])),
+        ("primary", sg.LineString([(10, 0), (11, 0)])),
+        ("service", sg.LineString([(0, 10), (0, 11)])),
+    ]
+    write_roads(
+        map_file,
+        [road for _, road in roads],
+        {"fclass": [fclass for fclass, _ in roads]},
+    )
+
+    primary, major, everything = data.read_maps(
+        map_file, 1, [set(["primary"]), set(["primary", "secondary"]), set(["all"])]
+    )
+    assert len(primary) == 2
+    assert list(primary.properties["fclass"]) == ["primary", "primary"]
+    assert primary[1].equals(roads[2][1])
+    assert len(major) == 3
+    assert len(everything) == 4
+    assert everything[1].equals(roads[1][1])
+
+    boxed = data.read_map(map_file, 1, set(["all"]), bbox=(9, -1, 12, 12))
+    assert list(boxed.properties["fclass"]) == ["secondary", "primary"]
+    assert len(data.read_map(map_file, 1, set(["motorway"]))) == 0
+
+    layers = data.list_layers(map_file, sizes=False)
+    assert [layer[1:] for layer in layers] == [("places", None), ("roads", None)]
+    shutil.rmtree(folder)
+
+
 def test_create():
     img = data.create_image(100, 10)
     assert len(img.shape) == 2
     assert img.shape[0] == 10
     assert img.shape[1] == 100
-    assert img.dtype is np.dtype("float")
+    assert img.dtype is np.dtype("float32")
 
 
 def test_filter():
@@ -46,6 +186,19 @@ def test_filter():
     assert filtered[0].coords[0] == (10, 10)
 
 
+def test_filter_corners():
+    # closest road to the other two corners of the tile
+    mapdata = [
+        sg.LineString([(0, 0), (1, 1)]),
+        sg.LineString([(30, 32), (32, 32)]),
+        sg.LineString([(-5, 40), (-4, 40)]),
+        sg.LineString([(200, 200), (300, 300)]),
+    ]
+    filtered = data.pre_filter(mapdata, (0, 30), (30, 0))
+    assert len(filtered) == 3
+    assert len(data.pre_filter([], (0, 30), (30, 0))) == 0
+
+
 def test_plot():
     img = np.zeros((200, 100), dtype=float)
     mapdata = [
@@ -59,6 +212,28 @@ def test_plot():
     assert img[0, 0] == 0.0
 
 
+def test_plot_width():
+    mapdata = [
+        sg.LineString([(10, 10.5), (90, 10.5)]),
+        sg.LineString([(50, 0), (70, 90)]),
+    ]
+    img = np.zeros((100, 100), dtype=float)
+    data.plot_roads(img, mapdata, (0, 0), (100, 100), width=3)
+    assert np.all(img[9:12, 20] == 1.0)
+    assert img[8, 20] == 0.0 and img[12, 20] == 0.0
+    for width in range(1, 6):
+        img = np.zeros((100, 100), dtype=float)
+        data.plot_roads(img, mapdata, (0, 0), (100, 100), width=width)
+        assert img[:, 20].sum() == width
+
+    img = np.zeros((100, 100), dtype=float)
+    data.plot_roads(img, mapdata, (0, 0), (100, 100), antialias=True)
+    assert img[10, 20] == 1.0
+    assert 0.0 < img[45, 60] < 1.0
+    assert img.max() == 1.0
+    assert img[0, 0] == 0.0
+
+
 def test_boost():
     img = np.zeros((200, 100), dtype=float)
     img[50, 50] = 0.01
@@ -75,3 +250,47 @@ def test_save():
     img2 = imread(fname)
     assert np.all(img == img2 / 255.0)
     os.unlink(fname)
+
+
+def test_save_formats():
+    tifffile = pytest.importorskip("tifffile")
+    img = data.create_image(100, 200)
+    img[:] = np.linspace(0, 50, 100)
+    folder = tempfile.mkdtemp()
+    data.save_image(img, os.path.join(folder, "tile.npy"))
+    raw = np.load(os.path.join(folder, "tile.npy"))
+    assert raw.dtype == np.float32 and np.all(raw == img)
+    # the header, then the array copied a slice at a time
+    chunks = data.encode_image(img, "npy")
+    assert next(chunks).startswith(b"\x93NUMPY")
+    assert sum(len(chunk) for chunk in chunks) == img.nbytes
+
+    data.save_image(img, os.path.join(folder, "tile.tif"), ul=(10, 20), lb=(11, 19))
+    with tifffile.TiffFile(os.path.join(folder, "tile.tif")) as tiff:
+        assert np.all(tiff.asarray() == img)
+        assert tiff.geotiff_metadata["ModelTiepoint"] == [0, 0, 0, 10, 20, 0]
+        assert tiff.geotiff_metadata["ModelPixelScale"] == [0.01, 0.005, 0]
+
+    data.boost(img, 0.02)
+    data.save_image(img, os.path.join(folder, "tile.png"), "png16")
+    img2 = imread(os.path.join(folder, "tile.png"))
+    assert img2.dtype == np.uint16
+    assert np.max(np.abs(img - img2 / 65535.0)) < 1e-4
+    shutil.rmtree(folder)
+
+
+def test_read_coords():
+    stream = io.StringIO("id,lat,lon\n1,10,20\n2,11,21\n3,12,22\n")
+    chunks = list(data.read_csv_coords(stream, chunk_size=2))
+    assert len(chunks) == 2
+    header, rows, coords = chunks[0]
+    assert header == ["id", "lat", "lon"]
+    assert rows[1] == ["2", "11", "21"]
+    assert np.all(coords == [[20, 10], [21, 11]])
+
+    _, fname = tempfile.mkstemp(suffix=".npy")
+    np.save(fname, np.array([[10, 20], [11, 21], [12, 22]], dtype=float))
+    chunks = list(data.read_npy_coords(fname, chunk_size=2))
+    assert len(chunks) == 2
+    assert np.all(chunks[1] == [[22, 12]])
+    os.unlink(fname)
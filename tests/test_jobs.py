@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+import roadster.jobs as jobs
+
+
+def test_submit():
+    queue = jobs.JobQueue(workers=1)
+    job = queue.submit("a", lambda: 42)
+    assert job.wait(5)
+    assert job.status == "done"
+    assert job.result == 42
+    assert queue.get(job.id) is job
+    # finished jobs are kept and identical requests reuse them
+    assert queue.submit("a", lambda: 43) is job
+
+    failed = queue.submit("b", lambda: 1 / 0)
+    assert failed.wait(5)
+    assert failed.status == "failed"
+    assert "ZeroDivisionError" in failed.error
+    assert queue.submit("b", lambda: 1) is not failed
+
+
+def test_dedup_and_bound():
+    release = threading.Event()
+    queue = jobs.JobQueue(workers=1, max_pending=2)
+    running = queue.submit("slow", release.wait)
+    while running.status != "running":
+        time.sleep(0.01)
+    first = queue.submit("x", lambda: 1)
+    assert queue.submit("x", lambda: 2) is first
+    queue.submit("y", lambda: 3)
+    with pytest.raises(jobs.QueueFull):
+        queue.submit("z", lambda: 4)
+
+    assert queue.cancel(first.id).status == "cancelled"
+    release.set()
+    assert running.wait(5) and running.status == "done"
+    assert first.result is None
+
+
+def test_abandoned():
+    release = threading.Event()
+    queue = jobs.JobQueue(workers=1, abandon_after=0.05)
+    queue.submit("slow", release.wait)
+    calls = list()
+    job = queue.submit("x", lambda: calls.append(1))
+    time.sleep(0.1)
+    release.set()
+    assert job.wait(5)
+    assert job.status == "cancelled"
+    assert not calls
@@ -1,7 +1,12 @@
 import math
 
+import pytest
+
+import roadster.data as data
 import roadster.point as point
 
+import numpy as np
+import shapely
 import shapely.geometry as sg
 
 
@@ -14,3 +19,150 @@ def test_distance():
     assert point.distance(mapdata, (20, 20)) == 0
     assert point.distance(mapdata, (21, 21)) == math.sqrt(2)
     assert point.distance(mapdata, (21, 20)) == 1
+
+
+def test_distances():
+    mapdata = [
+        sg.LineString([(100, 100), (50, 50)]),
+        sg.LineString([(10, 10), (20, 20)]),
+        sg.Point(70, 0),
+    ]
+    coords = np.array([(0, 0), (20, 20), (21, 21), (21, 20), (70, 1)])
+    expected = [math.sqrt(2 * 10**2), 0, math.sqrt(2), 1, 1]
+    assert np.allclose(point.distances(mapdata, coords), expected)
+    assert np.allclose(point.distances(mapdata, coords, chunk_size=2), expected)
+    rnd = np.random.default_rng(42).uniform(-10, 110, (1000, 2))
+    assert np.allclose(
+        point.distances(mapdata, rnd, chunk_size=100),
+        [point.distance(mapdata, tuple(coord)) for coord in rnd],
+    )
+    assert point.distances(mapdata, [(0, 0)], candidates=[0])[0] == math.sqrt(
+        2 * 50**2
+    )
+
+    # past the small batches, over the segment kernel and, with a small split,
+    # the nearest queries for the crowded chunks
+    rng = np.random.default_rng(7)
+    starts = rng.uniform(0, 100, (500, 2))
+    roads = [sg.LineString([start, start + rng.normal(0, 2, 2)]) for start in starts]
+    rnd = rng.uniform(-10, 110, (5000, 2))
+    expected = [point.distance(roads, tuple(coord)) for coord in rnd]
+    for split in (1 << 16, 1 << 8):
+        assert np.allclose(point.distances(roads, rnd, split=split), expected)
+    assert np.allclose(
+        point.distances(roads, rnd, split=1 << 8, max_distance=1),
+        np.minimum(expected, 1),
+    )
+
+
+def test_distance_metres():
+    pytest.importorskip("pyproj")
+    mapdata = [sg.LineString([(0, 0), (1, 0)])]
+    # a hundredth of a degree of latitude at the equator, about 1.1 km
+    assert point.distance(mapdata, (0.5, 0.01), metres=True) == pytest.approx(
+        1105.7, rel=2e-3
+    )
+    dists = point.distances(mapdata, [(0.5, 0.01), (0.2, -0.02)], metres=True)
+    assert dists == pytest.approx([1105.7, 2211.4], rel=2e-3)
+
+
+def test_bounded_distances():
+    rng = np.random.default_rng(9)
+    starts = rng.uniform(0, 100, (300, 2))
+    roads = [sg.LineString([start, start + rng.normal(0, 2, 2)]) for start in starts]
+    roads.append(sg.Point(50, 50))
+    coords = rng.uniform(-10, 110, (3000, 2))
+    exact = point.distances(roads, coords)
+
+    bounds = exact + rng.uniform(0, 5, len(coords))
+    bounds[:10] = np.inf
+    assert np.allclose(point.bounded_distances(roads, coords, bounds), exact)
+    assert np.allclose(
+        point.bounded_distances(roads, coords, bounds, budget=100), exact
+    )
+    # no road within the bound
+    assert np.allclose(point.bounded_distances(roads, coords, exact / 2), exact / 2)
+
+
+def test_class_distances():
+    rng = np.random.default_rng(7)
+    starts = rng.uniform(0, 100, (500, 2))
+    roads = [sg.LineString([start, start + rng.normal(0, 2, 2)]) for start in starts]
+    roads.append(sg.Point(50, 50))
+    fclass = np.array(
+        [["residential", "primary", "secondary"][i % 3] for i in range(500)]
+        + ["motorway"]
+    )
+    mapdata = data.MapData(roads, properties={"fclass": fclass})
+    coords = rng.uniform(-10, 110, (2000, 2))
+
+    dists, nearest = point.class_distances(
+        mapdata, coords, chunk_size=100, nearest=True
+    )
+    classes = ["motorway", "primary", "residential", "secondary"]
+    for column, name in enumerate(classes):
+        subset = [road for road, label in zip(roads, fclass) if label == name]
+        assert np.allclose(dists[:, column], point.distances(subset, coords))
+        assert (fclass[nearest[:, column]] == name).all()
+        assert np.allclose(
+            shapely.distance(mapdata.geoms[nearest[:, column]], shapely.points(coords)),
+            dists[:, column],
+        )
+
+    dists = point.class_distances(mapdata, coords[:10], ["primary", "unknown"])
+    assert np.isinf(dists[:, 1]).all()
+    primary = mapdata.subset(np.flatnonzero(fclass == "primary"))
+    assert np.allclose(dists[:, 0], point.distances(primary, coords[:10]))
+
+
+@pytest.mark.parametrize("max_distance", [None, 3])
+def test_class_distances_per_class(monkeypatch, max_distance):
+    rng = np.random.default_rng(8)
+    starts = rng.uniform(0, 100, (300, 2))
+    roads = [sg.LineString([start, start + rng.normal(0, 2, 2)]) for start in starts]
+    fclass = np.array([["primary", "secondary"][i % 2] for i in range(300)])
+    fclass[7] = "rare"
+    mapdata = data.MapData(roads, properties={"fclass": fclass})
+    coords = rng.uniform(-10, 110, (3000, 2))
+
+    monkeypatch.setattr(point, "_per_class", lambda *args: False)
+    single = point.class_distances(
+        mapdata, coords, nearest=True, max_distance=max_distance
+    )
+    monkeypatch.setattr(point, "_per_class", lambda *args: True)
+    separate = point.class_distances(
+        mapdata, coords, nearest=True, max_distance=max_distance
+    )
+    assert np.allclose(single[0], separate[0])
+    assert (single[1] == separate[1]).all()
+    assert set(mapdata.by_class()) == {"primary", "rare", "secondary"}
+    members, rare = mapdata.by_class()["rare"]
+    assert list(members) == [7] and len(rare) == 1
+
+
+def test_max_distance():
+    mapdata = [
+        sg.LineString([(100, 100), (50, 50)]),
+        sg.LineString([(10, 10), (20, 20)]),
+        sg.Point(70, 0),
+    ]
+    assert point.distance(mapdata, (0, 0), max_distance=5) == 5
+    assert point.distance(mapdata, (21, 20), max_distance=5) == 1
+
+    rnd = np.random.default_rng(3).uniform(-50, 150, (1000, 2))
+    full = point.distances(mapdata, rnd)
+    for max_distance in (0.5, 5, 30):
+        assert np.allclose(
+            point.distances(mapdata, rnd, chunk_size=50, max_distance=max_distance),
+            np.minimum(full, max_distance),
+        )
+
+    fclass = np.array(["primary", "residential", "primary"])
+    classes = data.MapData(mapdata, properties={"fclass": fclass})
+    dists, nearest = point.class_distances(classes, rnd, nearest=True)
+    capped, capped_nearest = point.class_distances(
+        classes, rnd, chunk_size=50, nearest=True, max_distance=5
+    )
+    assert np.allclose(capped, np.minimum(dists, 5))
+    assert (capped_nearest[dists <= 5] == nearest[dists <= 5]).all()
+    assert (capped_nearest[dists > 5] == -1).all()
@@ -0,0 +1,30 @@
+import roadster.pool as pool
+import roadster.point as point
+import roadster.data as data
+
+import numpy as np
+import shapely.geometry as sg
+
+
+def test_distances():
+    mapdata = data.MapData(
+        [
+            sg.LineString([(100, 100), (50, 50)]),
+            sg.LineString([(10, 10), (20, 20)]),
+        ]
+    )
+    coords = np.random.default_rng(42).uniform(-10, 110, (1000, 2))
+    with pool.DistancePool(2, preload=[mapdata], chunk_size=100) as workers:
+        assert np.allclose(
+            workers.distances(mapdata, coords), point.distances(mapdata, coords)
+        )
+        assert np.allclose(workers.distances(mapdata, [(21, 20)]), [1])
+
+
+def test_distances_mixed():
+    mapdata = data.MapData([sg.LineString([(10, 10), (20, 20)]), sg.Point(70, 0)])
+    coords = np.random.default_rng(42).uniform(-10, 110, (300, 2))
+    with pool.DistancePool(2, preload=[mapdata], chunk_size=100) as workers:
+        assert np.allclose(
+            workers.distances(mapdata, coords), point.distances(mapdata, coords)
+        )
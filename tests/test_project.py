@@ -0,0 +1,23 @@
+import pytest
+
+import roadster.project as project
+
+import numpy as np
+
+
+def test_utm_crs():
+    assert project.utm_crs(-63.1, 46.2) == "EPSG:32620"
+    assert project.utm_crs(14.5, 35.9) == "EPSG:32633"
+    assert project.utm_crs(-58.4, -34.6) == "EPSG:32721"
+    assert project.utm_crs(180.0, 0.0) == "EPSG:32660"
+
+
+def test_project():
+    pytest.importorskip("pyproj")
+    coords = project.project([(-63.0, 46.0), (-63.0, 46.01)], "EPSG:32620")
+    # the central meridian of zone 20 is at 63W
+    assert coords[0, 0] == pytest.approx(500000.0)
+    assert np.hypot(*(coords[1] - coords[0])) == pytest.approx(1111.6, rel=1e-3)
+    lon_scale, lat_scale = project.scale("EPSG:32620", -63.0, 46.0)
+    assert lat_scale == pytest.approx(111160, rel=1e-3)
+    assert lon_scale == pytest.approx(77430, rel=1e-3)
@@ -0,0 +1,47 @@
+import math
+import shutil
+import tempfile
+
+import roadster.data as data
+import roadster.point as point
+import roadster.raster as raster
+import roadster.tile as tile
+
+import numpy as np
+import shapely.geometry as sg
+
+
+def test_build_raster():
+    mapdata = [
+        sg.LineString([(100, 100), (50, 50)]),
+        sg.LineString([(10, 10), (20, 20)]),
+    ]
+    folder = tempfile.mkdtemp()
+    built = raster.build_raster(
+        mapdata, folder, 1.0, bounds=(0, 0, 100, 100), block=500
+    )
+    assert built.values.shape == (101, 101)
+    assert built.bounds == (0, 0, 100, 100)
+    opened = raster.Raster.open(folder)
+    assert isinstance(opened.values, np.memmap)
+
+    # grid nodes are exact, in between within the resolution
+    assert opened.distance((0, 0)) == np.float32(math.sqrt(2 * 10**2))
+    assert opened.distance((20, 100)) == np.float32(point.distance(mapdata, (20, 100)))
+    coords = np.random.default_rng(42).uniform(0, 100, (1000, 2))
+    exact = point.distances(mapdata, coords)
+    assert np.all(np.abs(opened.distances(coords) - exact) < 1.0)
+    cropped = opened.crop((30.5, 40.2), (60.1, 70.7))
+    inside = coords[np.all((coords >= (30.5, 40.2)) & (coords <= (60.1, 70.7)), axis=1)]
+    assert np.allclose(cropped.distances(inside), opened.distances(inside))
+
+    # outside of the raster, distances are computed
+    assert np.isnan(opened.distance((-10, 0)))
+    assert point.distance(mapdata, (-10, 0), raster=opened) == math.sqrt(20**2 + 10**2)
+
+    brute = data.create_image(50, 50)
+    tile.plot(brute, mapdata, "brute", (0, 110), (110, 0), boost=0.01)
+    img = data.create_image(50, 50)
+    tile.plot(img, mapdata, "raster", (0, 110), (110, 0), boost=0.01, raster=opened)
+    assert np.max(np.abs(img - brute)) < 0.01
+    shutil.rmtree(folder)
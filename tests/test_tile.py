@@ -1,6 +1,8 @@
 import math
 
+import roadster.data as data
 import roadster.tile as tile
+import roadster.point as point
 
 import numpy as np
 import shapely.geometry as sg
@@ -22,6 +24,59 @@ def test_plot_brute():
     assert abs(img[21, 20] - 1 / 100) < 1e10
 
 
+def test_plot_max_distance():
+    mapdata = [
+        sg.LineString([(100, 100), (50, 50)]),
+        sg.LineString([(10, 10), (20, 20)]),
+    ]
+    full = np.zeros((200, 100), dtype=np.float32)
+    tile.plot(full, mapdata, "brute", (0, 0), (100, 200), boost=None)
+    for inter_type in ("brute", "edt", "hierarchical"):
+        img = np.zeros((200, 100), dtype=np.float32)
+        tile.plot(
+            img, mapdata, inter_type, (0, 0), (100, 200), boost=None, max_distance=5
+        )
+        assert img.max() <= 5
+        assert np.abs(img - np.minimum(full, 5)).max() < 1.5
+    far = np.zeros((10, 10), dtype=np.float32)
+    tile.plot(
+        far, mapdata, "brute", (200, 200), (210, 190), boost=None, max_distance=5
+    )
+    assert (far == 5).all()
+
+    boosted = np.zeros((200, 100), dtype=np.float32)
+    tile.plot(boosted, mapdata, "brute", (0, 0), (100, 200), boost=0.1)
+    assert np.allclose(boosted, np.minimum(full * 0.1, 1.0))
+
+
+def test_plot_edt():
+    mapdata = [
+        sg.LineString([(100, 100), (50, 50)]),
+        sg.LineString([(10, 10), (20, 20)]),
+    ]
+    brute = np.zeros((200, 100), dtype=float)
+    tile.plot(brute, mapdata, "brute", (0, 0), (100, 200), boost=0.01)
+    img = np.zeros((200, 100), dtype=float)
+    tile.plot(img, mapdata, "edt", (0, 0), (100, 200), boost=0.01)
+    assert img[20, 20] == 0
+    assert np.max(np.abs(img - brute)) <= math.sqrt(2) / 100
+
+
+def test_plot_classes():
+    roads = [
+        sg.LineString([(100, 100), (50, 50)]),
+        sg.LineString([(10, 10), (20, 20)]),
+    ]
+    mapdata = data.MapData(roads, properties={"fclass": np.array(["b", "a"])})
+    stack = np.zeros((2, 200, 100), dtype=float)
+    classes = tile.plot_classes(stack, mapdata, (0, 0), (100, 200), boost=0.01)
+    assert classes == ["a", "b"]
+    for image, road in zip(stack, roads[::-1]):
+        brute = np.zeros((200, 100), dtype=float)
+        tile.plot(brute, [road], "brute", (0, 0), (100, 200), boost=0.01)
+        assert np.allclose(image, brute)
+
+
 def test_plot_kriging():
     img = np.zeros((200, 100), dtype=float)
     mapdata = [
@@ -35,3 +90,160 @@ def test_plot_kriging():
     assert abs(img[20, 20]) < 1e10
     assert abs(img[21, 21] - math.sqrt(2) / 100) < 1e10
     assert abs(img[21, 20] - 1 / 100) < 1e10
+
+
+def test_plot_kriging_adaptive():
+    img = np.zeros((200, 100), dtype=float)
+    mapdata = [
+        sg.LineString([(100, 100), (50, 50)]),
+        sg.LineString([(10, 10), (20, 20)]),
+    ]
+    tile.plot(
+        img,
+        mapdata,
+        "kriging",
+        (0, 0),
+        (100, 200),
+        boost=0.01,
+        points=200,
+        sampling="adaptive",
+    )
+    assert abs(img[0, 0] - math.sqrt(2 * 10**2) / 100) < 0.05
+    assert abs(img[21, 20] - 1 / 100) < 0.05
+
+
+def test_plot_interpolated():
+    mapdata = [
+        sg.LineString([(100, 100), (50, 50)]),
+        sg.LineString([(10, 10), (20, 20)]),
+    ]
+    brute = np.zeros((200, 100), dtype=float)
+    tile.plot(brute, mapdata, "brute", (0, 0), (100, 200), boost=0.01)
+    for inter_type in ("bilinear", "bicubic", "idw"):
+        img = np.zeros((200, 100), dtype=float)
+        tile.plot(
+            img, mapdata, inter_type, (0, 0), (100, 200), boost=0.01, points=2000
+        )
+        assert np.mean(np.abs(img - brute)) < 0.01
+        assert img.min() >= 0
+
+
+def test_plot_hierarchical():
+    mapdata = [
+        sg.LineString([(100, 100), (50, 50)]),
+        sg.LineString([(10, 10), (20, 20)]),
+    ]
+    for boost, tolerance in ((0.01, 2.0), (0.1, None)):
+        brute = np.zeros((200, 100), dtype=float)
+        tile.plot(brute, mapdata, "brute", (0, 0), (100, 200), boost=boost)
+        img = np.zeros((200, 100), dtype=float)
+        tile.plot(
+            img,
+            mapdata,
+            "hierarchical",
+            (0, 0),
+            (100, 200),
+            boost=boost,
+            tolerance=tolerance,
+        )
+        # by default a pixel diagonal, pixels are 1x1 here
+        bound = (tolerance or math.sqrt(2)) * boost
+        assert np.max(np.abs(img - brute)) <= bound + 1e-9
+
+    # below a pixel, without boost, every pixel is exact
+    brute = np.zeros((200, 100), dtype=float)
+    tile.plot(brute, mapdata, "brute", (0, 0), (100, 200), boost=None)
+    img = np.zeros((200, 100), dtype=float)
+    tile.plot(
+        img, mapdata, "hierarchical", (0, 0), (100, 200), boost=None, tolerance=0.1
+    )
+    assert np.allclose(img, brute)
+
+
+def test_plot_hierarchical_bounded():
+    rng = np.random.default_rng(4)
+    starts = rng.uniform(0, 1, (400, 2))
+    mapdata = [
+        sg.LineString([start, start + rng.normal(0, 0.02, 2)]) for start in starts
+    ]
+    # an odd number of top blocks
+    brute = np.zeros((192, 130), dtype=float)
+    tile.plot(brute, mapdata, "brute", (0.2, 0.8), (0.6, 0.2), boost=None)
+    img = np.zeros((192, 130), dtype=float)
+    tile.plot(img, mapdata, "hierarchical", (0.2, 0.8), (0.6, 0.2), boost=None)
+    pixel = math.hypot(0.4 / 130, 0.6 / 192)
+    assert np.max(np.abs(img - brute)) <= pixel + 1e-9
+
+
+def test_adaptive_samples():
+    mapdata = [
+        sg.LineString([(100, 100), (50, 50)]),
+        sg.LineString([(10, 10), (20, 20)]),
+    ]
+    samples = tile._adaptive_samples(
+        lambda coords: point.distances(mapdata, coords), (0, 0), (100, 200), 300
+    )
+    assert 300 <= len(samples) < 320
+    assert np.allclose(samples[:, 2], point.distances(mapdata, samples[:, :2]))
+    assert np.any(np.all(samples[:, :2] == [100, 200], axis=1))
+
+
+def test_xyz_bounds():
+    ul, lb = tile.xyz_bounds(0, 0, 0)
+    assert ul[0] == -180 and lb[0] == 180
+    assert abs(ul[1] - 85.0511) < 1e-4 and abs(lb[1] + 85.0511) < 1e-4
+    ul, lb = tile.xyz_bounds(1, 1, 0)
+    assert ul == (0, ul[1]) and lb == (180, 0)
+
+
+def test_plan_tiles():
+    tiles = tile.xyz_tiles(1, -10, -10, 10, 10)
+    assert [key for key, _, _ in tiles] == [(0, 0), (1, 0), (0, 1), (1, 1)]
+    assert tiles[3][1:] == tile.xyz_bounds(1, 1, 1)
+    tiles = tile.grid_tiles((0, 10), (10, 0), 4)
+    assert len(tiles) == 9
+    assert tiles[5] == ((2, 1), (8, 6), (12, 2))
+
+
+def test_plot_many():
+    mapdata = [
+        sg.LineString([(1, 1), (9, 5)]),
+        sg.LineString([(2, 9), (3, 4)]),
+    ]
+    tiles = tile.grid_tiles((0, 10), (10, 0), 2.5)
+    images = dict(
+        tile.plot_many(mapdata, "brute", tiles, 20, 20, batch=3, road_value=None)
+    )
+    assert len(images) == 16
+    for key, ul, lb in tiles:
+        img = np.zeros((20, 20), dtype=float)
+        tile.plot(img, mapdata, "brute", ul, lb)
+        assert np.allclose(images[key], img)
+
+
+def test_plot_many_points(monkeypatch):
+    mapdata = [sg.LineString([(1, 1), (9, 5)])]
+    tiles = tile.grid_tiles((0, 10), (10, 0), 5)
+    calls = list()
+
+    def record(image, *args, **options):
+        calls.append((image.shape, options["points"]))
+        return image
+
+    monkeypatch.setattr(tile, "plot", record)
+    # absolute sample counts are per tile, fractions are of the pixels
+    for points, expected in ((50, 200), (0.01, 0.01)):
+        calls.clear()
+        list(tile.plot_many(mapdata, "bilinear", tiles, 20, 20, points=points))
+        assert calls == [((40, 40), expected)]
+
+
+def test_plot_small_tile():
+    mapdata = [sg.LineString([(1, 1), (4, 4)])]
+    brute = np.zeros((5, 5), dtype=float)
+    tile.plot(brute, mapdata, "brute", (0, 5), (5, 0), boost=None)
+    # 1% of the pixels would be no sample at all
+    for inter_type in ("kriging", "bilinear", "bicubic", "idw"):
+        img = np.zeros((5, 5), dtype=float)
+        tile.plot(img, mapdata, inter_type, (0, 5), (5, 0), boost=None)
+        assert np.abs(img - brute).max() < 1.5
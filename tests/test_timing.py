@@ -0,0 +1,44 @@
+import pytest
+
+import roadster.timing as timing
+
+
+def test_stage():
+    seen = list()
+    timing.add_listener(lambda name, seconds: seen.append(name))
+    try:
+        with timing.Recording() as outer:
+            with timing.stage("a"):
+                pass
+            with timing.Recording() as inner:
+                with timing.stage("b"):
+                    pass
+            with pytest.raises(ValueError):
+                with timing.stage("a"):
+                    raise ValueError()
+    finally:
+        timing._listeners.clear()
+
+    assert seen == ["a", "b", "a"]
+    assert [name for name, _ in outer.stages] == ["a", "b", "a"]
+    assert [name for name, _ in inner.stages] == ["b"]
+    assert set(outer.totals()) == {"a", "b"}
+    assert outer.totals()["a"] == pytest.approx(outer.stages[0][1] + outer.stages[2][1])
+
+
+def test_histograms():
+    histograms = timing.Histograms(buckets=(0.1, 1.0))
+    histograms("a", 0.05)
+    histograms("a", 0.5)
+    histograms("a", 5.0)
+    histograms("b", 0.1)
+    assert histograms.count("a") == 3
+    assert histograms.count("c") == 0
+
+    text = histograms.prometheus("seconds", "stage", "Durations.")
+    assert 'seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'seconds_bucket{stage="a",le="1.0"} 2' in text
+    assert 'seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'seconds_bucket{stage="b",le="0.1"} 1' in text
+    assert 'seconds_count{stage="a"} 3' in text
+    assert 'seconds_sum{stage="a"} 5.55' in text
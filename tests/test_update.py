@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import shapely.geometry as sg
+
+import roadster.cache as cache
+import roadster.data as data
+import roadster.pool as pool
+import roadster.raster as raster
+import roadster.tile as tile
+import roadster.update as update
+
+from tests.shapefiles import write_roads
+
+
+def write_osm_roads(map_file, roads):
+    # primary roads, by OSM id
+    write_roads(
+        map_file,
+        list(roads.values()),
+        {"osm_id": list(roads), "fclass": ["primary"] * len(roads)},
+    )
+
+
+def test_diff_maps():
+    old = data.MapData(
+        [sg.LineString([(0, 0), (1, 1)]), sg.LineString([(2, 2), (3, 3)])],
+        properties={"osm_id": np.array([10, 20])},
+    )
+    new = data.MapData(
+        [
+            sg.LineString([(2, 2), (3, 3)]),
+            sg.LineString([(0, 0), (1, 2)]),
+            sg.LineString([(5, 5), (6, 6)]),
+        ],
+        properties={"osm_id": np.array([20, 10, 30])},
+    )
+    changes = update.diff_maps(old, new)
+    assert list(changes.removed) == [0]
+    assert list(changes.added) == [1, 2]
+    assert not changes.everything
+    assert changes.bounds.tolist() == [[0, 0, 1, 1], [0, 0, 1, 2], [5, 5, 6, 6]]
+    assert not update.diff_maps(old, old)
+    assert update.diff_maps(None, new).everything
+
+
+def test_update():
+    folder = tempfile.mkdtemp()
+    map_file = os.path.join(folder, "roads.shp.zip")
+    roads = {
+        1: sg.LineString([(0, 0), (0, 10)]),
+        2: sg.LineString([(10, 0), (10, 10)]),
+        3: sg.LineString([(5, 0), (5, 1)]),
+    }
+    write_osm_roads(map_file, roads)
+    data.prepare_map(map_file, 1)
+    built = raster.build_raster(
+        data.load_map(map_file, 1), os.path.join(folder, "raster"), 0.5
+    )
+    tiles = cache.TileCache(os.path.join(folder, "tiles"))
+    key = cache.TileCache.key(map_file, 1, {"boost": 10})
+    tiles.describe(key, {"boost": 10})
+    idw_key = cache.TileCache.key(map_file, 1, {"boost": 10, "type": "idw"})
+    tiles.describe(idw_key, {"boost": 10, "type": "idw"})
+    for (x, y), _, _ in tile.xyz_tiles(6, 0, 0, 10, 10):
+        tiles.put(key, 6, x, y, b"png")
+        tiles.put(idw_key, 6, x, y, b"png")
+
+    # one road moves, the others stay
+    roads[3] = sg.LineString([(5, 9), (5, 10)])
+    time.sleep(0.01)
+    write_osm_roads(map_file, roads)
+    changes = update.update_map(map_file, 1)
+    assert list(changes.removed) == [2] and list(changes.added) == [2]
+    assert not update.update_map(map_file, 1)
+
+    # tiles away from both versions of the road are kept
+    # interpolated tiles also next to them, their samples reach a tile away
+    assert update.invalidate_tiles(tiles, map_file, 1, changes) == 3 + 6
+    assert tiles.get(key, 6, 32, 30) is None
+    assert tiles.get(key, 6, 33, 30) is not None
+    assert tiles.get(idw_key, 6, 33, 30) is None
+
+    nodes = update.update_raster(built.folder, changes)
+    assert 0 < nodes < built.values.size / 2
+    fresh = raster.build_raster(
+        data.load_map(map_file, 1), os.path.join(folder, "fresh"), 0.5
+    )
+    assert np.allclose(raster.Raster.open(built.folder).values, fresh.values)
+    shutil.rmtree(folder)
+
+
+def test_tile_radius():
+    # the default boosts saturate at a thousandth of a degree, or at 100 metres
+    assert update._tile_radius({}, 0.0) == 0.001
+    assert np.isclose(update._tile_radius({"metres": ""}, 0.0), 100 / 111320.0)
+    assert np.isclose(update._tile_radius({"boost": "100"}, 0.0), 0.01)
+    assert update._tile_radius({"boost": "0"}, 0.0) is None
+
+
+def test_tile_spread():
+    assert update._tile_spread({}, 256) == 0
+    # 26 nodes a side at 1% of the pixels
+    assert update._tile_spread({"type": "bilinear"}, 256) == 255 / 25
+    assert update._tile_spread({"type": "bilinear", "samples": "9"}, 256) == 127.5
+    assert update._tile_spread({"type": "kriging"}, 256) == 256
+
+
+def test_update_pool():
+    folder = tempfile.mkdtemp()
+    map_file = os.path.join(folder, "roads.shp.zip")
+    roads = {1: sg.LineString([(0, 0), (0, 10)])}
+    write_osm_roads(map_file, roads)
+    data.prepare_map(map_file, 1)
+    mapdata = data.load_map(map_file, 1)
+    with pool.DistancePool(1, preload=[mapdata]) as workers:
+        assert np.allclose(workers.distances(mapdata, [(1, 5)]), [1])
+
+        roads[1] = sg.LineString([(0.9, 0), (0.9, 10)])
+        time.sleep(0.01)
+        write_osm_roads(map_file, roads)
+        changes = update.update_map(map_file, 1)
+        assert changes.new.folder == mapdata.folder
+        assert np.allclose(workers.distances(changes.new, [(1, 5)]), [0.1])
+    shutil.rmtree(folder)
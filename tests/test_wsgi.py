@@ -0,0 +1,229 @@
+import http.client
+import io
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+import shapely.geometry as sg
+
+from werkzeug.serving import make_server
+
+import roadster.cache as cache
+import roadster.data as data
+import roadster.jobs as jobs
+import roadster.point as point
+
+from tests.shapefiles import write_roads
+
+import wsgi
+
+
+def test_tile_npy(monkeypatch):
+    mapdata = data.MapData([sg.LineString([(0, 0), (1, 1)])]).build_index()
+    monkeypatch.setattr(wsgi, "maps", cache.MapCache(loader=lambda *args: mapdata))
+    monkeypatch.setattr(data, "_chunk_bytes", 1000)
+
+    # a real server, which writes the response chunks to the socket
+    server = make_server("127.0.0.1", 0, wsgi.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", server.port)
+        connection.request("GET", "/tile/test/0/64/32/1/0/0/1?format=npy&type=brute")
+        response = connection.getresponse()
+        assert response.status == 200
+        assert response.getheader("Content-Type") == data.MIME_TYPES["npy"]
+        body = response.read()
+        assert int(response.getheader("Content-Length")) == len(body)
+        image = np.load(io.BytesIO(body))
+    finally:
+        server.shutdown()
+        thread.join()
+
+    assert image.shape == (32, 64) and image.dtype == np.float32
+    lon, lat = (np.arange(64) + 0.5) / 64, 1 - (np.arange(32) + 0.5) / 32
+    corner = point.distance(mapdata, (lon[-1], lat[-1]))
+    assert abs(image[-1, -1] - corner) < 0.05
+
+
+ROADS = {
+    1: sg.LineString([(0.1, 0.1), (0.9, 0.9)]),
+    2: sg.LineString([(0.1, 0.9), (0.3, 0.7)]),
+}
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    mapdata = data.MapData(
+        list(ROADS.values()),
+        properties={
+            "osm_id": np.array(list(ROADS)),
+            "fclass": np.array(["primary", "residential"]),
+        },
+    ).build_index()
+    monkeypatch.setattr(wsgi, "maps", cache.MapCache(loader=lambda *args: mapdata))
+    monkeypatch.setattr(wsgi, "tiles", cache.TileCache(str(tmp_path / "tiles")))
+    monkeypatch.setattr(wsgi, "jobs", jobs.JobQueue(workers=1))
+    monkeypatch.setattr(wsgi, "rasters_dir", str(tmp_path / "rasters"))
+    return wsgi.app.test_client()
+
+
+def test_point(client):
+    response = client.get("/point/test/1/0.5/0.4")
+    assert response.status_code == 200
+    assert float(response.text) == pytest.approx(
+        point.distance(ROADS.values(), (0.4, 0.5))
+    )
+    response = client.get("/point/test/1/0.1/0.9?max_distance=0.1")
+    assert float(response.text) == 0.1
+
+    response = client.get("/point/test/1/0.5/0.4?classes=residential,motorway")
+    result = response.get_json()
+    assert result["residential"]["osm_id"] == 2
+    assert result["residential"]["distance"] == pytest.approx(
+        point.distance([ROADS[2]], (0.4, 0.5))
+    )
+    assert result["motorway"] == {"distance": None, "osm_id": None}
+
+
+def test_points(client):
+    latlon = [(0.5, 0.4), (0.1, 0.9), (0.0, 0.0)]
+    expected = point.distances(ROADS.values(), np.array(latlon)[:, ::-1])
+
+    response = client.post("/points/test/1", json=latlon)
+    assert response.get_json() == pytest.approx(expected.tolist())
+
+    body = "name,lat,lon\n" + "".join(f"p,{lat},{lon}\n" for lat, lon in latlon)
+    response = client.post("/points/test/1", data=body, content_type="text/csv")
+    assert response.mimetype == "text/csv"
+    lines = response.text.splitlines()
+    assert lines[0] == "distance"
+    assert [float(line) for line in lines[1:]] == pytest.approx(expected.tolist())
+
+    npy = io.BytesIO()
+    np.save(npy, np.array(latlon))
+    response = client.post(
+        "/points/test/1?max_distance=0.2",
+        data=npy.getvalue(),
+        content_type="application/x-npy",
+    )
+    assert response.mimetype == "application/x-npy"
+    dists = np.load(io.BytesIO(response.data))
+    assert dists == pytest.approx(np.minimum(expected, 0.2))
+
+    response = client.post("/points/test/1", data="0.5 0.4", content_type="text/plain")
+    assert response.status_code == 415
+
+
+def test_unknown_format(client):
+    response = client.get("/tile/test/1/16/16/1/0/0/1?format=bmp")
+    assert response.status_code == 400
+    assert response.text == "Unknown format bmp"
+    response = client.post("/jobs/tile/test/1/16/16/1/0/0/1?format=bmp")
+    assert response.status_code == 400
+
+
+def test_xyz_tile(client):
+    url = "/tiles/test/1/8/128/127.png?size=32&type=brute"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert response.headers["Cache-Control"] == f"public, max-age={wsgi.tiles_max_age}"
+    etag = response.get_etag()[0]
+    image = response.data
+    assert wsgi.tiles.misses == 1
+
+    # from the tile cache, unchanged
+    response = client.get(url)
+    assert response.data == image and response.get_etag()[0] == etag
+    assert wsgi.tiles.hits == 1
+    response = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+    assert not response.data
+    response = client.get(url, headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+
+    # other options are other tiles
+    response = client.get("/tiles/test/1/8/128/127.png?size=32&type=brute&boost=10")
+    assert response.status_code == 200 and response.data != image
+    assert client.get("/tiles/test/1/1/2/0.png").status_code == 404
+
+
+def test_jobs(client):
+    url = "/jobs/tile/test/1/16/8/1/0/0/1?type=brute"
+    response = client.post(url)
+    assert response.status_code == 202
+    job = response.get_json()
+    assert response.headers["Location"] == f"/jobs/{job['id']}"
+    # identical requests share the job
+    assert client.post(url).get_json()["id"] == job["id"]
+
+    response = client.get(f"/jobs/{job['id']}?wait=10")
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    direct = client.get("/tile/test/1/16/8/1/0/0/1?type=brute")
+    assert response.data == direct.data
+
+    response = client.post(url.replace("brute", "brute&format=npy"))
+    response = client.get(f"/jobs/{response.get_json()['id']}?wait=10")
+    assert response.mimetype == data.MIME_TYPES["npy"]
+    assert np.load(io.BytesIO(response.data)).shape == (8, 16)
+
+    response = client.delete(f"/jobs/{job['id']}")
+    assert response.get_json()["status"] == "done"
+    assert client.get("/jobs/unknown").status_code == 404
+    assert client.delete("/jobs/unknown").status_code == 404
+
+
+def test_metrics(client):
+    client.get("/point/test/1/0.5/0.4")
+    client.get("/point/test/1/0.5/0.4")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "text/plain; version=0.0.4"
+
+    samples = dict()
+    for line in response.text.splitlines():
+        if line.startswith("# "):
+            assert line.split()[1] in ("HELP", "TYPE")
+            continue
+        name, value = line.rsplit(" ", 1)
+        samples[name] = float(value)
+    assert samples["roadster_map_cache_hits_total"] == 1
+    assert samples["roadster_map_cache_misses_total"] == 1
+    assert samples["roadster_map_cache_hit_ratio"] == 0.5
+    assert samples["roadster_map_cache_bytes"] > 0
+    assert samples["roadster_jobs_pending"] == 0
+    assert samples['roadster_request_seconds_count{endpoint="point"}'] >= 2
+    assert "# TYPE roadster_request_seconds histogram" in response.text
+
+
+def test_update(client, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(wsgi, "maps", cache.MapCache())
+    os.makedirs("download")
+    map_file = os.path.join("download", "test.shp.zip")
+
+    def write(roads):
+        properties = {"osm_id": list(roads), "fclass": ["primary"] * len(roads)}
+        write_roads(map_file, list(roads.values()), properties)
+
+    write(ROADS)
+    result = client.post("/update/test/1").get_json()
+    assert result["everything"] and result["added"] == 2
+    assert json.loads(client.post("/update/test/1").data)["added"] == 0
+
+    url = "/tiles/test/1/8/128/127.png?size=16&type=brute&boost=1"
+    before = client.get(url).data
+    assert float(client.get("/point/test/1/0.1/0.9").text) == pytest.approx(
+        0.4 * 2**0.5
+    )
+    write({**ROADS, 3: sg.LineString([(0.5, 0.1), (0.9, 0.1)])})
+    result = client.post("/update/test/1").get_json()
+    assert not result["everything"]
+    assert (result["removed"], result["added"], result["tiles"]) == (0, 1, 1)
+    # the map is loaded again and the tile computed again
+    assert float(client.get("/point/test/1/0.1/0.9").text) == 0
+    assert client.get(url).data != before
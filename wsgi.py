@@ -1,41 +1,180 @@
+import io
+import itertools
 import os
-import threading
+import time
 
-from flask import Flask, request, make_response
+from flask import Flask, g, request, make_response, jsonify
 
 import roadster
 
-import imageio as iio
-from skimage import img_as_ubyte
+import numpy as np
 
 app = Flask(__name__)
 
-threadLocal = threading.local()
+# maps are shared by all threads, prepared maps are memory-mapped so separate
+# server processes share the same physical copy of their arrays (each process
+# still builds its own geometries and index)
+maps = roadster.cache.MapCache(
+    max_bytes=int(os.environ.get("ROADSTER_MAP_CACHE_MB", 2048)) << 20
+)
 
 
-def get_mapdata(mapname, road_layer):
-    global threadLocal
+# long-lived pool shared by all requests, ROADSTER_PROCESSES=0 computes in-process
+_processes = int(os.environ.get("ROADSTER_PROCESSES", 0))
+distance_pool = roadster.pool.DistancePool(_processes) if _processes else None
+
+tiles = roadster.cache.TileCache(os.environ.get("ROADSTER_TILE_CACHE", "tiles"))
+tiles_max_age = int(os.environ.get("ROADSTER_TILE_MAX_AGE", 86400))
+
+# precomputed rasters, see roadster-build-raster
+rasters_dir = os.environ.get("ROADSTER_RASTERS", "rasters")
+rasters = dict()
+
+
+def get_raster(name):
+    """The raster in `rasters_dir` with the given name, None for no name."""
+    if not name:
+        return None
+    name = os.path.basename(name)
+    if name not in rasters:
+        rasters[name] = roadster.raster.Raster.open(os.path.join(rasters_dir, name))
+    return rasters[name]
+
+
+# tiles computed in the background, see /jobs
+jobs = roadster.jobs.JobQueue(
+    workers=int(os.environ.get("ROADSTER_JOB_WORKERS", 2)),
+    max_pending=int(os.environ.get("ROADSTER_JOB_QUEUE", 64)),
+    abandon_after=float(os.environ.get("ROADSTER_JOB_ABANDON", 60)),
+)
+jobs_max_wait = 30.0
+
+# durations of the stages (see roadster.timing) and of the requests, for /metrics
+stage_seconds = roadster.timing.Histograms()
+roadster.timing.add_listener(stage_seconds)
+request_seconds = roadster.timing.Histograms()
+
+
+@app.before_request
+def start_timing():
+    g.started = time.perf_counter()
+    g.recording = roadster.timing.Recording().__enter__()
 
+
+@app.after_request
+def add_timing(response):
+    """Report the stages of the request in a Server-Timing header."""
+    recording = getattr(g, "recording", None)
+    if recording is not None:
+        timings = [
+            f"{name};dur={seconds * 1000:.1f}"
+            for name, seconds in recording.totals().items()
+        ]
+        timings.append(f"total;dur={(time.perf_counter() - g.started) * 1000:.1f}")
+        response.headers.set("Server-Timing", ", ".join(timings))
+    return response
+
+
+@app.teardown_request
+def stop_timing(error=None):
+    recording = g.pop("recording", None)
+    if recording is not None:
+        recording.__exit__(None, None, None)
+        request_seconds.observe(
+            request.endpoint or "unknown", time.perf_counter() - g.started
+        )
+
+
+def get_mapdata(mapname, road_layer):
     road_type = request.args.get("road_type", "all")
-    mapstr = f"{mapname}:{road_layer}:{road_type}"
-    maps = getattr(threadLocal, "maps", None)
-    if maps is None:
-        maps = dict()
-        threadLocal.maps = maps
-    if mapstr not in maps:
-        mapdata = roadster.data.load_map(mapname, road_layer, set([road_type]))
-        print(f"loaded {mapstr}")
-        maps[mapstr] = mapdata
-    else:
-        mapdata = maps[mapstr]
+    return maps.get(mapname, road_layer, set([road_type]))
+
+
+def max_distance_of(args):
+    """The `max_distance` argument as a float, None if not given."""
+    max_distance = args.get("max_distance")
+    return None if max_distance is None else float(max_distance)
+
+
+def distances(mapdata, coords):
+    options = dict(
+        metres="metres" in request.args,
+        raster=get_raster(request.args.get("raster")),
+        max_distance=max_distance_of(request.args),
+    )
+    if distance_pool is None:
+        return roadster.point.distances(mapdata, coords, **options)
+    return distance_pool.distances(mapdata, coords, **options)
+
+
+def render_tile(mapdata, tile_width, tile_height, ul, lb, args=None):
+    """Render a tile as an iterable of bytes chunks, using the rendering options in
+    `args`.
+
+    By default, the options are the arguments of the current request. The tile is
+    encoded in their `format` (see `data.encode_image`, PNG by default), the raw
+    formats keep the distances, without boost or roads.
+    """
+    if args is None:
+        args = request.args
+    image_format = args.get("format", "png")
+    raw = image_format in roadster.data.RAW_FORMATS
+    zero_roads = args.get("zero_roads", False)
+    line_width = int(args.get("line_width", 1))
+    antialias = "antialias" in args
+    type_ = args.get("type", "auto")
+    samples = float(args.get("samples", 0.01))
+    boost = float(args.get("boost", roadster.data.default_boost("metres" in args)))
+    sampling = args.get("sampling", "uniform")
+    tolerance = args.get("tolerance")
+    image = roadster.data.create_image(tile_width, tile_height)
+    roadster.tile.plot(
+        image,
+        mapdata,
+        type_,
+        ul,
+        lb,
+        points=samples,
+        boost=None if raw else boost,
+        pool=distance_pool,
+        sampling=sampling,
+        tolerance=None if tolerance is None else float(tolerance),
+        metres="metres" in args,
+        raster=get_raster(args.get("raster")),
+        max_distance=max_distance_of(args),
+    )
+    if not raw:
+        roadster.data.plot_roads(
+            image,
+            mapdata,
+            ul,
+            lb,
+            road_value=0.0 if zero_roads else 1.0,
+            width=line_width,
+            antialias=antialias,
+        )
+
+    with roadster.timing.stage(f"{image_format}_encode"):
+        return roadster.data.encode_image(image, image_format, ul, lb)
 
-    return mapdata
+
+def unknown_format(args):
+    """The error response for an unknown tile `format`, None if it is known."""
+    image_format = args.get("format", "png")
+    if image_format in roadster.data.IMAGE_FORMATS:
+        return None
+    return f"Unknown format {image_format}", 400
 
 
 @app.route(
     "/tile/<mapname>/<int:road_layer>/<int:tile_width>/<int:tile_height>/<wnlat>/<wnlon>/<eslat>/<eslon>"
 )
 def tile(mapname, road_layer, tile_width, tile_height, wnlat, wnlon, eslat, eslon):
+    """The tile between the two corners, as a PNG or, with `format`, a 16-bit PNG
+    (`png16`) or the raw distances (`npy` or `tiff`), streamed as computed."""
+    error = unknown_format(request.args)
+    if error is not None:
+        return error
     mapdata = get_mapdata(mapname, road_layer)
 
     wnlat = float(wnlat)
@@ -43,43 +182,319 @@ def tile(mapname, road_layer, tile_width, tile_height, wnlat, wnlon, eslat, eslo
     eslat = float(eslat)
     eslon = float(eslon)
 
-    print(tile_width, tile_height)
-
-    zero_roads = request.args.get("zero_roads", False)
-    type_ = request.args.get("type", "auto")
-    samples = float(request.args.get("samples", 0.01))
-    boost = float(request.args.get("boost", 1000.0))
-    image = roadster.data.create_image(tile_width, tile_height)
-    roadster.tile.plot(
-        image,
-        mapdata,
-        type_,
-        (wnlon, wnlat),
-        (eslon, eslat),
-        points=samples,
-        boost=boost,
-    )
-    roadster.data.plot_roads(
-        image,
-        mapdata,
-        (wnlon, wnlat),
-        (eslon, eslat),
-        road_value=0.0 if zero_roads else 1.0,
+    image_format = request.args.get("format", "png")
+    chunks = render_tile(
+        mapdata, tile_width, tile_height, (wnlon, wnlat), (eslon, eslat)
     )
+    if image_format == "npy":
+        # the header, then the float32 array a slice at a time as it is sent
+        header = next(chunks)
+        length = len(header) + tile_width * tile_height * np.float32().itemsize
+        chunks = itertools.chain([header], chunks)
+    else:
+        length = sum(len(chunk) for chunk in chunks)
+    response = make_response(iter(chunks))
+    response.headers.set("Content-Type", roadster.data.MIME_TYPES[image_format])
+    response.headers.set("Content-Length", length)
+    return response
+
+
+def job_status(job, code=200):
+    response = jsonify({"id": job.id, "status": job.status, "error": job.error})
+    response.status_code = code
+    response.headers.set("Location", f"/jobs/{job.id}")
+    return response
+
+
+@app.route(
+    "/jobs/tile/<mapname>/<int:road_layer>/<int:tile_width>/<int:tile_height>/<wnlat>/<wnlon>/<eslat>/<eslon>",
+    methods=["POST"],
+)
+def tile_job(mapname, road_layer, tile_width, tile_height, wnlat, wnlon, eslat, eslon):
+    """Queue the computation of a tile, same arguments as `/tile`.
+
+    Answers right away with the job id, identical requests share the same job.
+    """
+    error = unknown_format(request.args)
+    if error is not None:
+        return error
+    args = request.args.to_dict()
+    ul = (float(wnlon), float(wnlat))
+    lb = (float(eslon), float(eslat))
+    key = (mapname, road_layer, tile_width, tile_height, ul, lb)
+    key += tuple(sorted(args.items()))
+
+    def work():
+        road_type = args.get("road_type", "all")
+        mapdata = maps.get(mapname, road_layer, set([road_type]))
+        chunks = render_tile(mapdata, tile_width, tile_height, ul, lb, args)
+        return b"".join(chunks), roadster.data.MIME_TYPES[args.get("format", "png")]
+
+    try:
+        job = jobs.submit(key, work)
+    except roadster.jobs.QueueFull as e:
+        response = make_response(str(e), 503)
+        response.headers.set("Retry-After", "5")
+        return response
+    return job_status(job, 202)
+
 
-    print("generated")
+@app.route("/jobs/<job_id>")
+def get_job(job_id):
+    """The tile once the job is done, its status otherwise.
 
-    image_binary = iio.imwrite("<bytes>", img_as_ubyte(image), format="PNG")
-    response = make_response(image_binary)
-    response.headers.set("Content-Type", "image/png")
+    With `wait`, waits up to that many seconds (at most 30) for the job to finish
+    before answering.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return "Unknown job", 404
+    wait = min(float(request.args.get("wait", 0)), jobs_max_wait)
+    if wait > 0:
+        job.wait(wait)
+    if job.status == "done":
+        content, mime_type = job.result
+        response = make_response(content)
+        response.headers.set("Content-Type", mime_type)
+        return response
+    if job.status == "failed":
+        return job_status(job, 500)
+    if job.status == "cancelled":
+        return job_status(job, 410)
+    return job_status(job, 202)
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return "Unknown job", 404
+    return job_status(job)
+
+
+@app.route("/tiles/<mapname>/<int:road_layer>/<int:z>/<int:x>/<int:y>.png")
+def xyz_tile(mapname, road_layer, z, x, y):
+    """Tiles on the standard Web Mercator z/x/y grid, cached on disk."""
+    if not 0 <= x < 2**z or not 0 <= y < 2**z:
+        return "Tile outside of the grid", 404
+    size = int(request.args.get("size", 256))
+    options = {
+        name: request.args.get(name)
+        for name in (
+            "road_type",
+            "zero_roads",
+            "type",
+            "samples",
+            "sampling",
+            "boost",
+            "tolerance",
+            "line_width",
+            "antialias",
+            "metres",
+            "raster",
+            "max_distance",
+        )
+        if name in request.args
+    }
+    options["size"] = size
+    key = roadster.cache.TileCache.key(mapname, road_layer, options)
+
+    image_binary = tiles.get(key, z, x, y)
+    if image_binary is None:
+        mapdata = get_mapdata(mapname, road_layer)
+        ul, lb = roadster.tile.xyz_bounds(z, x, y)
+        args = {**request.args.to_dict(), "format": "png"}
+        image_binary = b"".join(render_tile(mapdata, size, size, ul, lb, args))
+        tiles.describe(key, options)
+        tiles.put(key, z, x, y, image_binary)
+
+    etag = roadster.cache.TileCache.etag(image_binary)
+    if etag in request.if_none_match:
+        response = make_response("", 304)
+    else:
+        response = make_response(image_binary)
+        response.headers.set("Content-Type", "image/png")
+    response.set_etag(etag)
+    response.headers.set("Cache-Control", f"public, max-age={tiles_max_age}")
     return response
 
 
 @app.route("/point/<mapname>/<int:road_layer>/<lat>/<lon>")
 def point(mapname, road_layer, lat, lon):
+    """Distance to the closest road.
+
+    With `classes` (comma separated road types, all of them if empty), a JSON
+    object with the distance to the closest road of each type and its OSM id.
+    """
+    mapdata = get_mapdata(mapname, road_layer)
+
+    if "classes" in request.args:
+        if "fclass" not in mapdata.properties:
+            return "The map has no road types", 400
+        classes = [name for name in request.args["classes"].split(",") if name]
+        classes = classes or sorted(set(mapdata.properties["fclass"]))
+        dists, nearest = roadster.point.class_distances(
+            mapdata,
+            [(float(lon), float(lat))],
+            classes,
+            nearest=True,
+            metres="metres" in request.args,
+            max_distance=max_distance_of(request.args),
+        )
+        ids = mapdata.properties.get("osm_id")
+        result = dict()
+        for column, name in enumerate(classes):
+            road = nearest[0, column]
+            result[name] = {
+                "distance": (
+                    float(dists[0, column]) if np.isfinite(dists[0, column]) else None
+                ),
+                "osm_id": int(ids[road]) if ids is not None and road >= 0 else None,
+            }
+        return jsonify(result)
+
+    return str(
+        roadster.point.distance(
+            mapdata,
+            (float(lon), float(lat)),
+            metres="metres" in request.args,
+            raster=get_raster(request.args.get("raster")),
+            max_distance=max_distance_of(request.args),
+        )
+    )
+
+
+@app.route("/points/<mapname>/<int:road_layer>", methods=["POST"])
+def points(mapname, road_layer):
+    """Distances for many coordinates, the response uses the same format as the body.
+
+    The body is either JSON (a list of [lat, lon] pairs), CSV (with a header
+    including `lat` and `lon` columns, names can be changed with the `lat_column`
+    and `lon_column` arguments) or a NumPy `.npy` array of lat/lon rows.
+    """
     mapdata = get_mapdata(mapname, road_layer)
 
-    return str(roadster.point.distance(mapdata, (float(lon), float(lat))))
+    if request.mimetype == "application/json":
+        latlon = np.asarray(request.get_json(), dtype=float).reshape(-1, 2)
+        dists = distances(mapdata, latlon[:, ::-1])
+        return jsonify(dists.tolist())
+
+    if request.mimetype == "text/csv":
+        chunks = roadster.data.read_csv_coords(
+            io.StringIO(request.get_data(as_text=True)),
+            lat_column=request.args.get("lat_column", "lat"),
+            lon_column=request.args.get("lon_column", "lon"),
+        )
+        result = io.StringIO()
+        result.write("distance\n")
+        for _, _, coords in chunks:
+            for dist in distances(mapdata, coords):
+                result.write(f"{dist}\n")
+        response = make_response(result.getvalue())
+        response.headers.set("Content-Type", "text/csv")
+        return response
+
+    if request.mimetype in ("application/x-npy", "application/octet-stream"):
+        latlon = np.load(io.BytesIO(request.get_data())).reshape(-1, 2)
+        result = io.BytesIO()
+        np.save(result, distances(mapdata, latlon[:, ::-1]))
+        response = make_response(result.getvalue())
+        response.headers.set("Content-Type", "application/x-npy")
+        return response
+
+    return f"Unsupported content type {request.mimetype}", 415
+
+
+@app.route("/update/<mapname>/<int:road_layer>", methods=["POST"])
+def update_map(mapname, road_layer):
+    """Update the prepared map from a new version of its shape file.
+
+    Only the cached tiles and the nodes of the rasters (built from this map, see
+    `roadster-build-raster`) the changed roads can affect are dropped or computed
+    again.
+    """
+    road_type = request.args.get("road_type", "all")
+    changes = roadster.update.update_map(mapname, road_layer, set([road_type]))
+    maps.drop(mapname, road_layer)
+    result = {
+        "everything": changes.everything,
+        "removed": len(changes.removed),
+        "added": len(changes.added),
+        "tiles": roadster.update.invalidate_tiles(tiles, mapname, road_layer, changes),
+        "rasters": dict(),
+    }
+    source = {"map": mapname, "road_layer": road_layer, "road_type": road_type}
+    if changes and os.path.isdir(rasters_dir):
+        for name in sorted(os.listdir(rasters_dir)):
+            if not os.path.exists(os.path.join(rasters_dir, name, "raster.json")):
+                continue
+            raster = get_raster(name)
+            if raster.source != source:
+                continue
+            result["rasters"][name] = roadster.update.update_raster(
+                raster.folder, changes, pool=distance_pool
+            )
+            rasters.pop(name)
+    return jsonify(result)
+
+
+@app.route("/metrics")
+def metrics():
+    """Stage and request durations and cache statistics, in the Prometheus format."""
+    lines = [
+        stage_seconds.prometheus(
+            "roadster_stage_seconds", "stage", "Time spent in each stage."
+        ),
+        request_seconds.prometheus(
+            "roadster_request_seconds", "endpoint", "Time spent answering requests."
+        ),
+    ]
+
+    def metric(name, kind, value, help_text):
+        lines.append(
+            f"# HELP {name} {help_text}\n# TYPE {name} {kind}\n{name} {value}\n"
+        )
+
+    def hit_ratio(cache):
+        lookups = cache.hits + cache.misses
+        return cache.hits / lookups if lookups else 0.0
+
+    metric(
+        "roadster_map_cache_hits_total",
+        "counter",
+        maps.hits,
+        "Maps found in the cache.",
+    )
+    metric("roadster_map_cache_misses_total", "counter", maps.misses, "Maps loaded.")
+    metric(
+        "roadster_map_cache_evictions_total", "counter", maps.evictions, "Maps evicted."
+    )
+    metric(
+        "roadster_map_cache_hit_ratio", "gauge", hit_ratio(maps), "Map cache hit ratio."
+    )
+    metric(
+        "roadster_map_cache_bytes",
+        "gauge",
+        maps.nbytes,
+        "Memory used by the cached maps.",
+    )
+    metric(
+        "roadster_tile_cache_hits_total", "counter", tiles.hits, "Tiles found on disk."
+    )
+    metric(
+        "roadster_tile_cache_misses_total", "counter", tiles.misses, "Tiles rendered."
+    )
+    metric(
+        "roadster_tile_cache_hit_ratio",
+        "gauge",
+        hit_ratio(tiles),
+        "Tile cache hit ratio.",
+    )
+    metric("roadster_jobs_pending", "gauge", jobs.pending, "Jobs waiting to run.")
+
+    response = make_response("".join(lines))
+    response.headers.set("Content-Type", "text/plain; version=0.0.4")
+    return response
 
 
 @app.route("/")